@@ -0,0 +1,65 @@
+"""
+Compares building a new boto3 S3 resource per request (the old get_architecture_storage behaviour) with
+reusing the application-scoped S3ClientRegistry.
+
+Runs against moto's in-process S3 so it needs no network, which isolates the client setup overhead.
+Against real S3 the per-request path also pays a TLS handshake for every new connection pool.
+
+    PYTHONPATH=. python benchmarks/s3_clients.py [requests]
+"""
+
+import os
+import sys
+import time
+
+import boto3
+from moto import mock_aws
+
+from src.state_manager.architecture_storage import ArchitectureStorage
+from src.util.aws.s3_clients import S3ClientRegistry, s3_client_config
+
+BUCKET = "benchmark-bucket"
+
+
+def new_resource():
+    return boto3.session.Session().resource(
+        "s3", region_name="us-east-1", config=s3_client_config()
+    )
+
+
+def per_request(n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        storage = ArchitectureStorage(bucket=new_resource().Bucket(BUCKET))
+        storage._bucket.Object("state.json").get()["Body"].read()
+    return time.perf_counter() - start
+
+
+def pooled(n: int) -> float:
+    registry = S3ClientRegistry(new_resource)
+    registry.warm(BUCKET)
+    start = time.perf_counter()
+    for _ in range(n):
+        storage = ArchitectureStorage(bucket=registry.bucket(BUCKET))
+        storage._bucket.Object("state.json").get()["Body"].read()
+    return time.perf_counter() - start
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+    with mock_aws():
+        bucket = new_resource().create_bucket(Bucket=BUCKET)
+        bucket.put_object(Key="state.json", Body=b"{}")
+        pooled(5)  # warm imports and moto
+        per_request_s = per_request(n)
+        pooled_s = pooled(n)
+    print(f"requests:    {n}")
+    print(f"per-request: {per_request_s / n * 1000:.2f} ms/request")
+    print(f"pooled:      {pooled_s / n * 1000:.2f} ms/request")
+    print(f"overhead removed: {(per_request_s - pooled_s) / n * 1000:.2f} ms/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Compares the legacy jsons-encoded state.json with the binary state format: encoded size, encode time and
+decode time, on synthetic states of increasing size.
+
+    PYTHONPATH=. python benchmarks/state_format.py [--sizes 1000,5000,20000] [--levels 1,6,9]
+"""
+
+import argparse
+import time
+
+import jsons
+import yaml
+
+from src.engine_service.engine_commands.run import RunEngineResult
+from src.state_manager.state_format import decode_state, encode_state
+
+TYPES = ["lambda_function", "iam_role", "s3_bucket", "rds_instance", "vpc", "subnet"]
+
+
+def synthetic_state(size: int) -> RunEngineResult:
+    ids = [f"aws:{TYPES[i % len(TYPES)]}:resource-{i}" for i in range(size)]
+    resources = yaml.dump(
+        {
+            "resources": {
+                id: {"Name": id, "Tags": {"env": "prod"}, "MemorySize": 128}
+                for id in ids
+            },
+            "edges": {
+                f"{id} -> {ids[i // 2]}": None for i, id in enumerate(ids[1:], 1)
+            },
+        }
+    )
+    topology = yaml.dump(
+        {"provider": "aws", "resources": {id.split(":", 1)[1]: None for id in ids}}
+    )
+    return RunEngineResult(
+        resources_yaml=resources, topology_yaml=topology, iac_topology=resources
+    )
+
+
+def timed(fn, runs: int = 5) -> float:
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return (time.perf_counter() - start) / runs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,5000,20000")
+    parser.add_argument("--levels", default="1,6,9")
+    args = parser.parse_args()
+
+    print(f"{'resources':>10} {'format':>8} {'KiB':>8} {'encode':>9} {'decode':>9}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        state = synthetic_state(size)
+        legacy = bytes(jsons.dumps(state), "utf-8")
+        encode_s = timed(lambda: bytes(jsons.dumps(state), "utf-8"))
+        decode_s = timed(lambda: jsons.loads(legacy))
+        print(
+            f"{size:>10} {'jsons':>8} {len(legacy) / 1024:>8.0f} {encode_s * 1000:>7.1f}ms {decode_s * 1000:>7.1f}ms"
+        )
+        for level in [int(l) for l in args.levels.split(",")]:
+            encoded = encode_state(state, state_format="binary", level=level)
+            encode_s = timed(lambda: encode_state(state, "binary", level))
+            decode_s = timed(lambda: decode_state(encoded))
+            print(
+                f"{size:>10} {f'zlib-{level}':>8} {len(encoded) / 1024:>8.0f} {encode_s * 1000:>7.1f}ms {decode_s * 1000:>7.1f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
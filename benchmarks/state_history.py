@@ -0,0 +1,90 @@
+"""
+Compares full and delta encoded state history on a long version history where every version changes a
+few resources: objects and bytes stored, write time, and read time of every version without a cache.
+
+Runs against moto's in-process S3, so times only reflect request counts and encoding work.
+
+    PYTHONPATH=. python benchmarks/state_history.py [--versions 200] [--resources 2000] [--changes 3]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import time
+from unittest import mock
+
+import boto3
+from moto import mock_aws
+
+from benchmarks.state_format import synthetic_state
+from src.environment_management.models import EnvironmentVersion
+from src.state_manager.architecture_storage import ArchitectureStorage
+
+
+def history(versions: int, resources: int, changes: int):
+    rng = random.Random(1)
+    state = synthetic_state(resources)
+    lines = state.resources_yaml.splitlines(keepends=True)
+    sizes = [i for i, line in enumerate(lines) if "MemorySize" in line]
+    states = []
+    for version in range(versions):
+        for i in rng.sample(sizes, changes):
+            lines[i] = f"    MemorySize: {128 + version}\n"
+        resources_yaml = "".join(lines)
+        states.append(
+            state._replace(resources_yaml=resources_yaml, iac_topology=resources_yaml)
+        )
+    return states
+
+
+async def run(mode: str, states, bucket_name: str):
+    bucket = boto3.resource("s3", region_name="us-east-1").create_bucket(
+        Bucket=bucket_name
+    )
+    storage = ArchitectureStorage(bucket)
+    versions = []
+    with mock.patch("src.state_manager.state_format.STATE_HISTORY", mode):
+        start = time.perf_counter()
+        base = None
+        for version, state in enumerate(states):
+            ev = EnvironmentVersion(
+                architecture_id="arch", id="prod", version=version, version_hash=""
+            )
+            ev.state_location = await storage.write_state_to_fs(ev, state, base=base)
+            versions.append(ev)
+            base = ev
+        write = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for ev, state in zip(versions, states):
+        assert await storage.get_state_from_fs(ev) == state
+    read = time.perf_counter() - start
+    objects = list(bucket.objects.all())
+    return write, read, len(objects), sum(o.size for o in objects)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--versions", type=int, default=200)
+    parser.add_argument("--resources", type=int, default=2000)
+    parser.add_argument("--changes", type=int, default=3)
+    args = parser.parse_args()
+
+    states = history(args.versions, args.resources, args.changes)
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+    print(f"{'history':>8} {'objects':>8} {'MiB':>8} {'write':>10} {'read':>10}")
+    with mock_aws():
+        for mode in ("full", "delta"):
+            write, read, count, size = asyncio.run(
+                run(mode, states, f"benchmark-{mode}")
+            )
+            print(
+                f"{mode:>8} {count:>8} {size / 2**20:>8.2f} {write / len(states) * 1000:>8.1f}ms "
+                f"{read / len(states) * 1000:>8.1f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
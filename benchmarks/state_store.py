@@ -0,0 +1,73 @@
+"""
+Compares the per-version and content-addressed state stores on a version history where most writes
+repeat an earlier state (promotes that change nothing, undo/redo, clones): objects and bytes stored, and
+write time.
+
+Runs against moto's in-process S3, so write times only reflect request counts and encoding work.
+
+    PYTHONPATH=. python benchmarks/state_store.py [--versions 200] [--resources 2000] [--repeat 0.8]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import time
+from unittest import mock
+
+import boto3
+from moto import mock_aws
+
+from benchmarks.state_format import synthetic_state
+from src.environment_management.models import EnvironmentVersion
+from src.state_manager.architecture_storage import ArchitectureStorage
+
+
+async def write_history(store: str, states, bucket_name: str) -> tuple[float, int, int]:
+    bucket = boto3.resource("s3", region_name="us-east-1").create_bucket(
+        Bucket=bucket_name
+    )
+    storage = ArchitectureStorage(bucket)
+    with mock.patch("src.state_manager.state_format.STATE_STORE", store):
+        start = time.perf_counter()
+        for version, state in enumerate(states):
+            ev = EnvironmentVersion(
+                architecture_id="arch", id="prod", version=version, version_hash=""
+            )
+            await storage.write_state_to_fs(ev, state)
+        elapsed = time.perf_counter() - start
+    objects = list(bucket.objects.all())
+    return elapsed, len(objects), sum(o.size for o in objects)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--versions", type=int, default=200)
+    parser.add_argument("--resources", type=int, default=2000)
+    parser.add_argument("--repeat", type=float, default=0.8)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    base = synthetic_state(args.resources)
+    states = []
+    for version in range(args.versions):
+        if states and rng.random() < args.repeat:
+            states.append(rng.choice(states))
+        else:
+            states.append(base._replace(iac_topology=f"{base.iac_topology}# {version}"))
+
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+    print(f"{'store':>8} {'objects':>8} {'MiB':>8} {'write':>10}")
+    with mock_aws():
+        for store in ("version", "cas"):
+            elapsed, count, size = asyncio.run(
+                write_history(store, states, f"benchmark-{store}")
+            )
+            print(
+                f"{store:>8} {count:>8} {size / 2**20:>8.1f} {elapsed / len(states) * 1000:>8.1f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
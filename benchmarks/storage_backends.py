@@ -0,0 +1,78 @@
+"""
+Compares state and iac I/O through ArchitectureStorage on moto's in-process S3 and on the local disk
+backend: time to write and read back a state, and to stream a large iac archive.
+
+    PYTHONPATH=. python benchmarks/storage_backends.py [--resources 2000] [--runs 50] [--iac-mib 16]
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import boto3
+from moto import mock_aws
+
+from benchmarks.state_format import synthetic_state
+from src.environment_management.models import EnvironmentVersion
+from src.state_manager.architecture_storage import ArchitectureStorage
+from src.util.storage import LocalStorage
+
+
+async def measure(bucket, state, runs: int, iac: bytes) -> tuple[float, float, float]:
+    storage = ArchitectureStorage(bucket)
+    versions = []
+    start = time.perf_counter()
+    for version in range(runs):
+        ev = EnvironmentVersion(
+            architecture_id="arch", id="prod", version=version, version_hash=""
+        )
+        ev.state_location = await storage.write_state_to_fs(
+            ev, state._replace(iac_topology=f"# {version}")
+        )
+        versions.append(ev)
+    write = (time.perf_counter() - start) / runs
+
+    start = time.perf_counter()
+    for ev in versions:
+        await storage.get_state_from_fs(ev)
+    read = (time.perf_counter() - start) / runs
+
+    ev = versions[0]
+    ev.iac_location = await storage.write_iac_to_fs(ev, iac)
+    start = time.perf_counter()
+    stream = await storage.get_iac_stream(ev)
+    async for _ in stream:
+        pass
+    return write, read, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resources", type=int, default=2000)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--iac-mib", type=int, default=16)
+    args = parser.parse_args()
+
+    state = synthetic_state(args.resources)
+    iac = os.urandom(args.iac_mib * 2**20)
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+    print(f"{'backend':>8} {'write':>10} {'read':>10} {'iac':>10}")
+    with mock_aws():
+        bucket = boto3.resource("s3", region_name="us-east-1").create_bucket(
+            Bucket="benchmark"
+        )
+        results = {"moto s3": asyncio.run(measure(bucket, state, args.runs, iac))}
+    with tempfile.TemporaryDirectory() as root:
+        bucket = LocalStorage(root).Bucket("benchmark")
+        results["local"] = asyncio.run(measure(bucket, state, args.runs, iac))
+    for backend, (write, read, iac_time) in results.items():
+        print(
+            f"{backend:>8} {write * 1000:>8.2f}ms {read * 1000:>8.2f}ms {iac_time * 1000:>8.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
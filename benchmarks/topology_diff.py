@@ -0,0 +1,99 @@
+"""
+Benchmarks Topology.diff_topology on synthetic architectures, against the previous list-scanning
+implementation which is quadratic in the number of resources.
+
+    PYTHONPATH=. python benchmarks/topology_diff.py [--sizes 1000,10000,50000] [--legacy-max 2000]
+
+The legacy implementation is only run up to --legacy-max resources, beyond that it takes minutes.
+"""
+
+import argparse
+import random
+import time
+
+from src.topology.edge import Edge
+from src.topology.resource import Resource, ResourceID
+from src.topology.topology import Diff, DiffStatus, Topology, TopologyDiff
+
+TYPES = ["lambda_function", "iam_role", "s3_bucket", "rds_instance", "vpc", "subnet"]
+
+
+def synthetic_topology(size: int, seed: int, churn: float = 0.05) -> Topology:
+    """A topology of roughly size resources, each with edges to a few earlier resources."""
+    rng = random.Random(seed)
+    ids = [
+        ResourceID("aws", TYPES[i % len(TYPES)], None, f"resource-{i}")
+        for i in range(size)
+        if rng.random() > churn
+    ]
+    resources = [
+        Resource(id, {"Name": id.name, "Tags": {"size": str(rng.randint(0, 3))}})
+        for id in ids
+    ]
+    edges = [
+        Edge(id, ids[rng.randrange(i)])
+        for i, id in enumerate(ids[1:], start=1)
+        for _ in range(2)
+    ]
+    return Topology(resources, edges)
+
+
+def legacy_diff(self: Topology, other: Topology, include_properties_diff=False):
+    resource_diffs = {}
+    edge_diffs = {}
+    for id in set([r.id for r in self.resources]).union(
+        [r.id for r in other.resources]
+    ):
+        if id not in [r.id for r in self.resources]:
+            resource_diffs[id] = Diff(
+                DiffStatus.ADDED,
+                target=id,
+                properties=next(r for r in other.resources if r.id == id).properties,
+            )
+        elif id not in [r.id for r in other.resources]:
+            resource_diffs[id] = Diff(DiffStatus.REMOVED, target=id)
+        elif include_properties_diff:
+            current_resource = next(r for r in self.resources if r.id == id)
+            previous_resource = next(r for r in other.resources if r.id == id)
+            diff_properties = current_resource.diff_properties(previous_resource)
+            if diff_properties:
+                resource_diffs[id] = Diff(
+                    DiffStatus.CHANGED, properties=diff_properties
+                )
+    for edge in set(self.edges).union(other.edges):
+        if edge not in self.edges:
+            edge_diffs[edge.source] = Diff(DiffStatus.ADDED, target=edge.target)
+        elif edge not in other.edges:
+            edge_diffs[edge.source] = Diff(DiffStatus.REMOVED, target=edge.target)
+    return TopologyDiff(resource_diffs, edge_diffs)
+
+
+def timed(fn) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,50000")
+    parser.add_argument("--legacy-max", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'resources':>10} {'indexed':>12} {'legacy':>12} {'speedup':>10}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        previous = synthetic_topology(size, seed=1)
+        current = synthetic_topology(size, seed=2)
+        indexed_s, diff = timed(lambda: previous.diff_topology(current, True))
+        if size <= args.legacy_max:
+            legacy_s, legacy = timed(lambda: legacy_diff(previous, current, True))
+            assert diff.__dict__() == legacy.__dict__()
+            print(
+                f"{size:>10} {indexed_s * 1000:>10.1f}ms {legacy_s * 1000:>10.1f}ms {legacy_s / indexed_s:>9.0f}x"
+            )
+        else:
+            print(f"{size:>10} {indexed_s * 1000:>10.1f}ms {'skipped':>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Measures memory per resource and diff throughput of Topology with the slotted, interned ResourceID and
+Edge against the previous __dict__-based classes, which rebuilt their string form on every hash and
+comparison and parsed a fresh ResourceID for every occurrence of an id.
+
+Topologies are built from id strings the way Topology.from_string builds them from engine output, so
+every edge endpoint goes through ResourceID.from_string.
+
+    PYTHONPATH=. python benchmarks/topology_memory.py [--sizes 10000,50000]
+"""
+
+import argparse
+import random
+import time
+import tracemalloc
+
+from src.topology.edge import Edge
+from src.topology.resource import Resource, ResourceID
+from src.topology.topology import Topology
+
+TYPES = ["lambda_function", "iam_role", "s3_bucket", "rds_instance", "vpc", "subnet"]
+
+
+class LegacyResourceID:
+    def __init__(self, provider=None, type=None, namespace=None, name=None):
+        self.provider = provider
+        self.type = type
+        self.namespace = namespace
+        self.name = name
+
+    def __str__(self):
+        if self.namespace is None:
+            return f"{self.provider}:{self.type}:{self.name}"
+        return f"{self.provider}:{self.type}:{self.namespace}:{self.name}"
+
+    def __eq__(self, other):
+        if not isinstance(other, LegacyResourceID):
+            return False
+        return self.__str__() == other.__str__()
+
+    def __hash__(self):
+        return hash(self.__str__())
+
+    @staticmethod
+    def from_string(id_string):
+        parts = id_string.split(":")
+        return LegacyResourceID(
+            parts[0], parts[1], parts[2] if len(parts) > 3 else None, parts[-1]
+        )
+
+
+class LegacyEdge:
+    def __init__(self, source, target):
+        self.source = source
+        self.target = target
+
+    def __eq__(self, other):
+        if not isinstance(other, LegacyEdge):
+            return False
+        return self.source == other.source and self.target == other.target
+
+    def __hash__(self):
+        return hash(self.__str__())
+
+    def __str__(self):
+        return f"{self.source}->{self.target}"
+
+
+def synthetic_document(size: int, seed: int, churn: float = 0.05):
+    """Resource id strings and edge (source, target) id string pairs, as found in engine output."""
+    rng = random.Random(seed)
+    ids = [
+        f"aws:{TYPES[i % len(TYPES)]}:resource-{i}"
+        for i in range(size)
+        if rng.random() > churn
+    ]
+    edges = [
+        (id, ids[rng.randrange(i)])
+        for i, id in enumerate(ids[1:], start=1)
+        for _ in range(2)
+    ]
+    return ids, edges
+
+
+def build(document, id_class, edge_class) -> Topology:
+    ids, edges = document
+    return Topology(
+        [Resource(id_class.from_string(id), {"Name": id}) for id in ids],
+        [
+            edge_class(id_class.from_string(source), id_class.from_string(target))
+            for source, target in edges
+        ],
+    )
+
+
+def measure(size: int, id_class, edge_class) -> tuple[float, float]:
+    """Returns (bytes per resource, diffs per second)."""
+    previous_document = synthetic_document(size, seed=1)
+    current_document = synthetic_document(size, seed=2)
+    tracemalloc.start()
+    previous = build(previous_document, id_class, edge_class)
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    current = build(current_document, id_class, edge_class)
+    runs = 3
+    start = time.perf_counter()
+    for _ in range(runs):
+        previous.diff_topology(current, True)
+    elapsed = time.perf_counter() - start
+    return used / len(previous.resources), runs / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10000,50000")
+    args = parser.parse_args()
+
+    print(
+        f"{'resources':>10} {'bytes/res':>10} {'legacy':>10} {'diffs/s':>10} {'legacy':>10}"
+    )
+    for size in [int(s) for s in args.sizes.split(",")]:
+        bytes_per, rate = measure(size, ResourceID, Edge)
+        legacy_bytes_per, legacy_rate = measure(size, LegacyResourceID, LegacyEdge)
+        print(
+            f"{size:>10} {bytes_per:>10.0f} {legacy_bytes_per:>10.0f} {rate:>10.2f} {legacy_rate:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Compares parsing resources YAML with yaml.safe_load, the libyaml C loader, and the parsed topology
+cache, on synthetic states of increasing size.
+
+    PYTHONPATH=. python benchmarks/yaml_parse.py [--sizes 1000,5000,20000]
+"""
+
+import argparse
+import time
+
+import yaml
+
+from src.topology.topology import Topology
+from src.topology.topology_cache import TopologyCache
+from src.util.yaml_loader import SafeLoader
+
+TYPES = ["lambda_function", "iam_role", "s3_bucket", "rds_instance", "vpc", "subnet"]
+
+
+def resources_yaml(size: int) -> str:
+    ids = [f"aws:{TYPES[i % len(TYPES)]}:resource-{i}" for i in range(size)]
+    return yaml.dump(
+        {
+            "resources": {
+                id: {"Name": id, "Tags": {"env": "prod"}, "MemorySize": 128}
+                for id in ids
+            },
+            "edges": {
+                f"{id} -> {ids[i // 2]}": None for i, id in enumerate(ids[1:], 1)
+            },
+        }
+    )
+
+
+def timed(fn, runs: int = 3) -> float:
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return (time.perf_counter() - start) / runs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,5000,20000")
+    args = parser.parse_args()
+
+    print(f"loader: {SafeLoader.__name__}")
+    print(
+        f"{'resources':>10} {'MiB':>6} {'safe_load':>11} {'C loader':>11} {'from_string':>12} {'cached':>9}"
+    )
+    for size in [int(s) for s in args.sizes.split(",")]:
+        document = resources_yaml(size)
+        safe_s = timed(lambda: yaml.safe_load(document), runs=1)
+        c_s = timed(lambda: yaml.load(document, Loader=SafeLoader))
+        topology_s = timed(lambda: Topology.from_string(document))
+        cache = TopologyCache(max_bytes=len(document))
+        cache.from_string(document)
+        cached_s = timed(lambda: cache.from_string(document), runs=20)
+        print(
+            f"{size:>10} {len(document) / 2**20:>6.1f} {safe_s * 1000:>9.0f}ms {c_s * 1000:>9.0f}ms"
+            f" {topology_s * 1000:>10.0f}ms {cached_s * 1000:>7.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
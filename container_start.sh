@@ -7,4 +7,7 @@ aws secretsmanager get-secret-value --secret-id $AUTH0_SECRET --query SecretStri
 aws secretsmanager get-secret-value --secret-id $AZURE_OPENAI_API_KEY --query SecretString --output text | tr -d '\n' > azure_openai_api_key.key
 
 
+# migrate once before the workers start, they only create missing tables
+python -m src.environment_management.migrate_schema || exit 1
+
 exec gunicorn --timeout 0 -w 9 -k uvicorn.workers.UvicornWorker -b 0.0.0.0:80 src.main:app
@@ -1,3 +1,4 @@
+import asyncio
 import uuid
 from datetime import datetime
 from typing import List, Optional
@@ -50,13 +51,41 @@ from src.state_manager.architecture_storage import (
     ArchitectureStorage,
     ArchitectureStateDoesNotExistError,
 )
+from src.state_manager.state_format import CAS_PREFIX
 from src.util.logging import logger
 
+SHARED_STATE_PREFIX = f"{CAS_PREFIX}/"
+# States copied at once when a cloned history still has states outside of the content-addressed store
+CLONE_CONCURRENCY = 8
+
 
 class ShareArchitectureRequest(BaseModel):
     entity_roles: Optional[dict[str, Role | None]]
 
 
+def version_state_fields(fields: Optional[List[str]]) -> List[str]:
+    """
+    Validates the state fields requested from a version endpoint, all of VersionState by default.
+    Only the selected fields are downloaded from storage.
+    """
+    if not fields:
+        return list(VersionState.model_fields)
+    unknown = [f for f in fields if f not in VersionState.model_fields]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields {', '.join(unknown)}, expected any of {', '.join(VersionState.model_fields)}",
+        )
+    return fields
+
+
+def version_state(state: RunEngineResult, fields: List[str]) -> VersionState:
+    """Builds the VersionState of the fields returned by version_state_fields, the others are None."""
+    return VersionState(
+        **{f: getattr(state, f) for f in VersionState.model_fields if f in fields}
+    )
+
+
 class ArchitectureHandler:
     def __init__(
         self,
@@ -177,30 +206,30 @@ class ArchitectureHandler:
             raise HTTPException(status_code=500, detail="internal server error")
 
     async def get_version(
-        self, architecture_id: str, env_id: str, accept: Optional[str] = None
+        self,
+        architecture_id: str,
+        env_id: str,
+        accept: Optional[str] = None,
+        fields: Optional[List[str]] = None,
     ):
         logger.info(
             f"Getting version for architecture: {architecture_id}, environment: {env_id}"
         )
+        fields = version_state_fields(fields)
         try:
             arch: EnvironmentVersion = await self.ev_dao.get_current_version(
                 architecture_id, env_id
             )
             if arch is None:
                 raise ArchitectureStateDoesNotExistError()
-            state: RunEngineResult = self.architecture_storage.get_state_from_fs(arch)
+            state: RunEngineResult = await self.architecture_storage.get_state_from_fs(
+                arch, fields=fields
+            )
             payload = EnvironmentVersionResponseObject(
                 architecture_id=arch.architecture_id,
                 id=arch.id,
                 version=arch.version,
-                state=(
-                    VersionState(
-                        resources_yaml=state.resources_yaml,
-                        topology_yaml=state.topology_yaml,
-                    )
-                    if state is not None
-                    else None
-                ),
+                state=(version_state(state, fields) if state is not None else None),
                 config_errors=(
                     arch.env_resource_configuration.get("config_errors", [])
                     if arch.env_resource_configuration is not None
@@ -236,7 +265,9 @@ class ArchitectureHandler:
         env_id: str,
         version: int,
         accept: Optional[str] = None,
+        fields: Optional[List[str]] = None,
     ):
+        fields = version_state_fields(fields)
         try:
             arch = await self.ev_dao.get_previous_state(
                 architecture_id, env_id, version
@@ -246,19 +277,14 @@ class ArchitectureHandler:
                     status_code=404,
                     detail=f"Previous state not found for environment, {env_id}, version {version}, architecture {architecture_id}",
                 )
-            state = self.architecture_storage.get_state_from_fs(arch)
+            state = await self.architecture_storage.get_state_from_fs(
+                arch, fields=fields
+            )
             payload = EnvironmentVersionResponseObject(
                 architecture_id=arch.architecture_id,
                 id=arch.id,
                 version=arch.version,
-                state=(
-                    VersionState(
-                        resources_yaml=state.resources_yaml,
-                        topology_yaml=state.topology_yaml,
-                    )
-                    if state is not None
-                    else None
-                ),
+                state=(version_state(state, fields) if state is not None else None),
                 config_errors=(
                     arch.env_resource_configuration.get("config_errors", [])
                     if arch.env_resource_configuration is not None
@@ -286,22 +312,19 @@ class ArchitectureHandler:
         env_id: str,
         version: int,
         accept: Optional[str] = None,
+        fields: Optional[List[str]] = None,
     ):
+        fields = version_state_fields(fields)
         try:
             arch = await self.ev_dao.get_next_state(architecture_id, env_id, version)
-            state = self.architecture_storage.get_state_from_fs(arch)
+            state = await self.architecture_storage.get_state_from_fs(
+                arch, fields=fields
+            )
             payload = EnvironmentVersionResponseObject(
                 architecture_id=arch.architecture_id,
                 id=arch.id,
                 version=arch.version,
-                state=(
-                    VersionState(
-                        resources_yaml=state.resources_yaml,
-                        topology_yaml=state.topology_yaml,
-                    )
-                    if state is not None
-                    else None
-                ),
+                state=(version_state(state, fields) if state is not None else None),
                 env_resource_configuration=(
                     arch.env_resource_configuration
                     if arch.env_resource_configuration is not None
@@ -431,29 +454,21 @@ class ArchitectureHandler:
                         tags=env.tags,
                     )
                 )
-                versions: List[EnvironmentVersion] = (
-                    await self.ev_dao.list_environment_versions(id, env.id)
-                )
-                for v in versions:
-                    new_version = EnvironmentVersion(
-                        id=v.id,
-                        architecture_id=newArch.id,
-                        version=v.version,
-                        version_hash=v.version_hash,
-                        env_resource_configuration=v.env_resource_configuration,
-                        constraints=v.constraints,
-                        created_at=v.created_at,
-                        created_by=v.created_by,
-                        state_location=None,
-                    )
-                    state_location = None
-                    state = self.architecture_storage.get_state_from_fs(v)
-                    if state:
-                        state_location = self.architecture_storage.write_state_to_fs(
-                            new_version, state
-                        )
-                        new_version.state_location = state_location
-                    self.ev_dao.add_environment_version(new_version)
+            # versions are copied as metadata only and share the source's immutable states
+            await self.ev_dao.clone_environment_versions(id, newArch.id)
+            unshared = await self.ev_dao.list_versions_with_unshared_state(
+                newArch.id, SHARED_STATE_PREFIX
+            )
+            if unshared:
+                semaphore = asyncio.Semaphore(CLONE_CONCURRENCY)
+
+                async def share(v: EnvironmentVersion) -> str:
+                    async with semaphore:
+                        return await self.architecture_storage.share_state(v)
+
+                locations = await asyncio.gather(*[share(v) for v in unshared])
+                for v, location in zip(unshared, locations):
+                    v.state_location = location
             return JSONResponse(content={"id": newArch.id})
         except ArchitectureDoesNotExistError:
             raise HTTPException(status_code=404, detail="Architecture not found")
@@ -6,14 +6,17 @@ from src.auth_service.entity import User
 from src.auth_service.main import AuthzService
 from src.auth_service.token import AuthError, get_user_id
 from src.backend_orchestrator.models import (
+    EnvironmentVersionNotLatestError,
     EnvironmentVersionResponseObject,
     VersionState,
 )
 from src.dependency_injection.injection import (
+    PhasedSessionLocal,
     SessionLocal,
     deps,
     get_environment_manager,
 )
+from src.engine_service.scheduler import EngineOverloadedError
 from src.environment_management.environment_manager import (
     EnvironmentManager,
     EnvironmentTrackingError,
@@ -22,6 +25,7 @@ from src.environment_management.environment_manager import (
 )
 from src.environment_management.environment_version import (
     EnvironmentVersionDoesNotExistError,
+    EnvironmentVersionReservedError,
 )
 from src.state_manager.architecture_storage import ArchitectureStateDoesNotExistError
 from src.util.logging import logger
@@ -143,7 +147,7 @@ async def promote(
         )
     try:
         accept = request.headers.get("accept")
-        async with SessionLocal.begin() as db:
+        async with PhasedSessionLocal() as db:
             manager: EnvironmentManager = get_environment_manager(db)
             env, result = await manager.promote(
                 id, BASE_ENV_ID, env_id, User(id=user_id)
@@ -179,6 +183,14 @@ async def promote(
         raise HTTPException(
             status_code=400, detail=f"Environment {env_id} not tracking any environment"
         )
+    except EnvironmentVersionNotLatestError:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Environment {env_id} changed while promoting, please try again",
+        )
+    except (EngineOverloadedError, EnvironmentVersionReservedError):
+        # answered by the app's exception handlers
+        raise
     except EnvironmentTrackingError as e:
         raise HTTPException(
             status_code=400,
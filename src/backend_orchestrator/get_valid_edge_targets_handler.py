@@ -7,6 +7,7 @@ from pydantic import BaseModel
 
 from src.backend_orchestrator.models import EnvironmentVersionNotLatestError
 from src.engine_service.binaries.fetcher import BinaryStorage, Binary
+from src.engine_service.scheduler import EngineOverloadedError
 from src.engine_service.engine_commands.get_valid_edge_targets import (
     GetValidEdgeTargetsRequest,
     get_valid_edge_targets,
@@ -58,8 +59,10 @@ class EdgeTargetHandler:
                 )
             valid_edge_targets = []
             if environment.state_location is not None:
-                input_graph = self.architecture_storage.get_state_from_fs(environment)
-                self.binary_storage.ensure_binary(Binary.ENGINE)
+                input_graph = await self.architecture_storage.get_state_from_fs(
+                    environment, fields=["resources_yaml"]
+                )
+                await self.binary_storage.ensure_binary(Binary.ENGINE)
                 request = GetValidEdgeTargetsRequest(
                     id=architecture_id,
                     input_graph=(
@@ -91,6 +94,9 @@ class EdgeTargetHandler:
             raise HTTPException(
                 status_code=400, detail="Architecture state is not the latest"
             )
+        except EngineOverloadedError:
+            # answered by the app's exception handler
+            raise
         except EnvironmentDoesNotExistError:
             raise HTTPException(
                 status_code=404, detail=f"No environment exists for id {env_id}"
@@ -1,23 +1,49 @@
 import logging
+import os
+import re
 from typing import Optional
 
 from fastapi import HTTPException, Response
-from fastapi.responses import StreamingResponse
+from fastapi.responses import RedirectResponse, StreamingResponse
 
 from src.backend_orchestrator.models import EnvironmentVersionNotLatestError
 from src.engine_service.binaries.fetcher import BinaryStorage, Binary
 from src.engine_service.engine_commands.export_iac import export_iac, ExportIacRequest
 from src.engine_service.engine_commands.run import RunEngineResult
+from src.engine_service.scheduler import EngineOverloadedError
 from src.environment_management.architecture import ArchitectureDAO
 from src.environment_management.environment_version import EnvironmentVersionDAO
 from src.environment_management.models import Architecture, EnvironmentVersion
 from src.state_manager.architecture_storage import (
     ArchitectureStorage,
     ArchitectureStateDoesNotExistError,
+    IacRangeNotSatisfiableError,
 )
+from src.util.single_flight import SingleFlight
 
 log = logging.getLogger(__name__)
 
+# "stream" passes the iac through the API, "redirect" answers with a redirect to a presigned URL so the
+# download does not go through the API at all (storage backends that cannot presign fall back to streaming)
+IAC_DOWNLOAD_MODE = os.getenv("IAC_DOWNLOAD_MODE", "stream")
+IAC_PRESIGNED_URL_TTL = int(os.getenv("IAC_PRESIGNED_URL_TTL", "300"))
+# Export the iac in the background after every successful run, so the first download does not wait for it
+IAC_PREGENERATE = os.getenv("IAC_PREGENERATE", "false").lower() == "true"
+IAC_FILENAME = "images.zip"
+
+_SINGLE_BYTE_RANGE = re.compile(r"bytes=(\d+-\d*|-\d+)")
+
+# Concurrent requests for the same environment version share one export
+iac_flight = SingleFlight("iac")
+
+
+def single_byte_range(header: Optional[str]) -> Optional[str]:
+    """Returns the Range header if it asks for a single byte range, multipart ranges are not supported."""
+    if header is None:
+        return None
+    header = header.replace(" ", "")
+    return header if _SINGLE_BYTE_RANGE.fullmatch(header) else None
+
 
 class IaCOrchestrator:
     def __init__(
@@ -38,7 +64,14 @@ class IaCOrchestrator:
         env_id: str,
         version: Optional[int],
         accept: Optional[str] = None,
+        byte_range: Optional[str] = None,
     ):
+        """
+        Returns the iac of the environment's current version, exporting it on first use.
+
+        :param byte_range: The request's Range header. A single byte range is answered with a 206 partial
+            response of that range, anything else with the whole archive.
+        """
         try:
             env_version: EnvironmentVersion = await self.ev_dao.get_current_version(
                 architecture_id, env_id
@@ -53,45 +86,51 @@ class IaCOrchestrator:
                     f"Architecture state is not current. Expected {env_version.version}, got {version}"
                 )
 
-            iac = self.architecture_storage.get_iac_from_fs(env_version)
-            if iac is None:
-                arch_state: RunEngineResult = (
-                    self.architecture_storage.get_state_from_fs(env_version)
-                )
-                if arch_state is None:
-                    raise ArchitectureStateDoesNotExistError(
-                        f"No architecture exists for id {architecture_id}"
-                    )
-                self.binary_storage.ensure_binary(Binary.IAC)
-                request = ExportIacRequest(
-                    input_graph=arch_state.resources_yaml,
-                    name=arch.name if arch.name is not None else arch.id,
+            if not await self.ensure_iac(arch, env_version):
+                return Response(content="I failed to generate IaC", status_code=500)
+            if IAC_DOWNLOAD_MODE == "redirect":
+                url = self.architecture_storage.get_iac_url(
+                    env_version, IAC_PRESIGNED_URL_TTL, IAC_FILENAME
                 )
-                result = await export_iac(request)
-                iac = result.iac_bytes
-                if iac is None:
-                    return Response(content="I failed to generate IaC", status_code=500)
-                iac_location = self.architecture_storage.write_iac_to_fs(
-                    env_version, iac
+                if url is not None:
+                    return RedirectResponse(url, status_code=307)
+            iac = await self.architecture_storage.open_iac(
+                env_version, byte_range=single_byte_range(byte_range)
+            )
+            if iac is None:
+                raise ArchitectureStateDoesNotExistError(
+                    f"No iac exists for {env_version.composite_id()}"
                 )
-                env_version.iac_location = iac_location
-                await self.ev_dao.update_environment_version(env_version)
+            headers = {
+                "Content-Type": (
+                    "application/octet-stream"
+                    if accept == "application/octet-stream"
+                    else "application/x-zip-compressed"
+                ),
+                "Content-Disposition": f"attachment; filename={IAC_FILENAME}",
+                "Accept-Ranges": "bytes",
+            }
+            if iac.content_length is not None:
+                headers["Content-Length"] = str(iac.content_length)
+            if iac.content_range is not None:
+                headers["Content-Range"] = iac.content_range
             return StreamingResponse(
-                iter([iac]),
+                iac.chunks,
+                status_code=206 if iac.content_range is not None else 200,
                 media_type="application/x-zip-compressed",
-                headers={
-                    "Content-Type": (
-                        "application/octet-stream"
-                        if accept == "application/octet-stream"
-                        else "application/x-zip-compressed"
-                    ),
-                    "Content-Disposition": f"attachment; filename=images.zip",
-                },
+                headers=headers,
             )
         except EnvironmentVersionNotLatestError as e:
             raise HTTPException(
                 status_code=400, detail="Environment version is not current"
             )
+        except IacRangeNotSatisfiableError:
+            raise HTTPException(
+                status_code=416, detail="Requested range not satisfiable"
+            )
+        except EngineOverloadedError:
+            # answered by the app's exception handler
+            raise
         except ArchitectureStateDoesNotExistError as e:
             raise HTTPException(
                 status_code=404,
@@ -100,3 +139,66 @@ class IaCOrchestrator:
         except Exception:
             log.error("Error getting iac", exc_info=True)
             raise HTTPException(status_code=500, detail="internal server error")
+
+    async def ensure_iac(
+        self, arch: Architecture, env_version: EnvironmentVersion
+    ) -> bool:
+        """Exports the iac of the version unless it has one, returns False if the export produced nothing."""
+        if env_version.iac_location is not None:
+            return True
+        iac_location = await iac_flight.do(
+            ArchitectureStorage.get_path_for_architecture(env_version),
+            lambda: self.generate_iac(arch, env_version),
+        )
+        if iac_location is None:
+            return False
+        env_version.iac_location = iac_location
+        await self.ev_dao.update_environment_version(env_version)
+        return True
+
+    async def pregenerate_iac(self, architecture_id: str, env_id: str):
+        """Exports the iac of the environment's current version ahead of its first download."""
+        try:
+            env_version = await self.ev_dao.get_current_version(architecture_id, env_id)
+            arch = await self.arch_dao.get_architecture(architecture_id)
+            if env_version is None or arch is None:
+                return
+            await self.ensure_iac(arch, env_version)
+        except Exception:
+            log.warning(
+                "Could not pregenerate iac for %s/%s",
+                architecture_id,
+                env_id,
+                exc_info=True,
+            )
+
+    async def generate_iac(
+        self, arch: Architecture, env_version: EnvironmentVersion
+    ) -> Optional[str]:
+        """
+        Exports the iac for the environment version and writes it to storage, returning its location.
+        If another worker already wrote it while we waited on the single-flight lock, that location is
+        returned instead of exporting again.
+        """
+        if await self.architecture_storage.generated_iac_exists(env_version):
+            return ArchitectureStorage.get_iac_location(env_version)
+        arch_state: RunEngineResult = await self.architecture_storage.get_state_from_fs(
+            env_version, fields=["resources_yaml"]
+        )
+        if arch_state is None:
+            raise ArchitectureStateDoesNotExistError(
+                f"No architecture exists for id {arch.id}"
+            )
+        await self.binary_storage.ensure_binary(Binary.IAC)
+        request = ExportIacRequest(
+            input_graph=arch_state.resources_yaml,
+            name=arch.name if arch.name is not None else arch.id,
+            id=arch.id,
+        )
+        result = await export_iac(request)
+        if result.iac_file is None:
+            return None
+        with result.iac_file:
+            return await self.architecture_storage.write_iac_to_fs(
+                env_version, result.iac_file
+            )
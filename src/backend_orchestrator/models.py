@@ -22,8 +22,9 @@ class ModifyArchitectureRequest(BaseModel):
 
 
 class VersionState(BaseModel):
-    resources_yaml: str
-    topology_yaml: str
+    # fields that were not requested are left unset
+    resources_yaml: Optional[str] = None
+    topology_yaml: Optional[str] = None
 
 
 class EnvironmentVersionResponseObject(BaseModel):
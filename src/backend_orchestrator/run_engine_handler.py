@@ -6,6 +6,7 @@ from typing import List, Optional
 import jsons
 from fastapi import HTTPException, Response
 from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.backend_orchestrator.models import (
     EnvironmentVersionResponseObject,
@@ -20,6 +21,7 @@ from src.engine_service.binaries.fetcher import BinaryStorage, Binary
 from src.engine_service.engine_commands.get_resource_types import (
     get_resource_types,
 )
+from src.engine_service.scheduler import EngineOverloadedError
 from src.engine_service.engine_commands.run import (
     EngineException,
     run_engine,
@@ -32,6 +34,8 @@ from src.environment_management.environment_version import (
     EnvironmentVersionDAO,
     EnvironmentVersion,
     EnvironmentVersionDoesNotExistError,
+    EnvironmentVersionReservedError,
+    VersionReservation,
 )
 from src.environment_management.models import (
     Environment,
@@ -45,6 +49,7 @@ from src.topology.resource import ResourceID
 from src.topology.topology import TopologicalChangesNotAllowed
 from src.topology.topology import TopologyDiff
 from src.topology.util import diff_engine_results
+from src.util.db import end_phase, rollback_phase
 from src.util.logging import logger
 
 log = logging.getLogger(__name__)
@@ -62,11 +67,14 @@ class EngineOrchestrator:
         ev_dao: EnvironmentVersionDAO,
         env_dao: EnvironmentDAO,
         binary_storage: BinaryStorage,
+        session: Optional[AsyncSession] = None,
     ):
         self.architecture_storage = architecture_storage
         self.ev_dao = ev_dao
         self.env_dao = env_dao
         self.binary_storage = binary_storage
+        # the DAOs' session, committed between phases so no connection is held while the engine runs
+        self.session = session
 
     async def run(
         self,
@@ -104,10 +112,13 @@ class EngineOrchestrator:
                     }
                 ),
             )
-        except EnvironmentVersionNotLatestError:
-            raise HTTPException(
-                status_code=400, detail="Environment version is not the latest"
-            )
+        except (
+            EngineOverloadedError,
+            EnvironmentVersionNotLatestError,
+            EnvironmentVersionReservedError,
+        ):
+            # answered by the app's exception handlers
+            raise
         except TopologicalChangesNotAllowed as e:
             content = {
                 "error_type": e.error_type,
@@ -139,6 +150,13 @@ class EngineOrchestrator:
         version: int,
         request: CopilotRunRequest,
     ) -> EnvironmentVersionResponseObject:
+        """
+        Runs the engine on the version and stores the result as the environment's new current version.
+
+        Runs in three phases so the session holds a connection for the reads and the writes only: a read
+        phase, an engine phase holding no connection, and a write phase that checks the environment did not
+        change in the meantime. If it did, EnvironmentVersionNotLatestError is raised and nothing is written.
+        """
         current_architecture: EnvironmentVersion = (
             await self.ev_dao.get_current_version(architecture_id, env_id)
         )
@@ -167,57 +185,83 @@ class EngineOrchestrator:
             if len(find_mutating_constraints(request.constraints)) > 0:
                 raise TopologicalChangesNotAllowed(env_id, request.constraints)
 
-        input_graph = self.architecture_storage.get_state_from_fs(architecture)
-        self.binary_storage.ensure_binary(Binary.ENGINE)
-        request = RunEngineRequest(
-            id=architecture_id,
-            input_graph=(
-                input_graph.resources_yaml if input_graph is not None else None
-            ),
-            templates=[],
-            engine_version=1.0,
-            constraints=request.constraints,
-            overwrite=request.overwrite,
-        )
-        result = await run_engine(request)
-
-        diff: TopologyDiff = diff_engine_results(result, input_graph)
-        if not env.allows_topological_changes():
-            if diff.contains_differences():
-                raise TopologicalChangesNotAllowed(
-                    env_id, constraints=request.constraints, diff=diff
-                )
-
         latest_architecture: EnvironmentVersion = await self.ev_dao.get_latest_version(
             architecture_id, env_id
         )
-        current_version = latest_architecture.version + 1
-        new_env_config = EnvironmentResourceConfiguration.from_dict(
-            architecture.env_resource_configuration
-        )
-        new_env_config.config_errors = result.config_errors
-        # new_env_config.diff = diff.__dict__()
-        arch = EnvironmentVersion(
-            architecture_id=architecture.architecture_id,
-            id=architecture.id,
-            version=current_version,
-            version_hash=str(uuid.uuid4()),
-            constraints=request.constraints,
-            created_at=datetime.utcnow(),
-            created_by=architecture.created_by,
-            state_location=None,
-            env_resource_configuration=new_env_config.to_dict(),
+        # rejects runs that could never be written before they start the engine
+        reservation = await self.ev_dao.reserve_version(
+            architecture_id, env_id, latest_architecture.version
         )
-        if request.overwrite:
-            print(
-                f"deleting any architecture for id {architecture_id} and envirnomnet {env_id} greater than state {version}"
+        await end_phase(self.session)
+
+        try:
+            input_graph = await self.architecture_storage.get_state_from_fs(
+                architecture, fields=["resources_yaml"]
+            )
+            await self.binary_storage.ensure_binary(Binary.ENGINE)
+            request = RunEngineRequest(
+                id=architecture_id,
+                input_graph=(
+                    input_graph.resources_yaml if input_graph is not None else None
+                ),
+                templates=[],
+                engine_version=1.0,
+                constraints=request.constraints,
+                overwrite=request.overwrite,
+            )
+            result = await run_engine(request)
+
+            diff: TopologyDiff = diff_engine_results(result, input_graph)
+            if not env.allows_topological_changes():
+                if diff.contains_differences():
+                    raise TopologicalChangesNotAllowed(
+                        env_id, constraints=request.constraints, diff=diff
+                    )
+
+            current_version = reservation.version
+            new_env_config = EnvironmentResourceConfiguration.from_dict(
+                architecture.env_resource_configuration
+            )
+            new_env_config.config_errors = result.config_errors
+            # new_env_config.diff = diff.__dict__()
+            arch = EnvironmentVersion(
+                architecture_id=architecture.architecture_id,
+                id=architecture.id,
+                version=current_version,
+                version_hash=str(uuid.uuid4()),
+                constraints=request.constraints,
+                created_at=datetime.utcnow(),
+                created_by=architecture.created_by,
+                state_location=None,
+                env_resource_configuration=new_env_config.to_dict(),
             )
-            await self.ev_dao.delete_future_versions(architecture_id, env_id, version)
+            # a state written for a run that loses the version check below is left to garbage collection
+            state_location = await self.architecture_storage.write_state_to_fs(
+                arch, result, base=architecture
+            )
+            arch.state_location = state_location
 
-        state_location = self.architecture_storage.write_state_to_fs(arch, result)
-        arch.state_location = state_location
-        self.ev_dao.add_environment_version(arch)
-        await self.env_dao.set_current_version(architecture_id, env_id, current_version)
+            head = await self.ev_dao.get_version_head(architecture_id, env_id)
+            if head != (current_architecture.version_hash, latest_architecture.version):
+                raise EnvironmentVersionNotLatestError(
+                    f"Environment {env_id} of architecture {architecture_id} changed while the engine ran"
+                )
+            if request.overwrite:
+                print(
+                    f"deleting any architecture for id {architecture_id} and envirnomnet {env_id} greater than state {version}"
+                )
+                await self.ev_dao.delete_future_versions(
+                    architecture_id, env_id, version
+                )
+            self.ev_dao.add_environment_version(arch)
+            await self.env_dao.set_current_version(
+                architecture_id, env_id, current_version
+            )
+            await self.ev_dao.release_version(reservation, written=True)
+            await end_phase(self.session)
+        except Exception:
+            await self._release(reservation)
+            raise
         payload = EnvironmentVersionResponseObject(
             architecture_id=arch.architecture_id,
             id=arch.id,
@@ -232,6 +276,19 @@ class EngineOrchestrator:
         )
         return payload
 
+    async def _release(self, reservation: VersionReservation):
+        # the run failed, drop what its write phase did and hand its version number back
+        try:
+            await rollback_phase(self.session)
+            await self.ev_dao.release_version(reservation, written=False)
+            await end_phase(self.session)
+        except Exception:
+            log.warning(
+                "Could not release %s, it lapses after VERSION_RESERVATION_TTL",
+                reservation,
+                exc_info=True,
+            )
+
     async def get_resource_types(self, architecture_id: str, env_id: str):
         try:
             await self.ev_dao.get_latest_version(architecture_id, env_id)
@@ -242,6 +299,9 @@ class EngineOrchestrator:
                 status_code=404,
                 detail=f"No architecture exists for id {architecture_id}",
             )
+        except EngineOverloadedError:
+            # answered by the app's exception handler
+            raise
         except Exception:
             log.error("Error getting resource types", exc_info=True)
             raise HTTPException(status_code=500, detail="internal server error")
@@ -259,10 +319,14 @@ class EngineOrchestrator:
         request = CopilotRunRequest(constraints=[], overwrite=False)
         try:
             ev = await self.ev_dao.get_current_version(architecture_id, env_id)
+            # the conversation can take up to two minutes, don't hold a connection through it
+            await end_phase(self.session)
 
             state = None
             if ev is not None and version > 0:
-                state = self.architecture_storage.get_state_from_fs(ev)
+                state = await self.architecture_storage.get_state_from_fs(
+                    ev, fields=["topology_yaml"]
+                )
             conversation = Conversation(
                 environment_version=ev, initial_state=state, messages=previous_messages
             )
@@ -314,6 +378,13 @@ class EngineOrchestrator:
                 status_code=404,
                 detail=f"No environment {env_id} exists for architecture {architecture_id}",
             )
+        except (
+            EngineOverloadedError,
+            EnvironmentVersionNotLatestError,
+            EnvironmentVersionReservedError,
+        ):
+            # answered by the app's exception handlers
+            raise
         except MessageExecutionException:
             raise HTTPException(
                 status_code=500,
@@ -13,7 +13,7 @@ from src.engine_service.engine_commands.run import (
     RunEngineResult,
 )
 from src.environment_management.models import EnvironmentVersion
-from src.topology.topology import Topology
+from src.topology.topology_cache import topology_cache
 from src.util.logging import logger
 
 log = logger.getChild("conversation")
@@ -52,7 +52,7 @@ class Conversation:
         self.initial_state = ResourcesAndEdges()
         self.messages = messages if messages is not None else []
         if initial_state:
-            topology = Topology.from_topology_yaml(initial_state.topology_yaml)
+            topology = topology_cache.from_topology_yaml(initial_state.topology_yaml)
             self.initial_state.resources = [str(r.id) for r in topology.resources]
             self.initial_state.edges = [str(e) for e in topology.edges]
 
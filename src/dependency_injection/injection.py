@@ -1,5 +1,6 @@
 import logging
 import os
+from typing import Optional
 
 import boto3
 from openfga_sdk import ClientConfiguration
@@ -14,15 +15,25 @@ from src.auth_service.teams_dao import TeamsDAO
 from src.auth_service.teams_manager import TeamsManager
 from src.backend_orchestrator.architecture_handler import ArchitectureHandler
 from src.backend_orchestrator.get_valid_edge_targets_handler import EdgeTargetHandler
-from src.backend_orchestrator.iac_handler import IaCOrchestrator
+from src.backend_orchestrator.iac_handler import IaCOrchestrator, iac_flight
 from src.backend_orchestrator.run_engine_handler import EngineOrchestrator
 from src.engine_service.binaries.fetcher import BinaryStorage
+from src.engine_service.engine_commands.run import run_cache, run_flight
+from src.engine_service.engine_commands.run_cache import (
+    ENGINE_RUN_CACHE,
+    S3CacheTier,
+)
 from src.environment_management.architecture import ArchitectureDAO
 from src.environment_management.environment import EnvironmentDAO
 from src.environment_management.environment_manager import EnvironmentManager
 from src.environment_management.environment_version import EnvironmentVersionDAO
-from src.environment_management.models import ModelsBase
+from src.environment_management.models import create_schema
 from src.state_manager.architecture_storage import ArchitectureStorage
+from src.state_manager.state_cache import StateCache
+from src.util.aws.s3_clients import S3ClientRegistry, s3_client_config
+from src.util.db import TimedQueuePool
+from src.util.storage import STORAGE_BACKEND, LocalStorage
+from src.util.single_flight import FileLock, JobLock, PostgresAdvisoryLock
 from src.util.secrets import (
     get_fga_secret,
     get_fga_client,
@@ -63,28 +74,55 @@ elif os.getenv("DB_ENDPOINT", "") != "":
     password = os.getenv("DB_PASSWORD", "")
     conn = f"postgresql+asyncpg://{username}:{password}@{endpoint}/main"
     log.info("Connecting to database: %s", conn)
-    engine = create_async_engine(conn, echo=False)
+    engine = create_async_engine(conn, echo=False, poolclass=TimedQueuePool)
 else:
     engine = create_async_engine(f"sqlite+aiosqlite://", echo=False)
 
 SessionLocal = async_sessionmaker(engine)
+# Sessions of handlers that commit between a read phase, slow work holding no connection and a write phase
+# (see end_phase). Loaded objects stay usable across those commits, closing the session rolls back the rest.
+PhasedSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
 
 
 def create_s3_resource():
+    # each resource gets its own session, boto3's default session is not safe to share across threads
+    session = boto3.session.Session()
     if os.getenv("ARCHITECTURE_BUCKET_NAME", None) is None:
-        return boto3.resource(
+        return session.resource(
             "s3",
             endpoint_url="http://localhost:9000",
             aws_access_key_id="minio",
             aws_secret_access_key="minio123",
+            config=s3_client_config(),
         )
     else:
-        return boto3.resource("s3")
+        return session.resource("s3", config=s3_client_config())
+
+
+def create_storage_resource():
+    if STORAGE_BACKEND == "local":
+        return LocalStorage()
+    return create_s3_resource()
+
+
+s3_clients = S3ClientRegistry(create_storage_resource)
+
+
+def architecture_bucket_name() -> str:
+    return os.getenv("ARCHITECTURE_BUCKET_NAME", "ifcp-architecture-storage")
+
+
+def binary_bucket_name() -> str:
+    return os.getenv("BINARY_BUCKET_NAME", "ifcp-binary-storage")
+
+
+def configure_s3_clients():
+    s3_clients.warm(architecture_bucket_name(), binary_bucket_name())
 
 
 async def get_db():
     async with engine.begin() as conn:
-        await conn.run_sync(ModelsBase.metadata.create_all)
+        await conn.run_sync(create_schema)
 
 
 def get_auth0_manager():
@@ -178,16 +216,42 @@ async def get_architecture_manager() -> SharingManager:
     )
 
 
+state_cache = StateCache.from_env()
+
+
 def get_architecture_storage():
-    bucket_name = os.getenv("ARCHITECTURE_BUCKET_NAME", "ifcp-architecture-storage")
-    s3_resource = create_s3_resource()
-    return ArchitectureStorage(bucket=s3_resource.Bucket(bucket_name))  # type: ignore
+    return ArchitectureStorage(
+        bucket=s3_clients.bucket(architecture_bucket_name()), state_cache=state_cache
+    )
 
 
 def get_binary_storage():
-    bucket_name = os.getenv("BINARY_BUCKET_NAME", "ifcp-binary-storage")
-    s3_resource = create_s3_resource()
-    return BinaryStorage(bucket=s3_resource.Bucket(bucket_name))  # type: ignore
+    return BinaryStorage(bucket=s3_clients.bucket(binary_bucket_name()))
+
+
+def configure_run_cache():
+    if "s3" in [t.strip() for t in ENGINE_RUN_CACHE.split(",")]:
+        bucket_name = os.getenv("ENGINE_RUN_CACHE_BUCKET", architecture_bucket_name())
+        run_cache.add_tier(S3CacheTier(bucket=s3_clients.bucket(bucket_name)))
+
+
+def get_job_lock() -> Optional[JobLock]:
+    # "postgres" coordinates workers across hosts, "file" across processes on one host, "none" in-process only.
+    # The holder of a postgres lock keeps a pooled connection for the whole job, so it is opt-in.
+    kind = os.getenv("SINGLE_FLIGHT_LOCK", "file")
+    if kind == "postgres":
+        return PostgresAdvisoryLock(engine)
+    if kind == "file":
+        return FileLock()
+    return None
+
+
+def configure_single_flight():
+    lock = get_job_lock()
+    iac_flight.lock = lock
+    # without a shared cache tier, a waiting worker has nowhere to find the result, so runs only dedupe in-process
+    if len(run_cache.tiers) > 0:
+        run_flight.lock = lock
 
 
 def get_environment_version_dao(session: AsyncSession):
@@ -227,11 +291,13 @@ def get_iac_orchestrator(session: AsyncSession):
 
 
 def get_engine_orchestrator(session: AsyncSession):
+    # runs and messages commit between phases, so they need a PhasedSessionLocal session
     return EngineOrchestrator(
         architecture_storage=get_architecture_storage(),
         ev_dao=get_environment_version_dao(session),
         env_dao=get_environment_dao(session),
         binary_storage=get_binary_storage(),
+        session=session,
     )
 
 
@@ -253,10 +319,12 @@ def share_architecture_handler(session: AsyncSession):
 
 
 def get_environment_manager(session: AsyncSession):
+    # promotions commit between phases, so they need a PhasedSessionLocal session
     return EnvironmentManager(
         architecture_storage=get_architecture_storage(),
         arch_dao=get_architecture_dao(session),
         env_dao=get_environment_dao(session),
         ev_dao=get_environment_version_dao(session),
         binary_storage=get_binary_storage(),
+        session=session,
     )
@@ -6,7 +6,7 @@ from pathlib import Path
 
 from botocore.exceptions import ClientError
 
-from src.util.aws.s3 import get_object
+from src.util.aws.s3 import get_object, run_in_s3_pool
 
 log = logging.getLogger()
 
@@ -44,12 +44,12 @@ class BinaryStorage:
     def __init__(self, bucket) -> None:
         self._bucket = bucket
 
-    def get_binary(self, binary: Binary) -> BytesIO:
+    async def get_binary(self, binary: Binary) -> BytesIO:
         path = binary.value
         try:
             log.info(f"Reading binary from {path}")
             obj = self._bucket.Object(path)
-            binary_raw = get_object(obj)
+            binary_raw = await run_in_s3_pool(get_object, obj)
             if binary_raw is None:
                 raise BinaryNotFoundException(f"Empty result from {path}")
             if isinstance(binary_raw, str):
@@ -62,11 +62,15 @@ class BinaryStorage:
             raise
 
     # write binary to disk checks to see if the binary passed in exists otherwise it will read it and write it to disk
-    def ensure_binary(self, binary: Binary):
+    async def ensure_binary(self, binary: Binary):
         if not binary.path.exists():
-            raw = self.get_binary(binary)
-            binary.path.parent.mkdir(parents=True, exist_ok=True)
-            with binary.path.open("wb") as file:
-                file.write(raw.getbuffer())
-            os.chmod(binary.path, 0o755)
+            raw = await self.get_binary(binary)
+            await run_in_s3_pool(_write_binary, binary.path, raw)
             print(f"Successfully wrote {binary.path} : {binary.path.exists()}")
+
+
+def _write_binary(path: Path, raw: BytesIO):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("wb") as file:
+        file.write(raw.getbuffer())
+    os.chmod(path, 0o755)
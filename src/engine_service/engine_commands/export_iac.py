@@ -1,20 +1,35 @@
+import asyncio
+import os
 import tempfile
-from io import BytesIO
 from pathlib import Path
-from typing import NamedTuple
+from typing import BinaryIO, NamedTuple, Optional
 
 from src.engine_service.engine_commands.util import run_iac_command
-from src.util.compress import zip_directory_recurse
+from src.engine_service.scheduler import tenant_scope
+from src.util.compress import STORED_SUFFIXES, zip_directory_recurse
+
+# Archives up to this size are built in memory, larger ones spill to a temporary file
+IAC_SPOOL_MAX_BYTES = int(os.getenv("IAC_SPOOL_MAX_BYTES", str(8 * 1024 * 1024)))
+# Comma separated file extensions to store without compression, defaults to common compressed formats
+IAC_STORED_SUFFIXES = [
+    s.strip()
+    for s in os.getenv("IAC_STORED_SUFFIXES", ",".join(sorted(STORED_SUFFIXES))).split(
+        ","
+    )
+    if s.strip()
+]
 
 
 class ExportIacRequest(NamedTuple):
     input_graph: str
     name: str
     provider: str = "pulumi"
+    id: Optional[str] = None
 
 
 class ExportIacResult(NamedTuple):
-    iac_bytes: bytes
+    # The zipped iac, positioned at the start. The caller is responsible for closing it.
+    iac_file: BinaryIO
 
 
 async def export_iac(request: ExportIacRequest) -> ExportIacResult:
@@ -39,14 +54,23 @@ async def export_iac(request: ExportIacRequest) -> ExportIacResult:
             ]
         )
 
-        await run_iac_command(
-            "Generate",
-            *args,
-            cwd=dir,
-        )
+        with tenant_scope(request.id):
+            await run_iac_command(
+                "Generate",
+                *args,
+                cwd=dir,
+            )
 
-        iac_bytes = zip_directory_recurse(BytesIO(), str(dir))
+        iac_file = tempfile.SpooledTemporaryFile(max_size=IAC_SPOOL_MAX_BYTES)
+        try:
+            await asyncio.to_thread(
+                zip_directory_recurse, iac_file, str(dir), IAC_STORED_SUFFIXES
+            )
+            iac_file.seek(0)
+        except BaseException:
+            iac_file.close()
+            raise
 
         return ExportIacResult(
-            iac_bytes=iac_bytes,
+            iac_file=iac_file,
         )
@@ -8,6 +8,8 @@ from typing import NamedTuple
 import yaml
 
 from src.engine_service.engine_commands.util import run_engine_command, EngineException
+from src.engine_service.scheduler import EngineOverloadedError, tenant_scope
+from src.util.yaml_loader import safe_load
 
 log = logging.getLogger(__name__)
 
@@ -65,18 +67,21 @@ async def get_valid_edge_targets(
                 ]
             )
 
-            out_logs, err_logs = await run_engine_command(
-                "GetValidEdgeTargets",
-                *args,
-                cwd=dir,
-            )
+            with tenant_scope(request.id):
+                out_logs, err_logs = await run_engine_command(
+                    "GetValidEdgeTargets",
+                    *args,
+                    cwd=dir,
+                )
 
             with open(dir / "valid_edge_targets.yaml") as file:
-                edges = yaml.safe_load(file)
+                edges = safe_load(file)
 
             return GetValidEdgeTargetsResult(
                 valid_edge_targets=edges,
             )
+        except EngineOverloadedError:
+            raise
         except Exception as e:
             log.error(
                 f"Error finding valid edge targets: {e}. Config: {request.config}"
@@ -0,0 +1,304 @@
+import asyncio
+import json
+import logging
+import os
+from asyncio.subprocess import Process
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from src.engine_service.binaries.fetcher import Binary
+
+log = logging.getLogger(__name__)
+
+# Worker pools are opt-in per binary: the binary must support a long-lived mode (ENGINE_POOL_SUBCOMMAND)
+# which reads one JSON job per line on stdin and writes one JSON result per line on stdout:
+#   request:  {"id": 1, "args": ["--json-log", "Run", ...], "cwd": "/tmp/..."}
+#   response: {"id": 1, "returncode": 0, "stdout": "...", "stderr": "..."}
+# Health checks send {"id": 2, "ping": true} and expect {"id": 2, "pong": true}.
+ENGINE_POOL_SIZE = int(os.getenv("ENGINE_POOL_SIZE", "0"))
+IAC_POOL_SIZE = int(os.getenv("IAC_POOL_SIZE", "0"))
+ENGINE_POOL_MAX_JOBS = int(os.getenv("ENGINE_POOL_MAX_JOBS", "100"))
+ENGINE_POOL_HEALTH_CHECK_INTERVAL = float(
+    os.getenv("ENGINE_POOL_HEALTH_CHECK_INTERVAL", "30")
+)
+ENGINE_POOL_HEALTH_CHECK_TIMEOUT = float(
+    os.getenv("ENGINE_POOL_HEALTH_CHECK_TIMEOUT", "5")
+)
+ENGINE_POOL_SUBCOMMAND = os.getenv("ENGINE_POOL_SUBCOMMAND", "Serve")
+
+# results are returned as a single JSON line, so the default 64KiB stream limit is far too small
+STREAM_LIMIT = 256 * 1024 * 1024
+
+
+class WorkerError(Exception):
+    pass
+
+
+class PoolConfig(NamedTuple):
+    size: int
+    max_jobs_per_worker: int = ENGINE_POOL_MAX_JOBS
+    health_check_interval: float = ENGINE_POOL_HEALTH_CHECK_INTERVAL
+    health_check_timeout: float = ENGINE_POOL_HEALTH_CHECK_TIMEOUT
+
+
+class EngineWorker:
+    """
+    A single long-lived engine process that executes jobs sent over stdin/stdout.
+    """
+
+    def __init__(self, process: Process):
+        self.process = process
+        self.jobs = 0
+        self._next_id = 0
+        self._stderr_task = asyncio.create_task(self._drain_stderr())
+
+    @staticmethod
+    async def start(command: list[str]) -> "EngineWorker":
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            env=os.environ.copy(),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=STREAM_LIMIT,
+        )
+        log.info("Started engine worker %s: %s", process.pid, " ".join(command))
+        return EngineWorker(process)
+
+    @property
+    def alive(self) -> bool:
+        return self.process.returncode is None
+
+    async def execute(
+        self, args: list[str], cwd: Optional[Path] = None
+    ) -> tuple[int, str, str]:
+        self.jobs += 1
+        response = await self._request(
+            {"args": args, "cwd": None if cwd is None else str(cwd)}
+        )
+        return (
+            response.get("returncode", 0),
+            response.get("stdout", ""),
+            response.get("stderr", ""),
+        )
+
+    async def ping(self, timeout: float) -> bool:
+        try:
+            response = await self._request({"ping": True}, timeout=timeout)
+            return response.get("pong", False)
+        except WorkerError:
+            return False
+
+    async def stop(self):
+        self._stderr_task.cancel()
+        if not self.alive:
+            return
+        try:
+            self.process.stdin.close()
+            await asyncio.wait_for(self.process.wait(), timeout=5)
+        except (asyncio.TimeoutError, ProcessLookupError, ConnectionResetError):
+            self.kill()
+
+    def kill(self):
+        self._stderr_task.cancel()
+        if self.alive:
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                pass
+
+    async def _request(self, payload: dict, timeout: float = None) -> dict:
+        if not self.alive:
+            raise WorkerError(f"Engine worker {self.process.pid} is not running")
+        self._next_id += 1
+        request_id = self._next_id
+        try:
+            self.process.stdin.write(
+                (json.dumps({"id": request_id, **payload}) + "\n").encode()
+            )
+            await self.process.stdin.drain()
+            line = await asyncio.wait_for(self.process.stdout.readline(), timeout)
+        except asyncio.TimeoutError:
+            self.kill()
+            raise WorkerError(f"Engine worker {self.process.pid} timed out")
+        except (BrokenPipeError, ConnectionResetError) as e:
+            self.kill()
+            raise WorkerError(f"Engine worker {self.process.pid} crashed: {e}")
+        if not line:
+            self.kill()
+            raise WorkerError(f"Engine worker {self.process.pid} exited")
+        try:
+            response = json.loads(line)
+        except json.JSONDecodeError:
+            self.kill()
+            raise WorkerError(f"Engine worker {self.process.pid} sent invalid output")
+        if response.get("id") != request_id:
+            self.kill()
+            raise WorkerError(
+                f"Engine worker {self.process.pid} answered request {response.get('id')}, expected {request_id}"
+            )
+        return response
+
+    async def _drain_stderr(self):
+        # The worker's own diagnostics; per-job logs come back in the response
+        while True:
+            line = await self.process.stderr.readline()
+            if not line:
+                return
+            log.debug("engine worker %s: %s", self.process.pid, line.decode().rstrip())
+
+
+class EngineWorkerPool:
+    """
+    A bounded pool of warm engine workers. Workers are spawned lazily up to the configured size,
+    recycled after max_jobs_per_worker jobs, replaced when they crash and periodically health checked
+    while idle.
+
+    Capacity is a semaphore of config.size slots: every worker out of the idle queue is held with a slot,
+    and a slot holder that finds no idle worker starts a new one. Dropping a worker frees its slot, so a
+    waiting caller wakes up and starts the replacement.
+    """
+
+    def __init__(self, command: list[str], config: PoolConfig):
+        self.command = command
+        self.config = config
+        self._idle: asyncio.Queue[EngineWorker] = asyncio.Queue()
+        self._slots = asyncio.Semaphore(config.size)
+        self._size = 0
+        self._stopping: set[asyncio.Task] = set()
+        self._health_task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    async def execute(
+        self, args: list[str], cwd: Optional[Path] = None
+    ) -> tuple[int, str, str]:
+        """
+        Run a job on a pooled worker.
+
+        :raises WorkerError: if the worker died while running the job. The worker is discarded and
+            the caller is expected to retry the job outside of the pool.
+        """
+        worker = await self._acquire()
+        try:
+            result = await worker.execute(args, cwd)
+        except BaseException:
+            # crashed, or cancelled mid-job: the worker's next response would belong to this job
+            self._discard(worker)
+            self._slots.release()
+            raise
+        self._release(worker)
+        self._slots.release()
+        return result
+
+    async def close(self):
+        self._closed = True
+        if self._health_task is not None:
+            self._health_task.cancel()
+        while not self._idle.empty():
+            self._discard(self._idle.get_nowait())
+        if self._stopping:
+            await asyncio.gather(*self._stopping, return_exceptions=True)
+
+    async def check_health(self):
+        """Ping every idle worker once, discarding the ones that do not answer."""
+        for _ in range(self._idle.qsize()):
+            # a worker being pinged is out of the idle queue, so it holds a slot like a busy one
+            async with self._slots:
+                if self._idle.empty():
+                    return
+                worker = self._idle.get_nowait()
+                if await worker.ping(self.config.health_check_timeout):
+                    self._release(worker)
+                else:
+                    log.warning(
+                        "Engine worker %s failed health check", worker.process.pid
+                    )
+                    self._discard(worker)
+
+    async def _acquire(self) -> EngineWorker:
+        if self._closed:
+            raise WorkerError("Engine worker pool is closed")
+        self._ensure_health_checks()
+        await self._slots.acquire()
+        try:
+            if self._closed:
+                raise WorkerError("Engine worker pool is closed")
+            while not self._idle.empty():
+                worker = self._idle.get_nowait()
+                if worker.alive:
+                    return worker
+                self._discard(worker)
+            self._size += 1
+            try:
+                return await EngineWorker.start(self.command)
+            except Exception as e:
+                self._size -= 1
+                raise WorkerError(f"Could not start engine worker: {e}") from e
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, worker: EngineWorker):
+        """Returns a worker to the idle queue, or drops it. The caller then frees its slot."""
+        if self._closed or not worker.alive:
+            self._discard(worker)
+        elif worker.jobs >= self.config.max_jobs_per_worker:
+            log.info(
+                "Recycling engine worker %s after %d jobs",
+                worker.process.pid,
+                worker.jobs,
+            )
+            self._discard(worker)
+        else:
+            self._idle.put_nowait(worker)
+
+    def _discard(self, worker: EngineWorker):
+        self._size -= 1
+        if worker.alive:
+            task = asyncio.create_task(worker.stop())
+            self._stopping.add(task)
+            task.add_done_callback(self._stopping.discard)
+        else:
+            worker.kill()
+
+    def _ensure_health_checks(self):
+        if self.config.health_check_interval <= 0:
+            return
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.create_task(self._health_check_loop())
+
+    async def _health_check_loop(self):
+        while not self._closed:
+            await asyncio.sleep(self.config.health_check_interval)
+            try:
+                await self.check_health()
+            except Exception:
+                log.error("Engine worker health check failed", exc_info=True)
+
+
+_pools: dict[Binary, EngineWorkerPool] = {}
+
+
+def get_worker_pool(b: Binary) -> Optional[EngineWorkerPool]:
+    """Returns the worker pool for the binary, or None if pooling is disabled for it."""
+    size = ENGINE_POOL_SIZE if b == Binary.ENGINE else IAC_POOL_SIZE
+    if size <= 0:
+        return None
+    pool = _pools.get(b)
+    if pool is None:
+        pool = EngineWorkerPool(
+            [str(b.path), "--json-log", ENGINE_POOL_SUBCOMMAND],
+            PoolConfig(size=size),
+        )
+        _pools[b] = pool
+    return pool
+
+
+async def close_worker_pools():
+    for pool in _pools.values():
+        await pool.close()
+    _pools.clear()
@@ -8,6 +8,9 @@ from typing import List, NamedTuple, Dict, Optional
 
 import yaml
 
+from src.engine_service.engine_commands.run_cache import RunResultCache
+from src.engine_service.scheduler import tenant_scope
+from src.util.single_flight import SingleFlight
 from src.engine_service.engine_commands.util import (
     run_engine_command,
     EngineException,
@@ -34,6 +37,11 @@ class RunEngineResult(NamedTuple):
     config_errors: List[Dict] = []
 
 
+run_cache = RunResultCache.from_env(RunEngineResult)
+# Identical concurrent runs (same cache key) share one engine execution
+run_flight = SingleFlight("engine_run")
+
+
 @contextlib.contextmanager
 def tempdir():
     if KEEP_TMP:
@@ -53,6 +61,24 @@ def tempdir():
 
 
 async def run_engine(request: RunEngineRequest) -> RunEngineResult:
+    key = await run_cache.key_for(request)
+    if key is None:
+        with tenant_scope(request.id):
+            return await _run_engine(request)
+    return await run_flight.do(key, lambda: _run_engine_cached(key, request))
+
+
+async def _run_engine_cached(key: str, request: RunEngineRequest) -> RunEngineResult:
+    cached = await run_cache.get(key)
+    if cached is not None:
+        return cached
+    with tenant_scope(request.id):
+        result = await _run_engine(request)
+    await run_cache.put(key, result)
+    return result
+
+
+async def _run_engine(request: RunEngineRequest) -> RunEngineResult:
     print(request.constraints)
     with tempdir() as tmp_dir:
         dir = Path(tmp_dir)
@@ -0,0 +1,236 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional, Protocol
+
+from botocore.exceptions import ClientError
+
+from src.engine_service.binaries.fetcher import Binary
+from src.util.cache import DiskCache, LRUCache
+from src.util.metrics import metrics
+
+log = logging.getLogger(__name__)
+
+# Comma separated list of tiers to use, from fastest to slowest: memory, disk, s3. Empty disables caching.
+ENGINE_RUN_CACHE = os.getenv("ENGINE_RUN_CACHE", "memory")
+ENGINE_RUN_CACHE_MAX_BYTES = int(
+    os.getenv("ENGINE_RUN_CACHE_MAX_BYTES", str(256 * 1024 * 1024))
+)
+ENGINE_RUN_CACHE_DIR = os.getenv(
+    "ENGINE_RUN_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "infracopilot", "run-cache"),
+)
+ENGINE_RUN_CACHE_DIR_MAX_BYTES = int(
+    os.getenv("ENGINE_RUN_CACHE_DIR_MAX_BYTES", str(1024 * 1024 * 1024))
+)
+# Bumping the version invalidates every cached result regardless of the engine binary
+ENGINE_RUN_CACHE_VERSION = os.getenv("ENGINE_RUN_CACHE_VERSION", "1")
+
+
+class CacheTier(Protocol):
+    name: str
+
+    def get(self, key: str) -> Optional[bytes]: ...
+
+    def put(self, key: str, value: bytes): ...
+
+    def clear(self): ...
+
+
+class DiskCacheTier:
+    name = "disk"
+
+    def __init__(self, root: str | Path, max_bytes: Optional[int] = None):
+        self._cache = DiskCache(root, max_bytes)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._cache.get(key)
+
+    def put(self, key: str, value: bytes):
+        self._cache.put(key, value)
+
+    def clear(self):
+        self._cache.clear()
+
+
+class S3CacheTier:
+    name = "s3"
+
+    def __init__(self, bucket, prefix: str = "engine-run-cache/"):
+        self._bucket = bucket
+        self._prefix = prefix
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return self._bucket.Object(self._prefix + key).get()["Body"].read()
+        except ClientError as err:
+            if err.response["Error"]["Code"] == "NoSuchKey":
+                return None
+            raise
+
+    def put(self, key: str, value: bytes):
+        self._bucket.Object(self._prefix + key).put(Body=value)
+
+    def clear(self):
+        self._bucket.objects.filter(Prefix=self._prefix).delete()
+
+
+def result_size(result) -> int:
+    return (
+        len(result.resources_yaml or "")
+        + len(result.topology_yaml or "")
+        + len(result.iac_topology or "")
+        + len(json.dumps(result.config_errors or []))
+    )
+
+
+_digests: dict[tuple[str, int, int], str] = {}
+
+
+def engine_digest(path: Path) -> Optional[str]:
+    """
+    Returns the sha256 of the engine binary, or None if it does not exist. The digest is memoized
+    on the path, modification time and size so the binary is only hashed once per upgrade.
+    """
+    try:
+        stat = path.stat()
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    stat_key = (str(path), stat.st_mtime_ns, stat.st_size)
+    digest = _digests.get(stat_key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        _digests[stat_key] = digest
+    return digest
+
+
+class RunResultCache:
+    """
+    Content-addressed cache of engine Run results.
+
+    Results are keyed by a canonical hash of the request inputs that affect the engine's output
+    together with the digest of the engine binary, so upgrading the engine never serves stale results.
+    """
+
+    def __init__(
+        self,
+        result_type: type,
+        memory: Optional[LRUCache] = None,
+        tiers: list[CacheTier] = None,
+    ):
+        self.result_type = result_type
+        self.memory = memory
+        self.tiers = tiers if tiers is not None else []
+        self._engine_digest: Optional[str] = None
+
+    @staticmethod
+    def from_env(result_type: type) -> "RunResultCache":
+        names = [t.strip() for t in ENGINE_RUN_CACHE.split(",") if t.strip()]
+        memory = None
+        tiers = []
+        if "memory" in names:
+            memory = LRUCache(ENGINE_RUN_CACHE_MAX_BYTES, sizeof=result_size)
+        if "disk" in names:
+            tiers.append(
+                DiskCacheTier(ENGINE_RUN_CACHE_DIR, ENGINE_RUN_CACHE_DIR_MAX_BYTES)
+            )
+        return RunResultCache(result_type, memory, tiers)
+
+    @property
+    def enabled(self) -> bool:
+        return self.memory is not None or len(self.tiers) > 0
+
+    def add_tier(self, tier: CacheTier):
+        self.tiers.append(tier)
+
+    async def key_for(self, request) -> Optional[str]:
+        """
+        Returns the cache key for a RunEngineRequest, or None if the request cannot be cached
+        (caching disabled or the engine binary is unavailable to fingerprint).
+        """
+        if not self.enabled:
+            return None
+        digest = await asyncio.to_thread(engine_digest, Binary.ENGINE.path)
+        if digest is None:
+            return None
+        if self._engine_digest is not None and digest != self._engine_digest:
+            log.info("Engine binary changed, invalidating in-memory run cache")
+            if self.memory is not None:
+                self.memory.clear()
+        self._engine_digest = digest
+        canonical = json.dumps(
+            {
+                "cache_version": ENGINE_RUN_CACHE_VERSION,
+                "engine": digest,
+                "engine_version": request.engine_version,
+                "input_graph": request.input_graph,
+                "constraints": request.constraints,
+                "templates": request.templates,
+            },
+            sort_keys=True,
+            separators=(",", ":"),
+            default=str,
+        )
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    async def get(self, key: str):
+        if self.memory is not None:
+            result = self.memory.get(key)
+            if result is not None:
+                metrics.counter(
+                    "engine_run_cache_hits_total",
+                    "Engine run cache hits",
+                    tier="memory",
+                ).inc()
+                return result
+        for i, tier in enumerate(self.tiers):
+            try:
+                raw = await asyncio.to_thread(tier.get, key)
+            except Exception:
+                log.warning("Engine run cache %s read failed", tier.name, exc_info=True)
+                continue
+            if raw is None:
+                continue
+            metrics.counter(
+                "engine_run_cache_hits_total", "Engine run cache hits", tier=tier.name
+            ).inc()
+            result = self.result_type(**json.loads(raw))
+            if self.memory is not None:
+                self.memory.put(key, result)
+            for upper in self.tiers[:i]:
+                await self._put_tier(upper, key, raw)
+            return result
+        metrics.counter(
+            "engine_run_cache_misses_total", "Engine run cache misses"
+        ).inc()
+        return None
+
+    async def put(self, key: str, result):
+        if self.memory is not None:
+            self.memory.put(key, result)
+        if len(self.tiers) == 0:
+            return
+        raw = json.dumps(result._asdict()).encode()
+        for tier in self.tiers:
+            await self._put_tier(tier, key, raw)
+
+    async def _put_tier(self, tier: CacheTier, key: str, raw: bytes):
+        try:
+            await asyncio.to_thread(tier.put, key, raw)
+        except Exception:
+            log.warning("Engine run cache %s write failed", tier.name, exc_info=True)
+
+    def invalidate(self):
+        """Drops every cached result from all tiers."""
+        if self.memory is not None:
+            self.memory.clear()
+        for tier in self.tiers:
+            tier.clear()
@@ -5,14 +5,20 @@ import os
 import shutil
 from asyncio.subprocess import Process
 from pathlib import Path
+from typing import Optional
 
 from src.engine_service.binaries.fetcher import Binary
+from src.engine_service.engine_commands.pool import get_worker_pool, WorkerError
+from src.engine_service.scheduler import Priority, current_tenant, get_scheduler
 
 log = logging.getLogger()
 
 CAPTURE_ENGINE_FAILURES = os.getenv("CAPTURE_ENGINE_FAILURES", False)
 ENGINE_PROFILING = os.getenv("ENGINE_PROFILING", False)
 
+# engine commands that back interactive UI calls and are scheduled ahead of runs and exports
+INTERACTIVE_COMMANDS = {"GetValidEdgeTargets", "ListResourceTypes"}
+
 
 class EngineException(Exception):
     def __init__(self, cmd, returncode: int, stdout: str, stderr: str):
@@ -60,16 +66,10 @@ async def run_command(
     print(f"Running {b.value} command: {' '.join(cmd)}")
     log.debug("Running %s command: %s", b.value, " ".join(cmd))
 
-    process: Process = await asyncio.create_subprocess_exec(
-        *cmd,
-        cwd=cwd,
-        env=env,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-    )
-    stdout, stderr = await process.communicate()
-    out_logs = "" if stdout is None else stdout.decode()
-    err_logs = "" if stderr is None else stderr.decode()
+    async with get_scheduler().slot(
+        priority_for(b, args), kind=f"{b.value}:{args[0]}", tenant=current_tenant.get()
+    ):
+        returncode, out_logs, err_logs = await execute(b, cmd, cwd, env)
 
     log.info("%s output:\n%s", b.value, out_logs)
     if err_logs is not None and len(err_logs.strip()) > 0:
@@ -77,10 +77,10 @@ async def run_command(
     if cwd is not None:
         capture_failure(f"failures/{b.value}", cmd, cwd, out_logs, err_logs)
 
-    if process.returncode != 0:
+    if returncode != 0:
         raise EngineException(
             cmd,
-            process.returncode,
+            returncode,
             out_logs,
             err_logs,
         )
@@ -88,6 +88,37 @@ async def run_command(
     return out_logs, err_logs
 
 
+async def execute(
+    b: Binary, cmd: list[str], cwd: Optional[Path], env: dict
+) -> tuple[int, str, str]:
+    pool = get_worker_pool(b)
+    if pool is not None:
+        try:
+            return await pool.execute(cmd[1:], cwd=cwd)
+        except WorkerError as e:
+            log.warning("%s worker failed, running command directly: %s", b.value, e)
+
+    process: Process = await asyncio.create_subprocess_exec(
+        *cmd,
+        cwd=cwd,
+        env=env,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await process.communicate()
+    out_logs = "" if stdout is None else stdout.decode()
+    err_logs = "" if stderr is None else stderr.decode()
+    return process.returncode, out_logs, err_logs
+
+
+def priority_for(b: Binary, args) -> Priority:
+    if b == Binary.IAC:
+        return Priority.EXPORT
+    if len(args) > 0 and args[0] in INTERACTIVE_COMMANDS:
+        return Priority.INTERACTIVE
+    return Priority.RUN
+
+
 async def run_engine_command(*args, cwd: None | Path | str = None) -> tuple[str, str]:
     return await run_command(Binary.ENGINE, *args, cwd=cwd)
 
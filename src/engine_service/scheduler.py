@@ -0,0 +1,266 @@
+import asyncio
+import contextlib
+import fcntl
+import logging
+import math
+import os
+import random
+import tempfile
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from enum import IntEnum
+from pathlib import Path
+from typing import Optional
+
+from src.util.metrics import metrics
+
+log = logging.getLogger(__name__)
+
+# Concurrent engine/iac executions allowed per API process
+ENGINE_MAX_CONCURRENCY = int(
+    os.getenv("ENGINE_MAX_CONCURRENCY", str(os.cpu_count() or 1))
+)
+# Concurrent engine/iac executions allowed across every API process on the host, 0 disables the host limit
+ENGINE_HOST_MAX_CONCURRENCY = int(
+    os.getenv("ENGINE_HOST_MAX_CONCURRENCY", str(os.cpu_count() or 1))
+)
+ENGINE_HOST_SLOTS_DIR = os.getenv(
+    "ENGINE_HOST_SLOTS_DIR",
+    os.path.join(tempfile.gettempdir(), "infracopilot", "engine-slots"),
+)
+# Requests whose estimated queue wait exceeds this many seconds are rejected
+ENGINE_MAX_QUEUE_WAIT = float(os.getenv("ENGINE_MAX_QUEUE_WAIT", "30"))
+
+HOST_SLOT_POLL_INTERVAL = 0.05
+EWMA_ALPHA = 0.2
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    RUN = 1
+    EXPORT = 2
+
+
+# The identity (architecture id) that engine work is charged to for fair queueing
+current_tenant: ContextVar[Optional[str]] = ContextVar("current_tenant", default=None)
+
+
+@contextlib.contextmanager
+def tenant_scope(tenant: Optional[str]):
+    token = current_tenant.set(tenant)
+    try:
+        yield
+    finally:
+        current_tenant.reset(token)
+
+
+class EngineOverloadedError(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Engine is overloaded, retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class HostSlots:
+    """
+    A host-wide counting semaphore built from flock'd slot files, shared by every process on the host.
+    Locks are released by the kernel if a process dies, so slots can never leak.
+    """
+
+    def __init__(self, directory: str | Path, count: int):
+        self.directory = Path(directory)
+        self.count = count
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def try_acquire(self) -> Optional[int]:
+        for i in random.sample(range(self.count), self.count):
+            fd = os.open(self.directory / f"slot-{i}.lock", os.O_RDWR | os.O_CREAT)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    async def acquire(self, timeout: float) -> Optional[int]:
+        deadline = time.monotonic() + timeout
+        while True:
+            fd = self.try_acquire()
+            if fd is not None:
+                return fd
+            if time.monotonic() >= deadline:
+                return None
+            await asyncio.sleep(HOST_SLOT_POLL_INTERVAL)
+
+    @staticmethod
+    def release(fd: int):
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+
+class EngineScheduler:
+    """
+    Admission controller for engine and IaC executions.
+
+    At most max_concurrency executions run at once. The rest wait in per-priority queues, where
+    interactive work is always served before runs and runs before exports. Within a priority, tenants
+    are served round-robin so one architecture cannot starve the others. Requests whose estimated wait
+    exceeds max_queue_wait are rejected with EngineOverloadedError instead of being queued.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_queue_wait: float,
+        host_slots: Optional[HostSlots] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue_wait = max_queue_wait
+        self.host_slots = host_slots
+        self._running = 0
+        self._queues: dict[Priority, OrderedDict[Optional[str], deque]] = {
+            p: OrderedDict() for p in Priority
+        }
+        self._avg_run_time: dict[Priority, float] = {p: 1.0 for p in Priority}
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    def queue_depth(self, priority: Optional[Priority] = None) -> int:
+        priorities = Priority if priority is None else [priority]
+        return sum(len(q) for p in priorities for q in self._queues[p].values())
+
+    def estimate_wait(self, priority: Priority) -> float:
+        """Seconds until a new request at this priority would start, based on average run times."""
+        ahead = sum(
+            self.queue_depth(p) * self._avg_run_time[p]
+            for p in Priority
+            if p <= priority
+        )
+        return (ahead + self._avg_run_time[priority]) / self.max_concurrency
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: Priority, kind: str, tenant: Optional[str] = None):
+        start = time.monotonic()
+        if self._running < self.max_concurrency and self.queue_depth() == 0:
+            self._running += 1
+        else:
+            await self._wait_for_slot(priority, kind, tenant)
+
+        host_fd = None
+        run_start = None
+        try:
+            if self.host_slots is not None:
+                remaining = self.max_queue_wait - (time.monotonic() - start)
+                host_fd = await self.host_slots.acquire(max(remaining, 0))
+                if host_fd is None:
+                    self._shed(kind, self.max_queue_wait)
+            run_start = time.monotonic()
+            metrics.histogram(
+                "engine_queue_wait_seconds", "Time spent waiting for a slot", kind=kind
+            ).observe(run_start - start)
+            yield
+        finally:
+            if host_fd is not None:
+                HostSlots.release(host_fd)
+            if run_start is not None:
+                self._record_run_time(priority, kind, time.monotonic() - run_start)
+            self._release()
+
+    def _record_run_time(self, priority: Priority, kind: str, elapsed: float):
+        self._avg_run_time[priority] += EWMA_ALPHA * (
+            elapsed - self._avg_run_time[priority]
+        )
+        metrics.histogram(
+            "engine_run_seconds", "Engine execution time", kind=kind
+        ).observe(elapsed)
+
+    async def _wait_for_slot(
+        self, priority: Priority, kind: str, tenant: Optional[str]
+    ):
+        estimate = self.estimate_wait(priority)
+        if estimate > self.max_queue_wait:
+            self._shed(kind, estimate)
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues[priority].setdefault(tenant, deque()).append(waiter)
+        self._update_depth(priority)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed to us just before we were cancelled
+                self._release()
+            else:
+                self._remove(priority, tenant, waiter)
+            raise
+
+    def _shed(self, kind: str, estimate: float):
+        metrics.counter(
+            "engine_requests_shed_total",
+            "Engine requests rejected by load shedding",
+            kind=kind,
+        ).inc()
+        raise EngineOverloadedError(retry_after=max(1, math.ceil(estimate)))
+
+    def _release(self):
+        # hand the slot directly to the next waiter so newcomers cannot jump the queue
+        while True:
+            waiter = self._next_waiter()
+            if waiter is None:
+                self._running -= 1
+                return
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        for priority in Priority:
+            queue = self._queues[priority]
+            if len(queue) == 0:
+                continue
+            tenant, waiters = next(iter(queue.items()))
+            waiter = waiters.popleft()
+            del queue[tenant]
+            if len(waiters) > 0:
+                # round-robin: the tenant goes to the back of the line
+                queue[tenant] = waiters
+            self._update_depth(priority)
+            return waiter
+        return None
+
+    def _remove(self, priority: Priority, tenant: Optional[str], waiter):
+        waiters = self._queues[priority].get(tenant)
+        if waiters is None:
+            return
+        try:
+            waiters.remove(waiter)
+        except ValueError:
+            pass
+        if len(waiters) == 0:
+            del self._queues[priority][tenant]
+        self._update_depth(priority)
+
+    def _update_depth(self, priority: Priority):
+        metrics.gauge(
+            "engine_queue_depth",
+            "Engine requests waiting for a slot",
+            priority=priority.name.lower(),
+        ).set(self.queue_depth(priority))
+
+
+_scheduler: Optional[EngineScheduler] = None
+
+
+def get_scheduler() -> EngineScheduler:
+    global _scheduler
+    if _scheduler is None:
+        host_slots = None
+        if ENGINE_HOST_MAX_CONCURRENCY > 0:
+            host_slots = HostSlots(ENGINE_HOST_SLOTS_DIR, ENGINE_HOST_MAX_CONCURRENCY)
+        _scheduler = EngineScheduler(
+            ENGINE_MAX_CONCURRENCY, ENGINE_MAX_QUEUE_WAIT, host_slots
+        )
+    return _scheduler
@@ -1,11 +1,10 @@
 from typing import List
 
-from sqlalchemy import select
+from sqlalchemy import delete, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.auth_service.entity import Entity
-from src.environment_management.environment import Environment
-from src.environment_management.environment_version import EnvironmentVersion
+from src.environment_management.environment import EnvironmentDAO
 from src.environment_management.models import Architecture
 
 
@@ -53,19 +52,5 @@ class ArchitectureDAO:
         await self._session.merge(architecture)
 
     async def delete_architecture(self, id: str):
-        stmt = (
-            select(Architecture, EnvironmentVersion, Environment)
-            .select_from(Architecture)
-            .outerjoin(
-                EnvironmentVersion,
-                EnvironmentVersion.architecture_id == Architecture.id,
-            )
-            .outerjoin(Environment, Environment.architecture_id == Architecture.id)
-            .filter(Architecture.id == id)
-        )
-        result = await self._session.execute(statement=stmt)
-        if result is None:
-            return
-        all = result.fetchall()
-        for r in all:
-            await self._session.delete(r[0])
+        await EnvironmentDAO(self._session).delete_environments_for_architecture(id)
+        await self._session.execute(delete(Architecture).where(Architecture.id == id))
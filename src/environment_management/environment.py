@@ -1,9 +1,13 @@
-from typing import List
+from typing import List, Optional
 
-from sqlalchemy import select
+from sqlalchemy import delete, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.environment_management.models import Environment
+from src.environment_management.models import (
+    Environment,
+    EnvironmentVersion,
+    EnvironmentVersionReservation,
+)
 
 
 class EnvironmentAlreadyExistsError(Exception):
@@ -44,32 +48,30 @@ class EnvironmentDAO:
             raise
 
     async def delete_environment(self, architecture_id: str, id: str):
-        stmt = (
-            select(Environment)
-            .where(Environment.architecture_id == architecture_id)
-            .where(Environment.id == id)
-        )
-        result = await self._session.execute(statement=stmt)
-        result = result.fetchone()
-        if result is None:
-            return
-        await self._session.delete(result[0])
+        await self._delete(architecture_id, id)
 
     async def delete_environments_for_architecture(self, architecture_id: str):
-        stmt = select(Environment).where(Environment.architecture_id == architecture_id)
-        results = await self._session.execute(statement=stmt)
-        for result in results.fetchall():
-            await self._session.delete(result[0])
+        await self._delete(architecture_id)
+
+    async def _delete(self, architecture_id: str, id: Optional[str] = None):
+        """
+        Deletes the architecture's environments (or only environment id) with their versions and version
+        counters, one DELETE per table whatever the length of their history. Matching objects loaded in the
+        session are marked deleted, as the ORM cascade of session.delete did.
+        """
+        for model in (EnvironmentVersionReservation, EnvironmentVersion, Environment):
+            stmt = delete(model).where(model.architecture_id == architecture_id)
+            if id is not None:
+                stmt = stmt.where(model.id == id)
+            await self._session.execute(stmt)
 
     async def set_current_version(self, architecture_id: str, id: str, version: int):
         stmt = (
-            select(Environment)
+            update(Environment)
             .where(Environment.architecture_id == architecture_id)
             .where(Environment.id == id)
+            .values(current=version)
         )
         result = await self._session.execute(statement=stmt)
-        result = result.fetchone()
-        if result is None:
+        if result.rowcount == 0:
             raise EnvironmentDoesNotExistError
-        result[0].current = version
-        await self._session.merge(result[0])
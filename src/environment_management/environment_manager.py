@@ -1,8 +1,11 @@
 import uuid
 from datetime import datetime
-from typing import List, Tuple
+from typing import List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.auth_service.entity import Entity
+from src.backend_orchestrator.models import EnvironmentVersionNotLatestError
 from src.constraints.application_constraint import ApplicationConstraint
 from src.constraints.constraint import Constraint, ConstraintOperator, ConstraintScope
 from src.constraints.util import parse_constraints, substitute_name_changes
@@ -14,7 +17,10 @@ from src.engine_service.engine_commands.run import (
 )
 from src.environment_management.architecture import ArchitectureDAO
 from src.environment_management.environment import EnvironmentDAO
-from src.environment_management.environment_version import EnvironmentVersionDAO
+from src.environment_management.environment_version import (
+    EnvironmentVersionDAO,
+    VersionReservation,
+)
 from src.environment_management.models import (
     EnvironmentVersion,
     EnvironmentResourceConfiguration,
@@ -25,6 +31,7 @@ from src.state_manager.architecture_storage import (
 from src.topology.topology import TopologicalChangesNotAllowed
 from src.topology.topology import TopologyDiff
 from src.topology.util import diff_engine_results
+from src.util.db import end_phase, rollback_phase
 from src.util.logging import logger
 
 BASE_ENV_ID = "default"
@@ -57,12 +64,15 @@ class EnvironmentManager:
         env_dao: EnvironmentDAO,
         ev_dao: EnvironmentVersionDAO,
         binary_storage: BinaryStorage,
+        session: Optional[AsyncSession] = None,
     ):
         self.architecture_storage = architecture_storage
         self.arch_dao = arch_dao
         self.env_dao = env_dao
         self.ev_dao = ev_dao
         self.binary_storage = binary_storage
+        # the DAOs' session, committed between phases so no connection is held while the engine runs
+        self.session = session
 
     async def is_in_sync(
         self,
@@ -134,11 +144,11 @@ class EnvironmentManager:
         curr_env: EnvironmentVersion = await self.ev_dao.get_current_version(
             architecture_id, env_id
         )
-        base_state: RunEngineResult = self.architecture_storage.get_state_from_fs(
-            curr_base
+        base_state: RunEngineResult = await self.architecture_storage.get_state_from_fs(
+            curr_base, fields=["resources_yaml"]
         )
-        env_state: RunEngineResult = self.architecture_storage.get_state_from_fs(
-            curr_env
+        env_state: RunEngineResult = await self.architecture_storage.get_state_from_fs(
+            curr_env, fields=["resources_yaml"]
         )
         return diff_engine_results(env_state, base_state, include_properties)
 
@@ -148,6 +158,11 @@ class EnvironmentManager:
         """
         Promote the base environment, for the specified architecture, to the specified environment.
 
+        The engine runs between a read phase and a write phase with no connection held. The read phase
+        reserves the new version number, raising EnvironmentVersionReservedError if another run or promotion
+        holds it. If the environment changed in the meantime anyway, EnvironmentVersionNotLatestError is
+        raised and nothing is written.
+
         Args:
             architecture_id (str): The ID of the architecture.
             base_env_id (str): The ID of the base environment.
@@ -164,7 +179,8 @@ class EnvironmentManager:
             architecture_id, base_env_id, env_id
         )
         if in_sync:
-            curr_state = self.architecture_storage.get_state_from_fs(env_version)
+            await end_phase(self.session)
+            curr_state = await self.architecture_storage.get_state_from_fs(env_version)
             return env_version, curr_state
 
         # Get the current version of the base environment
@@ -193,51 +209,88 @@ class EnvironmentManager:
                 )
 
         overrides_dict = [o.to_dict() for o in overrides]
-        # Get the state of the base environment
-        base_state: RunEngineResult = self.architecture_storage.get_state_from_fs(
-            curr_base
-        )
+        # rejects promotions that could never be written before they start the engine
+        latest = (await self.ev_dao.get_version_head(architecture_id, env_id)).latest
+        reservation = await self.ev_dao.reserve_version(architecture_id, env_id, latest)
+        await end_phase(self.session)
+
+        try:
+            # Get the state of the base environment
+            base_state: RunEngineResult = (
+                await self.architecture_storage.get_state_from_fs(
+                    curr_base, fields=["resources_yaml"]
+                )
+            )
 
-        self.binary_storage.ensure_binary(Binary.ENGINE)
-        request = RunEngineRequest(
-            id=architecture_id,
-            input_graph=base_state.resources_yaml if base_state is not None else None,
-            templates=[],
-            engine_version=1.0,
-            constraints=overrides_dict,
-        )
-        result: RunEngineResult = await run_engine(request)
-        diff: TopologyDiff = diff_engine_results(result, base_state)
-        if diff.contains_differences():
-            raise TopologicalChangesNotAllowed(env_id, constraints=overrides, diff=diff)
+            await self.binary_storage.ensure_binary(Binary.ENGINE)
+            request = RunEngineRequest(
+                id=architecture_id,
+                input_graph=(
+                    base_state.resources_yaml if base_state is not None else None
+                ),
+                templates=[],
+                engine_version=1.0,
+                constraints=overrides_dict,
+            )
+            result: RunEngineResult = await run_engine(request)
+            diff: TopologyDiff = diff_engine_results(result, base_state)
+            if diff.contains_differences():
+                raise TopologicalChangesNotAllowed(
+                    env_id, constraints=overrides, diff=diff
+                )
 
-        env_specific_config = EnvironmentResourceConfiguration.from_dict(
-            env_version.env_resource_configuration
-        )
-        env_specific_config.tracks.version_hash = curr_base.version_hash
-        env_specific_config.diff = diff.__dict__()
-        env_specific_config.overrides = [o.to_dict() for o in overrides]
-        # Create the new environment version
-        new_version = EnvironmentVersion(
-            architecture_id=architecture_id,
-            id=env_id,
-            version=env_version.version + 1,
-            version_hash=str(uuid.uuid4()),
-            constraints=overrides_dict,
-            env_resource_configuration=env_specific_config.to_dict(),
-            created_at=datetime.utcnow(),
-            created_by=requester.to_auth_string(),
-        )
-        location = self.architecture_storage.write_state_to_fs(new_version, result)
-        new_version.state_location = location
+            env_specific_config = EnvironmentResourceConfiguration.from_dict(
+                env_version.env_resource_configuration
+            )
+            env_specific_config.tracks.version_hash = curr_base.version_hash
+            env_specific_config.diff = diff.__dict__()
+            env_specific_config.overrides = [o.to_dict() for o in overrides]
+            # Create the new environment version
+            new_version = EnvironmentVersion(
+                architecture_id=architecture_id,
+                id=env_id,
+                version=reservation.version,
+                version_hash=str(uuid.uuid4()),
+                constraints=overrides_dict,
+                env_resource_configuration=env_specific_config.to_dict(),
+                created_at=datetime.utcnow(),
+                created_by=requester.to_auth_string(),
+            )
+            location = await self.architecture_storage.write_state_to_fs(
+                new_version, result, base=env_version
+            )
+            new_version.state_location = location
 
-        self.ev_dao.add_environment_version(new_version)
-        await self.env_dao.set_current_version(
-            architecture_id, env_id, env_version.version + 1
-        )
-        logger.info(f"Promoted {env_id} to version {env_version.version + 1}")
+            head = await self.ev_dao.get_version_head(architecture_id, env_id)
+            if head.current_hash != env_version.version_hash:
+                raise EnvironmentVersionNotLatestError(
+                    f"Environment {env_id} of architecture {architecture_id} changed while promoting"
+                )
+            self.ev_dao.add_environment_version(new_version)
+            await self.env_dao.set_current_version(
+                architecture_id, env_id, reservation.version
+            )
+            await self.ev_dao.release_version(reservation, written=True)
+            await end_phase(self.session)
+        except Exception:
+            await self._release(reservation)
+            raise
+        logger.info(f"Promoted {env_id} to version {reservation.version}")
         return new_version, result
 
+    async def _release(self, reservation: VersionReservation):
+        # the promotion failed, drop what its write phase did and hand its version number back
+        try:
+            await rollback_phase(self.session)
+            await self.ev_dao.release_version(reservation, written=False)
+            await end_phase(self.session)
+        except Exception:
+            logger.warning(
+                "Could not release %s, it lapses after VERSION_RESERVATION_TTL",
+                reservation,
+                exc_info=True,
+            )
+
     async def get_constraint_list_stream_since_last_promotion(
         self,
         architecture_id: str,
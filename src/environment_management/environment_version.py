@@ -1,9 +1,20 @@
-from typing import List
+import datetime
+import os
+import uuid
+from typing import List, NamedTuple, Optional
 
-from sqlalchemy import select, and_
+from sqlalchemy import and_, delete, func, insert, literal, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.environment_management.models import Environment, EnvironmentVersion
+from src.environment_management.models import (
+    Environment,
+    EnvironmentVersion,
+    EnvironmentVersionReservation,
+)
+
+# Seconds after which a reservation that was neither written nor released (its holder crashed) can be taken over
+VERSION_RESERVATION_TTL = int(os.getenv("VERSION_RESERVATION_TTL", "600"))
 
 
 class EnvironmentVersionAlreadyExistsError(Exception):
@@ -14,6 +25,25 @@ class EnvironmentVersionDoesNotExistError(Exception):
     pass
 
 
+class EnvironmentVersionReservedError(Exception):
+    pass
+
+
+class VersionHead(NamedTuple):
+    # version_hash of the environment's current version
+    current_hash: Optional[str]
+    # highest version number of the environment
+    latest: Optional[int]
+
+
+class VersionReservation(NamedTuple):
+    architecture_id: str
+    id: str
+    # the version number reserved
+    version: int
+    token: str
+
+
 class EnvironmentVersionDAO:
     def __init__(self, session: AsyncSession):
         self._session = session
@@ -51,49 +81,96 @@ class EnvironmentVersionDAO:
         except Exception as e:
             raise e
 
-    async def update_environment_version(self, environment_version: EnvironmentVersion):
+    async def clone_environment_versions(
+        self, source_architecture_id: str, target_architecture_id: str
+    ) -> int:
+        """
+        Copies every version of the source architecture into the target architecture with a single
+        INSERT ... SELECT, so the cost does not depend on the length of the history. The copies reference
+        the same state locations and have no iac. The target's environments must already be added.
+
+        Returns the number of versions copied.
+        """
+        # the environments referenced by the new versions must exist first
+        await self._session.flush()
+        columns = [
+            c.name
+            for c in EnvironmentVersion.__table__.columns
+            if c.name not in ("architecture_id", "iac_location")
+        ]
+        source = select(
+            literal(target_architecture_id).label("architecture_id"),
+            *[EnvironmentVersion.__table__.c[c] for c in columns],
+        ).where(EnvironmentVersion.architecture_id == source_architecture_id)
+        result = await self._session.execute(
+            insert(EnvironmentVersion).from_select(
+                ["architecture_id", *columns], source
+            )
+        )
+        return result.rowcount
+
+    async def list_versions_with_unshared_state(
+        self, architecture_id: str, shared_prefix: str
+    ) -> List[EnvironmentVersion]:
+        """Lists the versions of the architecture whose state is stored outside of shared_prefix."""
         stmt = (
             select(EnvironmentVersion)
+            .where(EnvironmentVersion.architecture_id == architecture_id)
+            .where(EnvironmentVersion.state_location.is_not(None))
+            .where(EnvironmentVersion.state_location.not_like(f"{shared_prefix}%"))
+        )
+        return list(await self._session.scalars(stmt))
+
+    async def update_environment_version(self, environment_version: EnvironmentVersion):
+        """Writes every column of environment_version to its row in a single UPDATE."""
+        values = {
+            c.key: getattr(environment_version, c.key)
+            for c in EnvironmentVersion.__mapper__.column_attrs
+            if not c.columns[0].primary_key
+        }
+        if values["created_at"] is None:
+            # keep the server assigned creation time
+            del values["created_at"]
+        stmt = (
+            update(EnvironmentVersion)
             .where(
                 EnvironmentVersion.architecture_id
                 == environment_version.architecture_id
             )
             .where(EnvironmentVersion.id == environment_version.id)
             .where(EnvironmentVersion.version == environment_version.version)
+            .values(**values)
         )
         result = await self._session.execute(statement=stmt)
-        if result is None:
-            raise EnvironmentVersionDoesNotExistError
-        result = result.fetchone()
-        if result is None:
+        if result.rowcount == 0:
             raise EnvironmentVersionDoesNotExistError
-        await self._session.delete(result[0])
-        self._session.add(environment_version)
 
     async def delete_environment_version(
         self, architecture_id: str, id: str, version: int
     ):
         stmt = (
-            select(EnvironmentVersion)
+            delete(EnvironmentVersion)
             .where(EnvironmentVersion.architecture_id == architecture_id)
             .where(EnvironmentVersion.id == id)
             .where(EnvironmentVersion.version == version)
         )
-        result = await self._session.execute(statement=stmt)
-        result = result.fetchone()
-        if result is not None:
-            await self._session.delete(result[0])
+        await self._session.execute(statement=stmt)
 
     async def get_current_version(
         self, architecture_id: str, id: str
     ) -> EnvironmentVersion:
         stmt = (
             select(EnvironmentVersion)
-            .filter(Environment.architecture_id == architecture_id)
-            .filter(Environment.id == id)
-            .filter(EnvironmentVersion.id == Environment.id)
-            .filter(EnvironmentVersion.architecture_id == Environment.architecture_id)
-            .filter(Environment.current == EnvironmentVersion.version)
+            .join(
+                Environment,
+                and_(
+                    Environment.architecture_id == EnvironmentVersion.architecture_id,
+                    Environment.id == EnvironmentVersion.id,
+                    Environment.current == EnvironmentVersion.version,
+                ),
+            )
+            .where(Environment.architecture_id == architecture_id)
+            .where(Environment.id == id)
         )
         result = await self._session.execute(statement=stmt)
         result = result.fetchone()
@@ -117,16 +194,127 @@ class EnvironmentVersionDAO:
             raise EnvironmentVersionDoesNotExistError
         return result[0]
 
+    async def get_version_head(self, architecture_id: str, id: str) -> VersionHead:
+        """
+        Returns the hash of the current version and the latest version number of the environment. Both are
+        read as plain columns, so objects the session loaded earlier never mask a concurrent change.
+        """
+        latest = (
+            select(func.max(EnvironmentVersion.version))
+            .where(EnvironmentVersion.architecture_id == architecture_id)
+            .where(EnvironmentVersion.id == id)
+            .scalar_subquery()
+        )
+        stmt = (
+            select(EnvironmentVersion.version_hash, latest)
+            .select_from(Environment)
+            .outerjoin(
+                EnvironmentVersion,
+                and_(
+                    EnvironmentVersion.architecture_id == Environment.architecture_id,
+                    EnvironmentVersion.id == Environment.id,
+                    EnvironmentVersion.version == Environment.current,
+                ),
+            )
+            .where(Environment.architecture_id == architecture_id)
+            .where(Environment.id == id)
+        )
+        row = (await self._session.execute(statement=stmt)).fetchone()
+        if row is None:
+            return VersionHead(None, None)
+        return VersionHead(*row)
+
+    async def reserve_version(
+        self, architecture_id: str, id: str, latest: int
+    ) -> VersionReservation:
+        """
+        Reserves version latest + 1 of the environment, where latest is the latest version the caller read.
+
+        The reservation is a single conditional UPDATE ... RETURNING of the environment's counter. It fails
+        with EnvironmentVersionReservedError if another caller holds an unexpired reservation, or if a
+        version after latest was already handed out, so runs that could never be written are rejected before
+        they start the engine. The reservation is visible to others once the session commits, and must be
+        released with release_version whether or not the version is written.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        reservation = VersionReservation(
+            architecture_id, id, latest + 1, uuid.uuid4().hex
+        )
+        counter = EnvironmentVersionReservation
+        stmt = (
+            update(counter)
+            .where(counter.architecture_id == architecture_id)
+            .where(counter.id == id)
+            .where(
+                or_(
+                    and_(counter.reserved_until.is_(None), counter.version <= latest),
+                    counter.reserved_until < now,
+                )
+            )
+            .values(
+                version=reservation.version,
+                token=reservation.token,
+                reserved_until=now
+                + datetime.timedelta(seconds=VERSION_RESERVATION_TTL),
+            )
+            .returning(counter.version)
+            .execution_options(synchronize_session=False)
+        )
+        if (await self._session.execute(stmt)).fetchone() is not None:
+            return reservation
+        # the environment's first reservation creates its counter
+        dialect = (
+            postgresql
+            if self._session.get_bind().dialect.name == "postgresql"
+            else sqlite
+        )
+        stmt = (
+            dialect.insert(counter)
+            .values(
+                architecture_id=architecture_id,
+                id=id,
+                version=reservation.version,
+                token=reservation.token,
+                reserved_until=now
+                + datetime.timedelta(seconds=VERSION_RESERVATION_TTL),
+            )
+            .on_conflict_do_nothing(index_elements=["architecture_id", "id"])
+            .returning(counter.version)
+        )
+        if (await self._session.execute(stmt)).fetchone() is not None:
+            return reservation
+        raise EnvironmentVersionReservedError(
+            f"Version {reservation.version} of environment {id} of architecture {architecture_id} is taken"
+        )
+
+    async def release_version(self, reservation: VersionReservation, written: bool):
+        """
+        Releases a reservation. If the reserved version was not written, the counter is rolled back so the
+        next caller gets the same version number. Does nothing if the reservation lapsed and was taken over.
+        """
+        counter = EnvironmentVersionReservation
+        stmt = (
+            update(counter)
+            .where(counter.architecture_id == reservation.architecture_id)
+            .where(counter.id == reservation.id)
+            .where(counter.token == reservation.token)
+            .values(
+                version=(reservation.version if written else reservation.version - 1),
+                token=None,
+                reserved_until=None,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        await self._session.execute(stmt)
+
     async def delete_future_versions(self, architecture_id: str, id: str, version: int):
         stmt = (
-            select(EnvironmentVersion)
+            delete(EnvironmentVersion)
             .where(EnvironmentVersion.architecture_id == architecture_id)
             .where(EnvironmentVersion.id == id)
             .where(EnvironmentVersion.version > version)
         )
-        result = await self._session.execute(statement=stmt)
-        for r in result.fetchall():
-            await self._session.delete(r[0])
+        await self._session.execute(statement=stmt)
 
     async def get_previous_state(
         self, architecture_id: str, id: str, version: int
@@ -175,14 +363,8 @@ class EnvironmentVersionDAO:
                 and_(
                     EnvironmentVersion.architecture_id == architecture_id,
                     EnvironmentVersion.id == id,
-                    EnvironmentVersion.env_resource_configuration[
-                        ("tracks", "version_hash")
-                    ].as_string()
-                    == tracking_version_hash,
-                    EnvironmentVersion.env_resource_configuration[
-                        ("tracks", "environment")
-                    ].as_string()
-                    == tracking_env,
+                    EnvironmentVersion.tracks_environment == tracking_env,
+                    EnvironmentVersion.tracks_version_hash == tracking_version_hash,
                 )
             )
             .order_by(EnvironmentVersion.version.asc())
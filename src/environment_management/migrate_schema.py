@@ -0,0 +1,46 @@
+"""
+Brings the database schema up to date with the models.
+
+    PYTHONPATH=. python -m src.environment_management.migrate_schema
+
+Creates the missing tables and columns and backfills the new columns in one transaction, serialized with
+other migrations and starting workers by an advisory lock on Postgres. The missing indexes are built after
+it commits, CONCURRENTLY on Postgres so the API keeps writing meanwhile. Run it once per deploy before
+starting the API: the workers only create missing tables.
+"""
+
+import argparse
+import asyncio
+import logging
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from src.environment_management.models import ModelsBase, migrate_columns
+from src.util.db import create_missing_indexes
+
+log = logging.getLogger(__name__)
+
+
+async def migrate_schema(engine: AsyncEngine):
+    async with engine.begin() as conn:
+        await conn.run_sync(migrate_columns)
+    log.info("tables and columns are up to date, building missing indexes")
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.run_sync(create_missing_indexes, ModelsBase.metadata)
+
+
+async def main():
+    from src.dependency_injection.injection import engine
+
+    argparse.ArgumentParser(description=__doc__.splitlines()[1]).parse_args()
+    logging.basicConfig(level=logging.INFO)
+    try:
+        await migrate_schema(engine)
+    finally:
+        await engine.dispose()
+    print("schema is up to date")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
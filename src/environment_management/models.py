@@ -1,11 +1,19 @@
 import datetime
-from typing import List
+from typing import List, Optional
 
-from sqlalchemy import DateTime
-from sqlalchemy import JSON, ForeignKey, ForeignKeyConstraint
-from sqlalchemy.orm import Mapped, mapped_column, DeclarativeBase, relationship
+from sqlalchemy import Connection, DateTime, update
+from sqlalchemy import JSON, ForeignKey, ForeignKeyConstraint, Index
+from sqlalchemy.orm import (
+    Mapped,
+    mapped_column,
+    DeclarativeBase,
+    relationship,
+    validates,
+)
 from sqlalchemy.sql import func
 
+from src.util.db import add_missing_columns, lock_schema
+
 
 class EnvironmentTracker:
     def __init__(self, environment: str = "", version_hash: str = ""):
@@ -82,6 +90,9 @@ class Environment(ModelsBase):
     versions = relationship(
         "EnvironmentVersion", backref="environment", cascade="all, delete-orphan"
     )
+    version_reservation = relationship(
+        "EnvironmentVersionReservation", cascade="all, delete-orphan"
+    )
 
     def allows_topological_changes(self):
         if self.tags is None:
@@ -122,6 +133,9 @@ class EnvironmentVersion(ModelsBase):
     )
     created_by: Mapped[str]
     constraints: Mapped[dict] = mapped_column(nullable=True, type_=JSON)
+    # copies of env_resource_configuration's tracks, so versions can be looked up by what they track
+    tracks_environment: Mapped[str] = mapped_column(nullable=True)
+    tracks_version_hash: Mapped[str] = mapped_column(nullable=True)
 
     __table_args__ = (
         ForeignKeyConstraint(
@@ -131,6 +145,13 @@ class EnvironmentVersion(ModelsBase):
         {},
     )
 
+    @validates("env_resource_configuration")
+    def _sync_tracks(self, key: str, value: Optional[dict]) -> Optional[dict]:
+        tracks = (value or {}).get("tracks") or {}
+        self.tracks_environment = tracks.get("environment")
+        self.tracks_version_hash = tracks.get("version_hash")
+        return value
+
     def __eq__(self, __value: object) -> bool:
         if not isinstance(__value, EnvironmentVersion):
             return False
@@ -153,6 +174,63 @@ class EnvironmentVersion(ModelsBase):
         return f"environment_version:{self.composite_id()}"
 
 
+# Newest-first lookups of an environment's versions (latest, previous, next and the current version join). On
+# Postgres the hash is included so version head checks are answered from the index alone.
+Index(
+    "ix_environment_versions_latest",
+    EnvironmentVersion.architecture_id,
+    EnvironmentVersion.id,
+    EnvironmentVersion.version.desc(),
+    postgresql_include=["version_hash"],
+)
+# Lookups of an environment's versions by hash (e.g. the versions after the one a promotion tracked)
+Index(
+    "ix_environment_versions_version_hash",
+    EnvironmentVersion.architecture_id,
+    EnvironmentVersion.id,
+    EnvironmentVersion.version_hash,
+    EnvironmentVersion.version.desc(),
+)
+# The versions of an environment tracking a version of another, in order (promotion overrides)
+Index(
+    "ix_environment_versions_tracks",
+    EnvironmentVersion.architecture_id,
+    EnvironmentVersion.id,
+    EnvironmentVersion.tracks_environment,
+    EnvironmentVersion.tracks_version_hash,
+    EnvironmentVersion.version,
+)
+
+
+class EnvironmentVersionReservation(ModelsBase):
+    """
+    The per-environment version counter runs and promotions reserve their version number from before they
+    start the engine, see EnvironmentVersionDAO.reserve_version. Kept in its own table so create_all adds
+    it to existing databases.
+    """
+
+    __tablename__ = "environment_version_reservations"
+
+    architecture_id: Mapped[str] = mapped_column(primary_key=True)
+    id: Mapped[str] = mapped_column(primary_key=True)
+    # highest version number handed out
+    version: Mapped[int] = mapped_column()
+    # holder of the reservation of version, None once it is written or released
+    token: Mapped[str] = mapped_column(nullable=True)
+    # when an unreleased reservation lapses and can be taken over
+    reserved_until: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ["architecture_id", "id"],
+            [Environment.architecture_id, Environment.id],
+        ),
+        {},
+    )
+
+
 class Architecture(ModelsBase):
     __tablename__ = "architectures"
 
@@ -180,3 +258,38 @@ class Architecture(ModelsBase):
 
     def __str__(self):
         return f"architecture:{self.id}"
+
+
+def backfill_tracking_columns(connection: Connection):
+    """Fills the tracks columns of versions written before they existed from env_resource_configuration."""
+    table = EnvironmentVersion.__table__
+    config = table.c.env_resource_configuration
+    connection.execute(
+        update(table)
+        .where(table.c.tracks_version_hash.is_(None))
+        .where(config.is_not(None))
+        .values(
+            tracks_environment=config[("tracks", "environment")].as_string(),
+            tracks_version_hash=config[("tracks", "version_hash")].as_string(),
+        )
+    )
+
+
+def create_schema(connection: Connection):
+    """
+    Creates the missing tables, serialized with other processes doing the same so concurrent workers starting
+    up do not race each other. Existing tables are left to migrate_columns.
+    """
+    lock_schema(connection)
+    ModelsBase.metadata.create_all(connection)
+
+
+def migrate_columns(connection: Connection):
+    """
+    Creates the missing tables, then the columns declared after their table was created, and backfills new
+    columns. Runs in the caller's transaction, so new columns are never seen unfilled.
+    """
+    create_schema(connection)
+    added = add_missing_columns(connection, ModelsBase.metadata)
+    if "environment_versions.tracks_version_hash" in added:
+        backfill_tracking_columns(connection)
@@ -5,7 +5,7 @@ from contextlib import asynccontextmanager
 from typing import Annotated, Optional, Callable
 
 import jsons
-from fastapi import FastAPI, Response, Header, HTTPException
+from fastapi import BackgroundTasks, FastAPI, Response, Header, HTTPException
 from fastapi import Request
 from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import JSONResponse
@@ -23,6 +23,7 @@ from src.backend_orchestrator.environments_api import router as environments_rou
 from src.backend_orchestrator.get_valid_edge_targets_handler import (
     CopilotGetValidEdgeTargetsRequest,
 )
+from src.backend_orchestrator.iac_handler import IAC_PREGENERATE
 from src.backend_orchestrator.models import (
     EnvironmentVersionNotLatestError,
     CreateArchitectureRequest,
@@ -38,6 +39,7 @@ from src.chat.conversation import Message
 from src.chat.explain_architecture import ExplainArchitecture
 from src.chat.explain_diff import ExplainDiff
 from src.dependency_injection.injection import (
+    PhasedSessionLocal,
     SessionLocal,
     get_architecture_handler,
     get_architecture_storage,
@@ -50,25 +52,36 @@ from src.dependency_injection.injection import (
     get_architecture_manager,
     get_auth0_manager,
     get_teams_manager,
+    configure_run_cache,
+    configure_s3_clients,
+    configure_single_flight,
     deps,
 )
+from src.engine_service.engine_commands.pool import close_worker_pools
+from src.engine_service.scheduler import EngineOverloadedError
 from src.environment_management.environment_version import (
     EnvironmentVersionDAO,
     EnvironmentVersionDoesNotExistError,
+    EnvironmentVersionReservedError,
 )
 from src.state_manager.architecture_storage import ArchitectureStateDoesNotExistError
 from src.topology.topology import TopologicalChangesNotAllowed
 from src.util.logging import logger
+from src.util.metrics import metrics
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await get_db()
+    configure_s3_clients()
+    configure_run_cache()
+    configure_single_flight()
     deps.fga_manager = await get_fga_manager()
     deps.auth0_manager = get_auth0_manager()
     deps.authz_service = await get_authz_service()
     deps.architecture_manager = await get_architecture_manager()
     yield
+    await close_worker_pools()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -85,6 +98,11 @@ async def ping():
     return Response(status_code=204)
 
 
+@app.get("/api/metrics")
+async def get_metrics():
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.post("/api/architecture")
 async def new_architecture(
     request: Request,
@@ -289,7 +307,14 @@ async def export_iac(
                 },
             )
         iac_handler = get_iac_orchestrator(db)
-        return await iac_handler.get_iac(id, env_id, state, accept)
+        return await iac_handler.get_iac(
+            id, env_id, state, accept, byte_range=request.headers.get("range")
+        )
+
+
+async def pregenerate_iac(id: str, env_id: str):
+    async with SessionLocal.begin() as db:
+        await get_iac_orchestrator(db).pregenerate_iac(id, env_id)
 
 
 @app.post("/api/architecture/{id}/environment/{env_id}/run")
@@ -299,8 +324,9 @@ async def run(
     env_id,
     state: int,
     body: CopilotRunRequest,
+    background_tasks: BackgroundTasks,
 ):
-    async with SessionLocal.begin() as db:
+    async with PhasedSessionLocal() as db:
         authz: AuthzService = deps.authz_service
         user_id = await get_user_id(request)
         authorized = await authz.can_write_to_architecture(User(id=user_id), id)
@@ -314,7 +340,11 @@ async def run(
             )
         accept = request.headers.get("accept")
         engine = get_engine_orchestrator(db)
-        return await engine.run(id, env_id, state, body, accept)
+        response = await engine.run(id, env_id, state, body, accept)
+    if IAC_PREGENERATE and response.status_code == 200:
+        # runs once the response is sent, after the new version is committed
+        background_tasks.add_task(pregenerate_iac, id, env_id)
+    return response
 
 
 @app.post("/api/architecture/{id}/environment/{env_id}/valid-edge-targets")
@@ -344,11 +374,19 @@ async def get_valid_edge_targets(
         )
 
 
+def split_fields(fields: Optional[str]) -> Optional[list[str]]:
+    """Parses a comma separated ?fields= query parameter."""
+    if not fields:
+        return None
+    return [f.strip() for f in fields.split(",") if f.strip()]
+
+
 @app.get("/api/architecture/{id}/environment/{env_id}")
 async def get_current_version(
     request: Request,
     id: str,
     env_id: str,
+    fields: Optional[str] = None,
 ):
     async with SessionLocal.begin() as db:
         authz: AuthzService = deps.authz_service
@@ -364,7 +402,9 @@ async def get_current_version(
             )
         accept = request.headers.get("accept")
         arch_handler = get_architecture_handler(db)
-        return await arch_handler.get_version(id, env_id, accept)
+        return await arch_handler.get_version(
+            id, env_id, accept, fields=split_fields(fields)
+        )
 
 
 class SetCurrentVersionRequest(BaseModel):
@@ -400,6 +440,7 @@ async def get_previous_state(
     id: str,
     env_id: str,
     version: int,
+    fields: Optional[str] = None,
 ):
     async with SessionLocal.begin() as db:
         authz: AuthzService = deps.authz_service
@@ -416,7 +457,7 @@ async def get_previous_state(
         accept = request.headers.get("accept")
         arch_handler = get_architecture_handler(db)
         return await arch_handler.get_environments_previous_state(
-            id, env_id, version, accept
+            id, env_id, version, accept, fields=split_fields(fields)
         )
 
 
@@ -426,6 +467,7 @@ async def get_next_state(
     id: str,
     env_id: str,
     version: int,
+    fields: Optional[str] = None,
 ):
     async with SessionLocal.begin() as db:
         authz: AuthzService = deps.authz_service
@@ -442,7 +484,7 @@ async def get_next_state(
         accept = request.headers.get("accept")
         arch_handler = get_architecture_handler(db)
         return await arch_handler.get_environments_next_state(
-            id, env_id, version, accept
+            id, env_id, version, accept, fields=split_fields(fields)
         )
 
 
@@ -474,6 +516,36 @@ def handle_auth_error(ex: AuthError):
     return response
 
 
+@app.exception_handler(EngineOverloadedError)
+async def handle_engine_overloaded(request: Request, ex: EngineOverloadedError):
+    return JSONResponse(
+        content={"detail": "The engine is busy, please try again shortly"},
+        status_code=503,
+        headers={"Retry-After": str(ex.retry_after)},
+    )
+
+
+@app.exception_handler(EnvironmentVersionNotLatestError)
+async def handle_version_not_latest(
+    request: Request, ex: EnvironmentVersionNotLatestError
+):
+    return JSONResponse(
+        content={"detail": "Environment version is not the latest"}, status_code=400
+    )
+
+
+@app.exception_handler(EnvironmentVersionReservedError)
+async def handle_version_reserved(
+    request: Request, ex: EnvironmentVersionReservedError
+):
+    return JSONResponse(
+        content={
+            "detail": "The environment is being changed by another run, please try again"
+        },
+        status_code=409,
+    )
+
+
 if os.getenv("PROFILING", "false").lower() == "true":
 
     @app.on_event("startup")
@@ -570,7 +642,7 @@ async def message_conversation(
     # if body.message_id is None or body.message_id == "":
     #     body.message_id = str(uuid.uuid4())
 
-    async with SessionLocal.begin() as db:
+    async with PhasedSessionLocal() as db:
         try:
             engine = get_engine_orchestrator(db)
             payload, engine_failure = await engine.handle_message(
@@ -597,10 +669,6 @@ async def message_conversation(
                 },
                 content=payload.model_dump(mode="json"),
             )
-        except EnvironmentVersionNotLatestError:
-            raise HTTPException(
-                status_code=400, detail="Environment version is not the latest"
-            )
         except TopologicalChangesNotAllowed as e:
             content = {
                 "error_type": e.error_type,
@@ -621,7 +689,12 @@ async def message_conversation(
                 status_code=404,
                 detail=f"No environment version exists for id {id} environment {env_id} and version {body.version}",
             )
-        except HTTPException:
+        except (
+            HTTPException,
+            EngineOverloadedError,
+            EnvironmentVersionNotLatestError,
+            EnvironmentVersionReservedError,
+        ):
             raise
         except Exception:
             logger.error("Error running engine", exc_info=True)
@@ -701,7 +774,9 @@ async def explain_architecture(
             ev_dao = EnvironmentVersionDAO(db)
             env_version = await ev_dao.get_current_version(id, env_id)
             store = get_architecture_storage()
-            state = store.get_state_from_fs(env_version)
+            state = await store.get_state_from_fs(
+                env_version, fields=["resources_yaml"]
+            )
             if state is None:
                 raise ArchitectureStateDoesNotExistError(
                     f"State for architecture {id} and environment {env_id} does not exist"
@@ -2,23 +2,64 @@ from typing import Optional
 import logging
 from botocore.exceptions import ClientError
 from src.engine_service.engine_commands.run import RunEngineResult
-import jsons
 from src.environment_management.environment_version import EnvironmentVersion
 import logging
-from typing import Optional
+import asyncio
+import functools
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable, Iterable, Optional
 
-import jsons
 from botocore.exceptions import ClientError
 
 from src.engine_service.engine_commands.run import RunEngineResult
 from src.environment_management.environment_version import EnvironmentVersion
+from src.state_manager.state_cache import StateCache
+from src.state_manager.state_format import (
+    BINARY_STATE_FILE,
+    CAS_PREFIX,
+    JSON_STATE_FILE,
+    MANIFEST_FILE,
+    STATE_FIELDS,
+    Part,
+    alternate_keys,
+    blob_key,
+    can_extend,
+    chain,
+    check_fields,
+    content_addressed,
+    decode_chain,
+    decode_manifest,
+    decode_state,
+    delta_history,
+    delta_key,
+    encode_delta,
+    encode_manifest,
+    encode_state,
+    key_digest,
+    manifest_key,
+    merge_fields,
+    part_digest,
+    relocate_key,
+    select_fields,
+    state_file_name,
+    version_path,
+    version_paths,
+)
 
 logger = logging.getLogger(__name__)
 
-from src.util.aws.s3 import put_object, get_object, delete_objects
+from src.util.aws.s3 import put_object, get_object, delete_objects, run_in_s3_pool
+from src.util.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
+IAC_CHUNK_SIZE = 64 * 1024
+# Seconds after which a reused content-addressed object is refreshed, must be well below the grace period
+# of the state garbage collector
+CAS_REFRESH_AFTER = int(os.getenv("CAS_REFRESH_AFTER", str(60 * 60)))
+
 
 class ArchitectureStateDoesNotExistError(Exception):
     pass
@@ -32,114 +73,582 @@ class WriteIacError(Exception):
     pass
 
 
+class IacRangeNotSatisfiableError(Exception):
+    pass
+
+
+@dataclass
+class IacDownload:
+    chunks: AsyncIterator[bytes]
+    # bytes in chunks, if known
+    content_length: Optional[int] = None
+    # "bytes <first>-<last>/<size>" when only a range of the iac was requested
+    content_range: Optional[str] = None
+
+
 class ArchitectureStorage:
-    def __init__(self, bucket):
+    def __init__(self, bucket, state_cache: Optional[StateCache] = None):
         self._bucket = bucket
+        self._state_cache = state_cache
 
-    def get_state_from_fs(self, arch: EnvironmentVersion) -> Optional[RunEngineResult]:
+    async def get_state_from_fs(
+        self, arch: EnvironmentVersion, fields: Optional[Iterable[str]] = None
+    ) -> Optional[RunEngineResult]:
+        """
+        Returns the state of the environment version, or None for the initial empty version.
+
+        :param fields: The RunEngineResult fields to read, all of them by default. Fields that are not
+            selected are left empty, and for split states their parts are not downloaded at all.
+        """
+        fields = check_fields(fields)
         if arch.state_location == None and arch.version == 0:
             return None
         elif arch.state_location == None:
             raise ArchitectureStateDoesNotExistError(
                 f"No architecture exists for id {arch.id} and state {arch.version}"
             )
-        try:
-            obj = self._bucket.Object(arch.state_location)
-            state_raw = get_object(obj)
-            if state_raw is None:
-                raise ArchitectureStateDoesNotExistError(
-                    f"No architecture exists at location: {arch.state_location}"
+        if arch.state_location.endswith("/" + MANIFEST_FILE):
+            return await self._get_split_state(arch, fields)
+        state = await self._cached(
+            arch.state_location,
+            arch.version_hash,
+            lambda: self._read_state_object(arch.state_location),
+        )
+        return select_fields(state, fields)
+
+    async def _get_split_state(
+        self, arch: EnvironmentVersion, fields: tuple[str, ...]
+    ) -> RunEngineResult:
+        manifest: Optional[dict[str, str]] = None
+        manifest_lock = asyncio.Lock()
+
+        async def read_part(field: str) -> RunEngineResult:
+            nonlocal manifest
+            async with manifest_lock:
+                if manifest is None:
+                    manifest = decode_manifest(
+                        await self._read_object(arch.state_location)
+                    )
+            if field not in manifest:
+                return RunEngineResult(
+                    resources_yaml="", topology_yaml="", iac_topology=""
                 )
-            data = jsons.loads(state_raw)
-            return RunEngineResult(
-                resources_yaml=data.get("resources_yaml", ""),
-                topology_yaml=data.get("topology_yaml", ""),
-                iac_topology=data.get("iac_topology", ""),
-                config_errors=data.get("config_errors_json", []),
-            )
-        except FileNotFoundError as e:
+            return await self._read_part(field, manifest[field])
+
+        parts = await asyncio.gather(
+            *[
+                self._cached(
+                    f"{arch.state_location}#{field}",
+                    arch.version_hash,
+                    functools.partial(read_part, field),
+                )
+                for field in fields
+            ]
+        )
+        return merge_fields(dict(zip(fields, parts)))
+
+    async def _cached(
+        self,
+        location: str,
+        version_hash: Optional[str],
+        load: Callable[[], Awaitable[RunEngineResult]],
+    ) -> RunEngineResult:
+        if self._state_cache is None:
+            return await load()
+        cache_key = StateCache.key(location, version_hash)
+        cached = await self._state_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        state = await load()
+        await self._state_cache.put(cache_key, state)
+        return state
+
+    async def _read_part(self, field: str, part: Part) -> RunEngineResult:
+        if isinstance(part, str):
+            return await self._read_state_object(part)
+        # a delta chain is immutable, so the rebuilt field is cached under its last key for every
+        # version that shares it and for the next write that extends it
+        return await self._cached(
+            part[-1], None, functools.partial(self._rebuild, field, part)
+        )
+
+    async def _rebuild(self, field: str, part: list[str]) -> RunEngineResult:
+        objects = await asyncio.gather(*[self._read_object(key) for key in part])
+        return decode_chain(field, objects[0], objects[1:], key_digest(part[-1]))
+
+    async def get_manifest(self, location: str) -> dict[str, Part]:
+        """
+        Returns the parts of a split state, mapping each field to the location of its part or, for a delta
+        encoded field, to the locations of its snapshot and deltas.
+        """
+        return decode_manifest(await self._read_object(location))
+
+    async def _read_state_object(self, key: str) -> RunEngineResult:
+        return decode_state(await self._read_object(key))
+
+    async def _read_object(self, key: str) -> bytes:
+        try:
+            return await self._read_key(key)
+        except ArchitectureStateDoesNotExistError:
+            # the object may have been moved to another key layout after the location was read
+            for alternate in alternate_keys(key):
+                try:
+                    raw = await self._read_key(alternate)
+                except ArchitectureStateDoesNotExistError:
+                    continue
+                _count_relocated_read()
+                return raw
+            raise
+
+    async def _read_key(self, key: str) -> bytes:
+        try:
+            obj = self._bucket.Object(key)
+            raw = await run_in_s3_pool(get_object, obj)
+        except FileNotFoundError:
             raise ArchitectureStateDoesNotExistError(
-                f"No architecture exists at location: {arch.state_location}"
+                f"No architecture exists at location: {key}"
             )
         except ClientError as err:
             # This is only necessary because Klotho's fs implementation
             # doesn't convert this to FileNotFoundError
             if err.response["Error"]["Code"] == "NoSuchKey":
                 raise ArchitectureStateDoesNotExistError(
-                    f"No architecture exists at location: {arch.state_location}"
+                    f"No architecture exists at location: {key}"
                 )
             raise
+        if raw is None:
+            raise ArchitectureStateDoesNotExistError(
+                f"No architecture exists at location: {key}"
+            )
+        return raw
 
-    def get_iac_from_fs(self, arch: EnvironmentVersion) -> Optional[bytes]:
+    async def get_iac_from_fs(self, arch: EnvironmentVersion) -> Optional[bytes]:
         if arch.iac_location is None:
             return None
-        try:
-            obj = self._bucket.Object(arch.iac_location)
-            iac_raw = get_object(obj)
-            if iac_raw is None:
-                raise ArchitectureStateDoesNotExistError(
-                    f"No architecture exists at location: {arch.iac_location}"
-                )
-            if isinstance(iac_raw, str):
-                iac_raw = iac_raw.encode()
-            return iac_raw
+        iac_raw = await self._read_object(arch.iac_location)
+        if isinstance(iac_raw, str):
+            iac_raw = iac_raw.encode()
+        return iac_raw
 
-        except FileNotFoundError:
+    async def get_iac_stream(
+        self, arch: EnvironmentVersion, chunk_size: int = IAC_CHUNK_SIZE
+    ) -> Optional[AsyncIterator[bytes]]:
+        """Returns the iac as an iterator of chunks read from S3, or None if it has not been generated."""
+        download = await self.open_iac(arch, chunk_size=chunk_size)
+        return download.chunks if download is not None else None
+
+    async def open_iac(
+        self,
+        arch: EnvironmentVersion,
+        byte_range: Optional[str] = None,
+        chunk_size: int = IAC_CHUNK_SIZE,
+    ) -> Optional[IacDownload]:
+        """
+        Opens the iac for streaming, or returns None if it has not been generated.
+
+        :param byte_range: An HTTP Range header value ("bytes=0-1023", "bytes=1024-" or "bytes=-1024") to
+            only read part of the iac.
+        """
+        if arch.iac_location is None:
+            return None
+        kwargs = {} if byte_range is None else {"Range": byte_range}
+        for i, key in enumerate(
+            [arch.iac_location, *alternate_keys(arch.iac_location)]
+        ):
+            try:
+                response = await run_in_s3_pool(self._bucket.Object(key).get, **kwargs)
+                break
+            except ClientError as err:
+                if err.response["Error"]["Code"] == "InvalidRange":
+                    raise IacRangeNotSatisfiableError(
+                        f"Range {byte_range} is outside of {key}"
+                    )
+                if err.response["Error"]["Code"] != "NoSuchKey":
+                    raise
+        else:
             raise ArchitectureStateDoesNotExistError(
                 f"No architecture exists at location: {arch.iac_location}"
             )
+        if i > 0:
+            _count_relocated_read()
+        return IacDownload(
+            chunks=_iter_body(response["Body"], chunk_size),
+            content_length=response.get("ContentLength"),
+            content_range=response.get("ContentRange") if byte_range else None,
+        )
+
+    def get_iac_url(
+        self, arch: EnvironmentVersion, expires_in: int, filename: str
+    ) -> Optional[str]:
+        """
+        Returns a presigned URL downloading the iac as filename, or None if it has not been generated or the
+        storage backend cannot presign URLs.
+        """
+        client = getattr(getattr(self._bucket, "meta", None), "client", None)
+        if arch.iac_location is None or client is None:
+            return None
+        # signing is local, no request is made
+        return client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self._bucket.name,
+                "Key": arch.iac_location,
+                "ResponseContentDisposition": f"attachment; filename={filename}",
+                "ResponseContentType": "application/x-zip-compressed",
+            },
+            ExpiresIn=expires_in,
+        )
+
+    async def generated_iac_exists(self, arch: EnvironmentVersion) -> bool:
+        """Returns whether iac has already been written for this version at its default location."""
+        try:
+            obj = self._bucket.Object(ArchitectureStorage.get_iac_location(arch))
+            await run_in_s3_pool(obj.load)
         except ClientError as err:
-            # This is only necessary because Klotho's fs implementation
-            # doesn't convert this to FileNotFoundError
-            if err.response["Error"]["Code"] == "NoSuchKey":
-                raise ArchitectureStateDoesNotExistError(
-                    f"No architecture exists at location: {arch.iac_location}"
-                )
+            if err.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return False
             raise
+        if arch.created_at is None:
+            return True
+        # version numbers are reused after an overwrite, iac written before this version is someone else's
+        created_at = arch.created_at
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        return obj.last_modified >= created_at
 
-    def write_state_to_fs(
-        self, arch: EnvironmentVersion, content: RunEngineResult
+    async def write_state_to_fs(
+        self,
+        arch: EnvironmentVersion,
+        content: RunEngineResult,
+        base: Optional[EnvironmentVersion] = None,
     ) -> str:
-        key = ArchitectureStorage.get_path_for_architecture(arch) + "/state.json"
+        """
+        Writes the state of the version and returns its location.
+
+        :param base: The version the state was built from. With STATE_HISTORY=delta, changed fields are
+            stored as deltas against the base's fields.
+        """
+        path = ArchitectureStorage.get_path_for_architecture(arch)
         try:
             if not isinstance(content, RunEngineResult):
                 raise TypeError(
                     f"content must be of type RunEngineResult, not {type(content)}"
                 )
-            obj = self._bucket.Object(key)
-            put_object(obj, bytes(jsons.dumps(content), "utf-8"))
+            key = await self._write_state(
+                path,
+                content,
+                base_location=base.state_location if base is not None else None,
+            )
+        except Exception as e:
+            raise WriteStateError(
+                f"Failed to write state to S3 bucket {self._bucket.name} and path {path}: {e}"
+            )
+        await self._evict(key, arch.version_hash)
+        return key
+
+    async def _write_state(
+        self,
+        path: str,
+        content: RunEngineResult,
+        state_format: str = None,
+        base_location: Optional[str] = None,
+    ) -> str:
+        """Writes the state under path in the configured format and returns its location."""
+        if content_addressed(state_format):
+            return await self._write_content_addressed_state(content, base_location)
+        key = f"{path}/{state_file_name(state_format)}"
+        if not key.endswith("/" + MANIFEST_FILE):
+            await run_in_s3_pool(
+                put_object,
+                self._bucket.Object(key),
+                encode_state(content, state_format=state_format),
+            )
             return key
+        parts = {field: f"{path}/parts/{field}.bin" for field in STATE_FIELDS}
+        await asyncio.gather(
+            *[
+                run_in_s3_pool(
+                    put_object,
+                    self._bucket.Object(part),
+                    encode_state(content, state_format="binary", fields=[field]),
+                )
+                for field, part in parts.items()
+            ]
+        )
+        # the manifest is written last so a readable manifest always has all of its parts
+        await run_in_s3_pool(
+            put_object, self._bucket.Object(key), encode_manifest(parts)
+        )
+        return key
+
+    async def _write_content_addressed_state(
+        self, content: RunEngineResult, base_location: Optional[str] = None
+    ) -> str:
+        """
+        Writes the parts and manifest of the state under the hash of their content, skipping any that are
+        already stored, and returns the location of the manifest.
+        """
+        base_parts = {}
+        if delta_history() and ArchitectureStorage.is_shared_location(base_location):
+            try:
+                base_parts = await self.get_manifest(base_location)
+            except ArchitectureStateDoesNotExistError:
+                logger.warning("Base state %s does not exist", base_location)
+        fields = list(STATE_FIELDS)
+        written = await asyncio.gather(
+            *[
+                self._write_part(content, field, base_parts.get(field))
+                for field in fields
+            ]
+        )
+        manifest = encode_manifest(dict(zip(fields, written)))
+        key = manifest_key(manifest)
+        await self._put_if_absent(key, lambda: manifest)
+        return key
+
+    async def _write_part(
+        self, content: RunEngineResult, field: str, base: Optional[Part]
+    ) -> Part:
+        digest = part_digest(content, field)
+        if isinstance(base, list) and key_digest(base[-1]) == digest:
+            # the chain is referenced by the base version's manifest, so it is already live
+            return base
+        encode_full = functools.partial(
+            encode_state, content, state_format="binary", fields=[field]
+        )
+        if can_extend(field, base):
+            base_state = await self._read_part(field, base)
+            # diffing large documents takes a while, keep it off the event loop
+            delta = await asyncio.to_thread(
+                encode_delta, getattr(base_state, field), getattr(content, field)
+            )
+            full = encode_full()
+            encode_full = lambda: full
+            # a delta that saves little is not worth the longer chain
+            if len(delta) * 2 < len(full):
+                part = [*chain(base), delta_key(digest, key_digest(chain(base)[-1]))]
+                await self._put_if_absent(part[-1], lambda: delta)
+                metrics.counter(
+                    "state_deltas_written_total", "State fields written as deltas"
+                ).inc()
+                if self._state_cache is not None:
+                    await self._state_cache.put(
+                        StateCache.key(part[-1], None), select_fields(content, [field])
+                    )
+                return part
+        key = blob_key(digest)
+        await self._put_if_absent(key, encode_full)
+        return key
+
+    async def _put_if_absent(self, key: str, data: Callable[[], bytes]):
+        """
+        Uploads a content-addressed object unless it already exists. Existing objects that are about to
+        become old enough for garbage collection are refreshed, so a collection running concurrently with
+        this write cannot delete an object the new state is about to reference.
+        """
+        obj = self._bucket.Object(key)
+        try:
+            await run_in_s3_pool(obj.load)
+        except ClientError as err:
+            if err.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                raise
+            await run_in_s3_pool(put_object, obj, data())
+            metrics.counter(
+                "state_objects_written_total",
+                "Content-addressed state objects uploaded",
+            ).inc()
+            return
+        metrics.counter(
+            "state_objects_reused_total",
+            "Content-addressed state objects that were already stored",
+        ).inc()
+        age = datetime.now(timezone.utc) - obj.last_modified
+        if age > timedelta(seconds=CAS_REFRESH_AFTER):
+            await run_in_s3_pool(
+                obj.copy_from,
+                CopySource={"Bucket": obj.bucket_name, "Key": key},
+                MetadataDirective="REPLACE",
+            )
+
+    async def _evict(self, location: str, version_hash: Optional[str]):
+        if self._state_cache is None:
+            return
+        await self._state_cache.delete(StateCache.key(location, version_hash))
+        for field in STATE_FIELDS:
+            await self._state_cache.delete(
+                StateCache.key(f"{location}#{field}", version_hash)
+            )
+
+    async def share_state(self, arch: EnvironmentVersion) -> str:
+        """
+        Returns a location holding the state of the version that other versions can reference.
+
+        Content-addressed states are immutable and returned as is. States stored under a version's path
+        can be rewritten by an overwriting run, so they are copied into the content-addressed store.
+        """
+        if ArchitectureStorage.is_shared_location(arch.state_location):
+            return arch.state_location
+        state = await self.get_state_from_fs(arch)
+        try:
+            return await self._write_content_addressed_state(state)
         except Exception as e:
             raise WriteStateError(
-                f"Failed to write state to S3 bucket {self._bucket.name} and key {key}: {e}"
+                f"Failed to share state {arch.state_location} in S3 bucket {self._bucket.name}: {e}"
             )
 
-    def write_iac_to_fs(self, arch: EnvironmentVersion, content: bytes) -> str:
-        key = ArchitectureStorage.get_path_for_architecture(arch) + "/iac.zip"
+    @staticmethod
+    def is_shared_location(location: Optional[str]) -> bool:
+        return location is not None and location.startswith(f"{CAS_PREFIX}/")
+
+    async def convert_state(self, location: str) -> str:
+        """
+        Rewrites a legacy state.json object next to it in the binary format and returns the new location.
+        The legacy object is left in place, callers delete it once nothing references it.
+        """
+        if not location.endswith("/" + JSON_STATE_FILE):
+            return location
+        try:
+            raw = await run_in_s3_pool(get_object, self._bucket.Object(location))
+            return await self._write_state(
+                location[: -len(JSON_STATE_FILE) - 1],
+                decode_state(raw),
+                state_format="binary",
+            )
+        except Exception as e:
+            raise WriteStateError(
+                f"Failed to convert state {location} in S3 bucket {self._bucket.name}: {e}"
+            )
+
+    async def relocate(
+        self, location: str, layout: str = None
+    ) -> tuple[str, list[str]]:
+        """
+        Copies the object at location, stored under a version's path, to the same path in another key layout.
+        The parts of split states are copied along and the copied manifest points at them.
+
+        Returns the new location and the keys that were copied. The old objects are left in place, callers
+        delete them once nothing references them.
+        """
+        new_location = relocate_key(location, layout)
+        if new_location == location:
+            return location, []
+        copied = [location]
+        try:
+            if location.endswith("/" + MANIFEST_FILE):
+                parts = await self.get_manifest(location)
+                moved = {
+                    field: relocate_key(part, layout) if isinstance(part, str) else part
+                    for field, part in parts.items()
+                }
+                sources = [f for f in parts if moved[f] != parts[f]]
+                await asyncio.gather(*[self._copy(parts[f], moved[f]) for f in sources])
+                copied.extend(parts[f] for f in sources)
+                # the manifest is written last so a readable manifest always has all of its parts
+                await run_in_s3_pool(
+                    put_object,
+                    self._bucket.Object(new_location),
+                    encode_manifest(moved),
+                )
+            else:
+                await self._copy(location, new_location)
+        except Exception as e:
+            raise WriteStateError(
+                f"Failed to relocate {location} in S3 bucket {self._bucket.name}: {e}"
+            )
+        return new_location, copied
+
+    async def _copy(self, source: str, target: str):
+        obj = self._bucket.Object(target)
+        try:
+            await run_in_s3_pool(
+                obj.copy_from, CopySource={"Bucket": self._bucket.name, "Key": source}
+            )
+        except ClientError as err:
+            if err.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                raise
+            # already moved, and the source deleted, for another version referencing the same object
+            await run_in_s3_pool(obj.load)
+
+    async def write_iac_to_fs(
+        self, arch: EnvironmentVersion, content: bytes | BinaryIO
+    ) -> str:
+        key = ArchitectureStorage.get_iac_location(arch)
         try:
-            if not isinstance(content, bytes):
-                raise TypeError(f"content must be of type bytes, not {type(content)}")
             obj = self._bucket.Object(key)
-            put_object(obj, content)
+            if isinstance(content, bytes):
+                await run_in_s3_pool(put_object, obj, content)
+            elif hasattr(content, "read"):
+                # streams the file in multipart chunks rather than loading it into memory
+                await run_in_s3_pool(obj.upload_fileobj, content)
+            else:
+                raise TypeError(
+                    f"content must be of type bytes or a binary file, not {type(content)}"
+                )
             return key
         except Exception as e:
             raise WriteIacError(
                 f"Failed to write iac to S3 bucket {self._bucket.name} and key {key}: {e}"
             )
 
-    def delete_state_from_fs(self, arch: EnvironmentVersion):
-        keys = [
-            ArchitectureStorage.get_path_for_architecture(arch) + "/state.json",
-            ArchitectureStorage.get_path_for_architecture(arch) + "/iac.zip",
-        ]
+    async def delete_state_from_fs(self, arch: EnvironmentVersion):
+        state_keys = []
+        keys = []
+        # the version's objects may still be under its path in another key layout
+        for path in ArchitectureStorage.get_paths_for_architecture(arch):
+            path_state_keys = [
+                f"{path}/{MANIFEST_FILE}",
+                f"{path}/{BINARY_STATE_FILE}",
+                f"{path}/{JSON_STATE_FILE}",
+            ]
+            state_keys.extend(path_state_keys)
+            keys.extend(
+                [
+                    *path_state_keys,
+                    *[f"{path}/parts/{field}.bin" for field in STATE_FIELDS],
+                    f"{path}/iac.zip",
+                ]
+            )
         try:
-            delete_objects(self._bucket, keys)
+            await run_in_s3_pool(delete_objects, self._bucket, keys)
         except Exception as e:
             raise WriteStateError(
                 f"Failed to delete state from S3 bucket {self._bucket.name} and key {keys}: {e}"
             )
+        if arch.state_location is not None and arch.state_location not in state_keys:
+            # content-addressed states are shared and left to garbage collection, only forget them here
+            state_keys.append(arch.state_location)
+        for key in state_keys:
+            await self._evict(key, arch.version_hash)
 
     @staticmethod
     def get_path_for_architecture(env: EnvironmentVersion) -> str:
-        root_path = "state"
-        return "/".join([root_path, env.architecture_id, env.id, str(env.version)])
+        """The path new objects of the version are written under, in the configured STATE_KEY_LAYOUT."""
+        return version_path(env.architecture_id, env.id, env.version)
+
+    @staticmethod
+    def get_paths_for_architecture(env: EnvironmentVersion) -> list[str]:
+        """Every path objects of the version may be stored under, the configured key layout first."""
+        return version_paths(env.architecture_id, env.id, env.version)
+
+    @staticmethod
+    def get_iac_location(env: EnvironmentVersion) -> str:
+        return ArchitectureStorage.get_path_for_architecture(env) + "/iac.zip"
+
+
+def _count_relocated_read():
+    metrics.counter(
+        "state_relocated_reads_total",
+        "Objects read from another key layout than their stored location",
+    ).inc()
+
+
+async def _iter_body(body, chunk_size: int) -> AsyncIterator[bytes]:
+    try:
+        chunks = body.iter_chunks(chunk_size)
+        while True:
+            chunk = await run_in_s3_pool(next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        body.close()
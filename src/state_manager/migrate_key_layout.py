@@ -0,0 +1,206 @@
+"""
+Moves the objects stored under environment version paths to the configured key layout and repoints their versions.
+
+    PYTHONPATH=. python -m src.state_manager.migrate_key_layout [--layout sharded] [--batch-size 100]
+        [--concurrency 8] [--delete-old] [--dry-run]
+
+Objects are copied server side, so the migration can run while the API is serving. Reads of a location that
+was moved before its version was repointed fall back to the other key layouts. A version whose locations
+changed while it was being migrated (for example by an overwriting run) is left alone. Content-addressed
+states are already spread over hashed prefixes and are not moved.
+"""
+
+import argparse
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Optional
+
+from sqlalchemy import or_, select, tuple_, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from src.environment_management.models import EnvironmentVersion
+from src.state_manager import state_format
+from src.state_manager.architecture_storage import ArchitectureStorage
+from src.state_manager.state_format import (
+    KEY_LAYOUTS,
+    SHARDED_VERSION_PREFIX,
+    VERSION_PREFIX,
+)
+from src.state_manager.state_gc import DELETE_BATCH_SIZE
+from src.util.aws.s3 import delete_objects, run_in_s3_pool
+
+log = logging.getLogger(__name__)
+
+_LAYOUT_PREFIXES = {"flat": VERSION_PREFIX, "sharded": SHARDED_VERSION_PREFIX}
+
+
+@dataclass
+class KeyMigrationReport:
+    scanned: int = 0
+    migrated: int = 0
+    skipped: int = 0
+    deleted: int = 0
+    failed: list[str] = field(default_factory=list)
+
+
+async def migrate_key_layout(
+    session_factory: async_sessionmaker,
+    storage: ArchitectureStorage,
+    layout: str = None,
+    batch_size: int = 100,
+    concurrency: int = 8,
+    delete_old: bool = False,
+    dry_run: bool = False,
+) -> KeyMigrationReport:
+    layout = layout or state_format.STATE_KEY_LAYOUT
+    if layout not in KEY_LAYOUTS:
+        raise ValueError(f"Unknown state key layout {layout}")
+    report = KeyMigrationReport()
+    semaphore = asyncio.Semaphore(concurrency)
+    last_key: Optional[tuple] = None
+    moved_out = [
+        column.like(f"{prefix}/%")
+        for other, prefix in _LAYOUT_PREFIXES.items()
+        if other != layout
+        for column in (
+            EnvironmentVersion.state_location,
+            EnvironmentVersion.iac_location,
+        )
+    ]
+
+    async def relocate(*locations: Optional[str]) -> Optional[tuple]:
+        async with semaphore:
+            moved, copied = [], []
+            for location in locations:
+                if location is None:
+                    moved.append(None)
+                    continue
+                try:
+                    new, keys = await storage.relocate(location, layout)
+                except Exception:
+                    log.warning("Could not relocate %s", location, exc_info=True)
+                    report.failed.append(location)
+                    return None
+                moved.append(new)
+                copied.extend(keys)
+            return *moved, copied
+
+    while True:
+        stmt = (
+            select(
+                EnvironmentVersion.architecture_id,
+                EnvironmentVersion.id,
+                EnvironmentVersion.version,
+                EnvironmentVersion.state_location,
+                EnvironmentVersion.iac_location,
+            )
+            .where(or_(*moved_out))
+            .order_by(
+                EnvironmentVersion.architecture_id,
+                EnvironmentVersion.id,
+                EnvironmentVersion.version,
+            )
+            .limit(batch_size)
+        )
+        if last_key is not None:
+            stmt = stmt.where(
+                tuple_(
+                    EnvironmentVersion.architecture_id,
+                    EnvironmentVersion.id,
+                    EnvironmentVersion.version,
+                )
+                > last_key
+            )
+        async with session_factory() as session:
+            rows = (await session.execute(stmt)).all()
+        if not rows:
+            return report
+        last_key = tuple(rows[-1][:3])
+        report.scanned += len(rows)
+        if dry_run:
+            continue
+
+        results = await asyncio.gather(*[relocate(row[3], row[4]) for row in rows])
+        old_keys = []
+        async with session_factory.begin() as session:
+            for (architecture_id, id, version, state, iac), result in zip(
+                rows, results
+            ):
+                if result is None:
+                    continue
+                new_state, new_iac, copied = result
+                result = await session.execute(
+                    update(EnvironmentVersion)
+                    .where(EnvironmentVersion.architecture_id == architecture_id)
+                    .where(EnvironmentVersion.id == id)
+                    .where(EnvironmentVersion.version == version)
+                    .where(
+                        EnvironmentVersion.state_location.is_not_distinct_from(state)
+                    )
+                    .where(EnvironmentVersion.iac_location.is_not_distinct_from(iac))
+                    .values(state_location=new_state, iac_location=new_iac)
+                )
+                if result.rowcount == 1:
+                    report.migrated += 1
+                    old_keys.extend(copied)
+                else:
+                    report.skipped += 1
+        if delete_old and old_keys:
+            # other versions still referencing a deleted key read it from its new layout
+            for i in range(0, len(old_keys), DELETE_BATCH_SIZE):
+                response = await run_in_s3_pool(
+                    delete_objects, storage._bucket, old_keys[i : i + DELETE_BATCH_SIZE]
+                )
+                report.deleted += len(response.get("Deleted", []))
+        log.info(
+            "Migrated %d versions, %d skipped, %d failed",
+            report.migrated,
+            report.skipped,
+            len(report.failed),
+        )
+
+
+async def main():
+    from src.dependency_injection.injection import (
+        SessionLocal,
+        get_architecture_storage,
+    )
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--layout",
+        choices=KEY_LAYOUTS,
+        default=state_format.STATE_KEY_LAYOUT,
+        help="key layout to move objects to (default: STATE_KEY_LAYOUT)",
+    )
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--delete-old",
+        action="store_true",
+        help="delete the old objects once their version points at the new location",
+    )
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    report = await migrate_key_layout(
+        SessionLocal,
+        get_architecture_storage(),
+        layout=args.layout,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        delete_old=args.delete_old,
+        dry_run=args.dry_run,
+    )
+    print(
+        f"scanned {report.scanned}, migrated {report.migrated}, skipped {report.skipped}, "
+        f"deleted {report.deleted}, failed {len(report.failed)}"
+    )
+    for location in report.failed:
+        print(f"failed: {location}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,155 @@
+"""
+Rewrites legacy state.json objects in the binary state format and repoints their environment versions.
+
+    PYTHONPATH=. python -m src.state_manager.migrate_state_format [--batch-size 100] [--concurrency 8]
+        [--delete-legacy] [--dry-run]
+
+Reads keep working on legacy objects, so the migration can run while the API is serving. A version whose
+state location changed while it was being converted (for example by an overwriting run) is left alone.
+"""
+
+import argparse
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Optional
+
+from sqlalchemy import select, tuple_, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from src.environment_management.models import EnvironmentVersion
+from src.state_manager.architecture_storage import ArchitectureStorage
+from src.state_manager.state_format import JSON_STATE_FILE
+from src.util.aws.s3 import delete_objects, run_in_s3_pool
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class StateMigrationReport:
+    scanned: int = 0
+    migrated: int = 0
+    skipped: int = 0
+    failed: list[str] = field(default_factory=list)
+
+
+async def migrate_state_format(
+    session_factory: async_sessionmaker,
+    storage: ArchitectureStorage,
+    batch_size: int = 100,
+    concurrency: int = 8,
+    delete_legacy: bool = False,
+    dry_run: bool = False,
+) -> StateMigrationReport:
+    report = StateMigrationReport()
+    semaphore = asyncio.Semaphore(concurrency)
+    last_key: Optional[tuple] = None
+
+    async def convert(location: str) -> Optional[str]:
+        async with semaphore:
+            try:
+                return await storage.convert_state(location)
+            except Exception:
+                log.warning("Could not convert state %s", location, exc_info=True)
+                report.failed.append(location)
+                return None
+
+    while True:
+        stmt = (
+            select(
+                EnvironmentVersion.architecture_id,
+                EnvironmentVersion.id,
+                EnvironmentVersion.version,
+                EnvironmentVersion.state_location,
+            )
+            .where(EnvironmentVersion.state_location.like(f"%/{JSON_STATE_FILE}"))
+            .order_by(
+                EnvironmentVersion.architecture_id,
+                EnvironmentVersion.id,
+                EnvironmentVersion.version,
+            )
+            .limit(batch_size)
+        )
+        if last_key is not None:
+            stmt = stmt.where(
+                tuple_(
+                    EnvironmentVersion.architecture_id,
+                    EnvironmentVersion.id,
+                    EnvironmentVersion.version,
+                )
+                > last_key
+            )
+        async with session_factory() as session:
+            rows = (await session.execute(stmt)).all()
+        if not rows:
+            return report
+        last_key = tuple(rows[-1][:3])
+        report.scanned += len(rows)
+        if dry_run:
+            continue
+
+        locations = await asyncio.gather(*[convert(row[3]) for row in rows])
+        migrated = []
+        async with session_factory.begin() as session:
+            for (architecture_id, id, version, old), new in zip(rows, locations):
+                if new is None:
+                    continue
+                result = await session.execute(
+                    update(EnvironmentVersion)
+                    .where(EnvironmentVersion.architecture_id == architecture_id)
+                    .where(EnvironmentVersion.id == id)
+                    .where(EnvironmentVersion.version == version)
+                    .where(EnvironmentVersion.state_location == old)
+                    .values(state_location=new)
+                )
+                if result.rowcount == 1:
+                    migrated.append(old)
+                else:
+                    report.skipped += 1
+        report.migrated += len(migrated)
+        if delete_legacy and migrated:
+            await run_in_s3_pool(delete_objects, storage._bucket, migrated)
+        log.info(
+            "Migrated %d states, %d skipped, %d failed",
+            report.migrated,
+            report.skipped,
+            len(report.failed),
+        )
+
+
+async def main():
+    from src.dependency_injection.injection import (
+        SessionLocal,
+        get_architecture_storage,
+    )
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--delete-legacy",
+        action="store_true",
+        help="delete state.json objects once their version points at the binary state",
+    )
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    report = await migrate_state_format(
+        SessionLocal,
+        get_architecture_storage(),
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        delete_legacy=args.delete_legacy,
+        dry_run=args.dry_run,
+    )
+    print(
+        f"scanned {report.scanned}, migrated {report.migrated}, skipped {report.skipped}, "
+        f"failed {len(report.failed)}"
+    )
+    for location in report.failed:
+        print(f"failed: {location}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,101 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Optional
+
+from src.engine_service.engine_commands.run import RunEngineResult
+from src.engine_service.engine_commands.run_cache import result_size
+from src.util.cache import DiskCache, LRUCache
+from src.util.metrics import metrics
+
+log = logging.getLogger(__name__)
+
+# Comma separated list of tiers to use: memory, disk. Empty disables caching.
+STATE_CACHE = os.getenv("STATE_CACHE", "memory")
+STATE_CACHE_MAX_BYTES = int(os.getenv("STATE_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+STATE_CACHE_DIR = os.getenv(
+    "STATE_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "infracopilot", "state-cache"),
+)
+STATE_CACHE_DIR_MAX_BYTES = int(
+    os.getenv("STATE_CACHE_DIR_MAX_BYTES", str(1024 * 1024 * 1024))
+)
+
+
+class StateCache:
+    """
+    Read-through cache of parsed environment version states.
+
+    Versions are immutable once written, but an overwriting run reuses the version number and therefore
+    the state location, so entries are keyed by the location together with the version hash, which is
+    unique to every version written. A rewritten location is a different key and needs no invalidation.
+    """
+
+    def __init__(
+        self, memory: Optional[LRUCache] = None, disk: Optional[DiskCache] = None
+    ):
+        self.memory = memory
+        self.disk = disk
+
+    @staticmethod
+    def from_env() -> "StateCache":
+        names = [t.strip() for t in STATE_CACHE.split(",") if t.strip()]
+        memory = None
+        disk = None
+        if "memory" in names:
+            memory = LRUCache(STATE_CACHE_MAX_BYTES, sizeof=result_size)
+        if "disk" in names:
+            disk = DiskCache(STATE_CACHE_DIR, STATE_CACHE_DIR_MAX_BYTES)
+        return StateCache(memory, disk)
+
+    @staticmethod
+    def key(state_location: str, version_hash: Optional[str]) -> str:
+        return hashlib.sha256(f"{state_location}\0{version_hash}".encode()).hexdigest()
+
+    async def get(self, key: str) -> Optional[RunEngineResult]:
+        if self.memory is not None:
+            result = self.memory.get(key)
+            if result is not None:
+                self._hit("memory")
+                return result
+        if self.disk is not None:
+            raw = await asyncio.to_thread(self.disk.get, key)
+            if raw is not None:
+                self._hit("disk")
+                result = RunEngineResult(**json.loads(raw))
+                self._put_memory(key, result)
+                return result
+        metrics.counter("state_cache_misses_total", "State cache misses").inc()
+        return None
+
+    async def put(self, key: str, result: RunEngineResult):
+        self._put_memory(key, result)
+        if self.disk is not None:
+            raw = json.dumps(result._asdict()).encode()
+            await asyncio.to_thread(self.disk.put, key, raw)
+
+    async def delete(self, key: str):
+        if self.memory is not None:
+            self.memory.delete(key)
+            self._update_size()
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.delete, key)
+
+    def _put_memory(self, key: str, result: RunEngineResult):
+        if self.memory is not None:
+            self.memory.put(key, result)
+            self._update_size()
+
+    def _hit(self, tier: str):
+        metrics.counter("state_cache_hits_total", "State cache hits", tier=tier).inc()
+
+    def _update_size(self):
+        metrics.gauge(
+            "state_cache_bytes", "Bytes held by the in-memory state cache"
+        ).set(self.memory.size_bytes)
+        metrics.gauge(
+            "state_cache_entries", "Entries held by the in-memory state cache"
+        ).set(len(self.memory))
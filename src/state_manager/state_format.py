@@ -0,0 +1,419 @@
+import difflib
+import hashlib
+import json
+import os
+import struct
+import zlib
+from typing import Iterable, Optional
+
+from src.engine_service.engine_commands.run import RunEngineResult
+
+# Format new states are written in: "binary", or "json" to keep writing legacy state.json objects
+STATE_FORMAT = os.getenv("STATE_FORMAT", "binary")
+# zlib level used for binary states, 1 is fastest and 9 smallest
+STATE_COMPRESSION_LEVEL = int(os.getenv("STATE_COMPRESSION_LEVEL", "6"))
+# How binary states are laid out: "split" stores every field as its own part behind a manifest so readers
+# can fetch only the fields they need, "single" stores the whole state in one object
+STATE_LAYOUT = os.getenv("STATE_LAYOUT", "split")
+# Where split states are stored: "cas" stores parts and manifests once under the hash of their content so
+# identical states share objects, "version" stores them under the path of each environment version
+STATE_STORE = os.getenv("STATE_STORE", "cas")
+# How content-addressed states are written: "full" stores every changed field as a whole part, "delta"
+# stores it as a line delta against the same field of the version it was built on
+STATE_HISTORY = os.getenv("STATE_HISTORY", "full")
+# Deltas applied on top of a full snapshot at most, so reconstructing a field reads this many objects + 1
+STATE_DELTA_CHAIN_LENGTH = int(os.getenv("STATE_DELTA_CHAIN_LENGTH", "8"))
+# How the objects stored under a version's own path are keyed: "flat" keys them state/<architecture>/<env>/<version>,
+# "sharded" puts a hash of that path first so the requests of a busy architecture spread over many S3 prefixes
+STATE_KEY_LAYOUT = os.getenv("STATE_KEY_LAYOUT", "flat")
+
+BINARY_STATE_FILE = "state.bin"
+JSON_STATE_FILE = "state.json"
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 2
+CAS_PREFIX = "cas"
+VERSION_PREFIX = "state"
+SHARDED_VERSION_PREFIX = "shards"
+KEY_LAYOUTS = ("flat", "sharded")
+# hex digits of the shard, 256 prefixes. Changing it would strand every sharded key.
+_SHARD_DIGITS = 2
+
+STATE_FIELDS = RunEngineResult._fields
+# fields that can be delta encoded, config_errors is small and not line oriented
+DELTA_FIELDS = ("resources_yaml", "topology_yaml", "iac_topology")
+
+# A part is either the key of a full part, or the chain of keys of a snapshot and the deltas that rebuild it
+Part = str | list[str]
+
+MAGIC = b"ICST"
+DELTA_MAGIC = b"ICDL"
+FORMAT_VERSION = 1
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+
+# magic, format version, compression
+_HEADER = struct.Struct(">4sBB")
+# section name length, section length
+_SECTION = struct.Struct(">HI")
+
+
+class StateFormatError(Exception):
+    pass
+
+
+def state_file_name(state_format: str = None, layout: str = None) -> str:
+    """The name of the object a state location points at for the given format and layout."""
+    state_format = state_format or STATE_FORMAT
+    layout = layout or STATE_LAYOUT
+    if state_format == "json":
+        return JSON_STATE_FILE
+    if state_format != "binary":
+        raise StateFormatError(f"Unknown state format {state_format}")
+    if layout == "split":
+        return MANIFEST_FILE
+    if layout == "single":
+        return BINARY_STATE_FILE
+    raise StateFormatError(f"Unknown state layout {layout}")
+
+
+def version_path(
+    architecture_id: str, env_id: str, version: int, layout: str = None
+) -> str:
+    """The path the objects of an environment version are stored under in the given key layout."""
+    layout = layout or STATE_KEY_LAYOUT
+    path = f"{architecture_id}/{env_id}/{version}"
+    if layout == "flat":
+        return f"{VERSION_PREFIX}/{path}"
+    if layout == "sharded":
+        shard = hashlib.sha256(path.encode("utf-8")).hexdigest()[:_SHARD_DIGITS]
+        return f"{SHARDED_VERSION_PREFIX}/{shard}/{path}"
+    raise StateFormatError(f"Unknown state key layout {layout}")
+
+
+def version_paths(architecture_id: str, env_id: str, version: int) -> list[str]:
+    """Every path the objects of an environment version may be stored under, the configured layout first."""
+    layouts = sorted(KEY_LAYOUTS, key=lambda layout: layout != STATE_KEY_LAYOUT)
+    return [
+        version_path(architecture_id, env_id, version, layout=layout)
+        for layout in layouts
+    ]
+
+
+def _split_version_key(key: str) -> Optional[tuple[str, list[str], list[str]]]:
+    """Splits a key under a version path into its layout, its (architecture, env, version) and the rest."""
+    segments = key.split("/")
+    if segments[0] == VERSION_PREFIX and len(segments) >= 5:
+        return "flat", segments[1:4], segments[4:]
+    if segments[0] == SHARDED_VERSION_PREFIX and len(segments) >= 6:
+        return "sharded", segments[2:5], segments[5:]
+    return None
+
+
+def key_layout(key: str) -> Optional[str]:
+    """The key layout of a key stored under a version path, None for other keys."""
+    split = _split_version_key(key)
+    return split[0] if split is not None else None
+
+
+def parse_version_path(key: str) -> Optional[str]:
+    """The path of the environment version a key is stored under, None for keys outside of version paths."""
+    split = _split_version_key(key)
+    if split is None:
+        return None
+    layout, (architecture_id, env_id, version), _ = split
+    return version_path(architecture_id, env_id, version, layout=layout)
+
+
+def relocate_key(key: str, layout: str = None) -> str:
+    """The key under the same version path in another key layout. Keys outside of version paths are kept."""
+    split = _split_version_key(key)
+    if split is None:
+        return key
+    _, (architecture_id, env_id, version), rest = split
+    return "/".join(
+        [version_path(architecture_id, env_id, version, layout=layout), *rest]
+    )
+
+
+def alternate_keys(key: str) -> list[str]:
+    """The other keys a migration between key layouts may have moved the object at key to."""
+    return [
+        relocated
+        for relocated in (relocate_key(key, layout) for layout in KEY_LAYOUTS)
+        if relocated != key
+    ]
+
+
+def content_addressed(state_format: str = None) -> bool:
+    """Whether states written in the given format go to the content-addressed store."""
+    return state_file_name(state_format) == MANIFEST_FILE and STATE_STORE == "cas"
+
+
+def check_fields(fields: Optional[Iterable[str]]) -> tuple[str, ...]:
+    """Validates a selection of state fields, None selects all of them."""
+    if fields is None:
+        return STATE_FIELDS
+    fields = tuple(dict.fromkeys(fields))
+    unknown = [f for f in fields if f not in STATE_FIELDS]
+    if unknown:
+        raise ValueError(
+            f"Unknown state fields {', '.join(unknown)}, expected any of {', '.join(STATE_FIELDS)}"
+        )
+    return fields
+
+
+def select_fields(state: RunEngineResult, fields: Iterable[str]) -> RunEngineResult:
+    """Returns the state with only the given fields set, the others are left at their empty value."""
+    fields = set(fields)
+    if fields.issuperset(STATE_FIELDS):
+        return state
+    return RunEngineResult(
+        **{
+            name: getattr(state, name) if name in fields else _empty(name)
+            for name in STATE_FIELDS
+        }
+    )
+
+
+def merge_fields(parts: dict[str, RunEngineResult]) -> RunEngineResult:
+    """Combines states that each hold the field they are keyed by into one state."""
+    return RunEngineResult(
+        **{
+            name: getattr(parts[name], name) if name in parts else _empty(name)
+            for name in STATE_FIELDS
+        }
+    )
+
+
+def _empty(name: str):
+    return [] if name == "config_errors" else ""
+
+
+def encode_state(
+    state: RunEngineResult,
+    state_format: str = None,
+    level: int = None,
+    fields: Iterable[str] = STATE_FIELDS,
+) -> bytes:
+    """
+    Serializes a state in the given format, STATE_FORMAT by default.
+
+    The binary format is a fixed header followed by a zlib compressed list of named, length-prefixed
+    sections, one per RunEngineResult field. Readers skip sections they do not know, so fields can be
+    added without a new format version. The parts of a split state are binary states of one section.
+    """
+    state_format = state_format or STATE_FORMAT
+    if state_format == "json":
+        return encode_json_state(state)
+    if state_format != "binary":
+        raise StateFormatError(f"Unknown state format {state_format}")
+    sections = [(name, _encode_field(state, name)) for name in fields]
+    body = b"".join(
+        _SECTION.pack(len(name), len(data)) + name.encode("utf-8") + data
+        for name, data in sections
+    )
+    level = STATE_COMPRESSION_LEVEL if level is None else level
+    return _HEADER.pack(MAGIC, FORMAT_VERSION, COMPRESSION_ZLIB) + zlib.compress(
+        body, level
+    )
+
+
+def _encode_field(state: RunEngineResult, name: str) -> bytes:
+    if name == "config_errors":
+        return json.dumps(state.config_errors).encode("utf-8")
+    return getattr(state, name).encode("utf-8")
+
+
+def encode_manifest(parts: dict[str, Part]) -> bytes:
+    """Serializes the manifest of a split state, mapping each field to its part."""
+    # manifests without deltas keep version 1 so they hash the same as before deltas existed
+    version = 2 if any(isinstance(p, list) for p in parts.values()) else 1
+    return json.dumps({"version": version, "parts": parts}).encode("utf-8")
+
+
+def manifest_keys(parts: dict[str, Part]) -> list[str]:
+    """Every object key a manifest references, including the snapshots and deltas of its chains."""
+    return [key for part in parts.values() for key in chain(part)]
+
+
+def decode_manifest(raw: bytes | str) -> dict[str, Part]:
+    manifest = json.loads(raw)
+    if manifest.get("version", 0) > MANIFEST_VERSION:
+        raise StateFormatError(
+            f"Unsupported state manifest version {manifest.get('version')}"
+        )
+    return manifest["parts"]
+
+
+def part_digest(state: RunEngineResult, name: str) -> str:
+    """
+    Content hash of one field of a state. It covers the field name and its uncompressed value, so equal
+    values of different fields get different parts and the compression level does not change the hash.
+    """
+    digest = hashlib.sha256(name.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(_encode_field(state, name))
+    return digest.hexdigest()
+
+
+def blob_key(digest: str) -> str:
+    return f"{CAS_PREFIX}/blobs/{digest[:2]}/{digest}"
+
+
+def delta_key(digest: str, base_digest: str) -> str:
+    return f"{CAS_PREFIX}/deltas/{digest[:2]}/{digest}/{base_digest}"
+
+
+def key_digest(key: str) -> str:
+    """The part digest of the content a blob or delta key rebuilds."""
+    segments = key.split("/")
+    return segments[-2] if segments[1] == "deltas" else segments[-1]
+
+
+def chain(part: Part) -> list[str]:
+    return part if isinstance(part, list) else [part]
+
+
+def delta_history() -> bool:
+    return STATE_HISTORY == "delta"
+
+
+def can_extend(name: str, base: Optional[Part]) -> bool:
+    """Whether a new value of the field may be written as a delta on top of the base part."""
+    return (
+        delta_history()
+        and name in DELTA_FIELDS
+        and base is not None
+        and len(chain(base)) <= STATE_DELTA_CHAIN_LENGTH
+    )
+
+
+def encode_delta(base: str, target: str, level: int = None) -> bytes:
+    """
+    Serializes target as line operations on base: a [start, end] pair copies base lines, a string is
+    inserted as is. Lines keep their endings, so applying the delta rebuilds target exactly.
+    """
+    base_lines = base.splitlines(keepends=True)
+    target_lines = target.splitlines(keepends=True)
+    ops = []
+    # autojunk skips matching on lines that repeat throughout the document, which keeps large diffs fast
+    # at the cost of a slightly larger delta, applying it is exact either way
+    matcher = difflib.SequenceMatcher(None, base_lines, target_lines)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append("".join(target_lines[j1:j2]))
+    level = STATE_COMPRESSION_LEVEL if level is None else level
+    return _HEADER.pack(DELTA_MAGIC, FORMAT_VERSION, COMPRESSION_ZLIB) + zlib.compress(
+        json.dumps(ops, separators=(",", ":")).encode("utf-8"), level
+    )
+
+
+def apply_delta(base: str, raw: bytes) -> str:
+    if len(raw) < _HEADER.size or raw[: len(DELTA_MAGIC)] != DELTA_MAGIC:
+        raise StateFormatError("Not a state delta")
+    _, version, compression = _HEADER.unpack_from(raw)
+    if version > FORMAT_VERSION:
+        raise StateFormatError(f"Unsupported state delta version {version}")
+    body = raw[_HEADER.size :]
+    if compression == COMPRESSION_ZLIB:
+        body = zlib.decompress(body)
+    elif compression != COMPRESSION_NONE:
+        raise StateFormatError(f"Unsupported state compression {compression}")
+    base_lines = base.splitlines(keepends=True)
+    out = []
+    for op in json.loads(body):
+        if isinstance(op, str):
+            out.append(op)
+        else:
+            out.extend(base_lines[op[0] : op[1]])
+    return "".join(out)
+
+
+def decode_chain(
+    name: str, snapshot: bytes, deltas: Iterable[bytes], digest: str
+) -> RunEngineResult:
+    """
+    Rebuilds one field from its snapshot part and the deltas applied on top of it, and checks the result
+    against the digest of the content it was written from.
+    """
+    value = getattr(decode_state(snapshot), name)
+    for delta in deltas:
+        value = apply_delta(value, delta)
+    state = with_field(name, value)
+    if part_digest(state, name) != digest:
+        raise StateFormatError(f"Rebuilt {name} does not match its digest {digest}")
+    return state
+
+
+def with_field(name: str, value) -> RunEngineResult:
+    """A state with only the given field set."""
+    return RunEngineResult(
+        **{n: value if n == name else _empty(n) for n in STATE_FIELDS}
+    )
+
+
+def manifest_key(manifest: bytes) -> str:
+    digest = hashlib.sha256(manifest).hexdigest()
+    return f"{CAS_PREFIX}/manifests/{digest[:2]}/{digest}/{MANIFEST_FILE}"
+
+
+def encode_json_state(state: RunEngineResult) -> bytes:
+    """Serializes a state as the legacy state.json document."""
+    return json.dumps(state._asdict()).encode("utf-8")
+
+
+def decode_state(raw: bytes | str) -> RunEngineResult:
+    """Deserializes a state written in either format, detected from its content."""
+    if isinstance(raw, str):
+        raw = raw.encode("utf-8")
+    if raw[: len(MAGIC)] != MAGIC:
+        return _decode_json_state(raw)
+    if len(raw) < _HEADER.size:
+        raise StateFormatError("Truncated state header")
+    _, version, compression = _HEADER.unpack_from(raw)
+    if version > FORMAT_VERSION:
+        raise StateFormatError(f"Unsupported state format version {version}")
+    body = memoryview(raw)[_HEADER.size :]
+    if compression == COMPRESSION_ZLIB:
+        body = memoryview(zlib.decompress(body))
+    elif compression != COMPRESSION_NONE:
+        raise StateFormatError(f"Unsupported state compression {compression}")
+
+    sections = {}
+    offset = 0
+    while offset < len(body):
+        if offset + _SECTION.size > len(body):
+            raise StateFormatError("Truncated state section")
+        name_length, length = _SECTION.unpack_from(body, offset)
+        offset += _SECTION.size
+        name = bytes(body[offset : offset + name_length]).decode("utf-8")
+        offset += name_length
+        if offset + length > len(body):
+            raise StateFormatError(f"Truncated state section {name}")
+        sections[name] = body[offset : offset + length]
+        offset += length
+
+    def text(name: str) -> str:
+        data = sections.get(name)
+        return "" if data is None else str(data, "utf-8")
+
+    config_errors = sections.get("config_errors")
+    return RunEngineResult(
+        resources_yaml=text("resources_yaml"),
+        topology_yaml=text("topology_yaml"),
+        iac_topology=text("iac_topology"),
+        config_errors=[] if config_errors is None else json.loads(bytes(config_errors)),
+    )
+
+
+def _decode_json_state(raw: bytes) -> RunEngineResult:
+    data = json.loads(raw)
+    return RunEngineResult(
+        resources_yaml=data.get("resources_yaml", ""),
+        topology_yaml=data.get("topology_yaml", ""),
+        iac_topology=data.get("iac_topology", ""),
+        config_errors=data.get("config_errors", data.get("config_errors_json", [])),
+    )
@@ -0,0 +1,287 @@
+"""
+Mark-and-sweep garbage collection of state and iac objects.
+
+    PYTHONPATH=. python -m src.state_manager.state_gc [--dry-run] [--grace-period SECONDS]
+        [--delete-rate KEYS_PER_SECOND] [--interval SECONDS]
+
+Content-addressed parts and manifests are shared by every version whose state is identical, so they are
+never deleted with a version. Instead the collector marks every manifest referenced by an environment
+version, and the parts those manifests reference (with the snapshots and deltas of delta encoded parts),
+then deletes the other objects under the store prefix.
+
+Objects stored under a version's own path (legacy states, per-version parts and iac) are left behind
+when versions, environments or architectures are deleted. They are collected when no environment
+version exists for their path and no version references them.
+
+The bucket is listed and deleted from page by page and version rows are read in batches, so memory grows
+with the live objects and not with the bucket. Run it from a single process, e.g. a scheduled task, or with
+--interval (default STATE_GC_INTERVAL) to keep collecting every interval seconds.
+"""
+
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Iterator
+
+from botocore.exceptions import ClientError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from src.environment_management.models import EnvironmentVersion
+from src.state_manager.architecture_storage import (
+    ArchitectureStateDoesNotExistError,
+    ArchitectureStorage,
+)
+from src.state_manager.state_format import (
+    CAS_PREFIX,
+    SHARDED_VERSION_PREFIX,
+    VERSION_PREFIX,
+    alternate_keys,
+    manifest_keys,
+    parse_version_path,
+)
+from src.util.aws.s3 import delete_objects, run_in_s3_pool
+from src.util.metrics import metrics
+
+log = logging.getLogger(__name__)
+
+# Objects younger than this are never collected, so states being written while the collector runs are
+# safe before their version is committed. Must be well above CAS_REFRESH_AFTER.
+CAS_GC_GRACE_PERIOD = int(os.getenv("CAS_GC_GRACE_PERIOD", str(24 * 60 * 60)))
+# S3 accepts at most 1000 keys per delete_objects call
+DELETE_BATCH_SIZE = 1000
+# Keys deleted per second at most, so working through a large backlog does not take the request rate
+# the API needs
+STATE_GC_DELETE_RATE = float(os.getenv("STATE_GC_DELETE_RATE", "1000"))
+# Rows and keys handled per batch while marking and sweeping
+MARK_BATCH_SIZE = 1000
+# Seconds between collections of the CLI, 0 collects once
+STATE_GC_INTERVAL = int(os.getenv("STATE_GC_INTERVAL", "0"))
+
+
+@dataclass
+class StateGarbageReport:
+    live: int = 0
+    scanned: int = 0
+    found: int = 0
+    # the garbage keys, listed by dry runs only
+    garbage: list[str] = field(default_factory=list)
+    garbage_bytes: int = 0
+    deleted: int = 0
+
+
+async def collect_state_garbage(
+    session_factory: async_sessionmaker,
+    storage: ArchitectureStorage,
+    grace_period: timedelta = timedelta(seconds=CAS_GC_GRACE_PERIOD),
+    dry_run: bool = False,
+    concurrency: int = 8,
+    delete_rate: float = STATE_GC_DELETE_RATE,
+) -> StateGarbageReport:
+    report = StateGarbageReport()
+    cutoff = datetime.now(timezone.utc) - grace_period
+    live, live_paths = await _mark(session_factory, storage, concurrency)
+    report.live = len(live) + len(live_paths)
+
+    bucket = storage._bucket
+    semaphore = asyncio.Semaphore(concurrency)
+
+    # a writer reusing an object refreshes it before referencing it, and a version path can be reused
+    # once its versions are deleted, so check again right before deleting
+    async def still_old(key: str) -> bool:
+        async with semaphore:
+            obj = bucket.Object(key)
+            try:
+                await run_in_s3_pool(obj.load)
+            except ClientError as err:
+                if err.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                    return False
+                raise
+            return obj.last_modified < cutoff
+
+    pending = []
+    batches = 0
+
+    async def delete(batch: list[str]):
+        nonlocal batches
+        if batches > 0 and delete_rate > 0:
+            await asyncio.sleep(DELETE_BATCH_SIZE / delete_rate)
+        batches += 1
+        response = await run_in_s3_pool(delete_objects, bucket, batch)
+        deleted = len(response.get("Deleted", []))
+        report.deleted += deleted
+        metrics.counter(
+            "state_gc_deleted_total", "Unreferenced state and iac objects deleted"
+        ).inc(deleted)
+
+    for prefix in (CAS_PREFIX, VERSION_PREFIX, SHARDED_VERSION_PREFIX):
+        # boto3 collections fetch the listing lazily, a page at a time
+        objects = iter(bucket.objects.filter(Prefix=f"{prefix}/"))
+        while page := await run_in_s3_pool(_take, objects, MARK_BATCH_SIZE):
+            candidates = {}
+            for obj in page:
+                report.scanned += 1
+                if obj.key in live or parse_version_path(obj.key) in live_paths:
+                    continue
+                if obj.last_modified < cutoff:
+                    candidates[obj.key] = obj.size
+            checks = await asyncio.gather(*[still_old(key) for key in candidates])
+            garbage = [key for key, old in zip(candidates, checks) if old]
+            report.found += len(garbage)
+            report.garbage_bytes += sum(candidates[key] for key in garbage)
+            if dry_run:
+                report.garbage.extend(garbage)
+                continue
+            pending.extend(garbage)
+            while len(pending) >= DELETE_BATCH_SIZE:
+                await delete(pending[:DELETE_BATCH_SIZE])
+                del pending[:DELETE_BATCH_SIZE]
+    if pending:
+        await delete(pending)
+
+    metrics.counter(
+        "state_gc_scanned_total", "State and iac objects listed by the collector"
+    ).inc(report.scanned)
+    metrics.gauge(
+        "state_gc_garbage_bytes", "Size of the garbage found by the last collection"
+    ).set(report.garbage_bytes)
+    return report
+
+
+def _take(objects: Iterator, n: int) -> list:
+    return list(itertools.islice(objects, n))
+
+
+async def _mark(
+    session_factory: async_sessionmaker,
+    storage: ArchitectureStorage,
+    concurrency: int,
+) -> tuple[set[str], set[str]]:
+    """
+    Returns the keys referenced by environment versions, and the paths of existing versions. Keys and paths
+    are marked in every key layout, so objects a layout migration copied are live with their originals.
+    """
+    live = set()
+    live_paths = set()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def mark_parts(manifest: str):
+        async with semaphore:
+            try:
+                live.update(manifest_keys(await storage.get_manifest(manifest)))
+            except ArchitectureStateDoesNotExistError:
+                log.warning("Referenced state manifest %s does not exist", manifest)
+
+    async with session_factory() as session:
+        result = await session.stream(
+            select(
+                EnvironmentVersion.architecture_id,
+                EnvironmentVersion.id,
+                EnvironmentVersion.version,
+                EnvironmentVersion.state_location,
+                EnvironmentVersion.iac_location,
+            ).execution_options(yield_per=MARK_BATCH_SIZE)
+        )
+        async for rows in result.partitions():
+            manifests = set()
+            for architecture_id, id, version, state_location, iac_location in rows:
+                live_paths.update(
+                    ArchitectureStorage.get_paths_for_architecture(
+                        EnvironmentVersion(
+                            architecture_id=architecture_id, id=id, version=version
+                        )
+                    )
+                )
+                for location in (state_location, iac_location):
+                    if location is None:
+                        continue
+                    if location.startswith(f"{CAS_PREFIX}/"):
+                        if location not in live:
+                            live.add(location)
+                            manifests.add(location)
+                        continue
+                    for key in (location, *alternate_keys(location)):
+                        live.add(key)
+                        if parse_version_path(key) is not None:
+                            # versions can reference objects under another version's path, e.g. older clones
+                            live_paths.add(parse_version_path(key))
+            await asyncio.gather(*[mark_parts(m) for m in manifests])
+    return live, live_paths
+
+
+async def collect_periodically(
+    session_factory: async_sessionmaker,
+    storage: ArchitectureStorage,
+    interval: int,
+    **kwargs,
+):
+    """Collects garbage every interval seconds until cancelled, logging failed collections."""
+    while True:
+        try:
+            report = await collect_state_garbage(session_factory, storage, **kwargs)
+            log.info(
+                "Collected %d unreferenced state objects (%d bytes)",
+                report.deleted,
+                report.garbage_bytes,
+            )
+        except Exception:
+            log.error("State garbage collection failed", exc_info=True)
+        await asyncio.sleep(interval)
+
+
+async def main():
+    from src.dependency_injection.injection import (
+        SessionLocal,
+        get_architecture_storage,
+    )
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--grace-period", type=int, default=CAS_GC_GRACE_PERIOD)
+    parser.add_argument(
+        "--delete-rate",
+        type=float,
+        default=STATE_GC_DELETE_RATE,
+        help="keys deleted per second at most, 0 for no limit",
+    )
+    parser.add_argument(
+        "--interval",
+        type=int,
+        default=STATE_GC_INTERVAL,
+        help="collect again every interval seconds, 0 to collect once",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.interval > 0:
+        await collect_periodically(
+            SessionLocal,
+            get_architecture_storage(),
+            args.interval,
+            grace_period=timedelta(seconds=args.grace_period),
+            dry_run=args.dry_run,
+            delete_rate=args.delete_rate,
+        )
+        return
+    report = await collect_state_garbage(
+        SessionLocal,
+        get_architecture_storage(),
+        grace_period=timedelta(seconds=args.grace_period),
+        dry_run=args.dry_run,
+        delete_rate=args.delete_rate,
+    )
+    print(
+        f"live {report.live}, scanned {report.scanned}, garbage {report.found} "
+        f"({report.garbage_bytes} bytes), deleted {report.deleted}"
+    )
+    if args.dry_run:
+        for key in report.garbage:
+            print(f"garbage: {key}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -4,8 +4,12 @@ from src.topology.resource import ResourceID
 class Edge:
     """
     Class to represent an edge.
+
+    The hash is computed once and recomputed only if the source or target is replaced.
     """
 
+    __slots__ = ("_source", "_target", "_hash")
+
     def __init__(self, source: ResourceID, target: ResourceID):
         """
         Initialize Edge with source and target ResourceID.
@@ -13,19 +17,45 @@ class Edge:
         :param source: The source ResourceID of the edge.
         :param target: The target ResourceID of the edge.
         """
-        self.source = source
-        self.target = target
+        self._source = source
+        self._target = target
+        self._hash = None
+
+    @property
+    def source(self) -> ResourceID:
+        return self._source
+
+    @source.setter
+    def source(self, source: ResourceID):
+        self._source = source
+        self._hash = None
+
+    @property
+    def target(self) -> ResourceID:
+        return self._target
+
+    @target.setter
+    def target(self, target: ResourceID):
+        self._target = target
+        self._hash = None
 
     def __eq__(self, __value: object) -> bool:
+        if self is __value:
+            return True
         if not isinstance(__value, Edge):
             return False
-        return self.source == __value.source and self.target == __value.target
+        return self._source == __value._source and self._target == __value._target
 
     def __hash__(self) -> int:
-        return hash(self.__str__())
+        if self._hash is None:
+            self._hash = hash((self._source, self._target))
+        return self._hash
 
     def __str__(self):
-        return f"{self.source}->{self.target}"
+        return f"{self._source}->{self._target}"
+
+    def __repr__(self):
+        return f"Edge({str(self)!r})"
 
     def to_dict(self):
         """
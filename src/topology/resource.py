@@ -1,8 +1,20 @@
+import os
+from functools import lru_cache
+
+# Number of distinct id strings whose parsed ResourceID is kept and shared by from_string
+RESOURCE_ID_CACHE_SIZE = int(os.getenv("RESOURCE_ID_CACHE_SIZE", "100000"))
+
+
 class ResourceID:
     """
     Class to represent the ID of a resource.
+
+    ResourceIDs are immutable: the canonical string and hash are computed once, and from_string
+    returns a shared instance for ids it has already parsed.
     """
 
+    __slots__ = ("_provider", "_type", "_namespace", "_name", "_str", "_hash")
+
     def __init__(self, provider=None, type=None, namespace=None, name=None):
         """
         Initialize ResourceID with provider, type, namespace and name.
@@ -12,10 +24,31 @@ class ResourceID:
         :param namespace: The namespace of the resource.
         :param name: The name of the resource.
         """
-        self.provider = provider
-        self.type = type
-        self.namespace = namespace
-        self.name = name
+        self._provider = provider
+        self._type = type
+        self._namespace = namespace
+        self._name = name
+        if namespace is None:
+            self._str = f"{provider}:{type}:{name}"
+        else:
+            self._str = f"{provider}:{type}:{namespace}:{name}"
+        self._hash = hash(self._str)
+
+    @property
+    def provider(self):
+        return self._provider
+
+    @property
+    def type(self):
+        return self._type
+
+    @property
+    def namespace(self):
+        return self._namespace
+
+    @property
+    def name(self):
+        return self._name
 
     def __str__(self):
         """
@@ -23,9 +56,10 @@ class ResourceID:
 
         :return: String representation of ResourceID.
         """
-        if self.namespace is None:
-            return f"{self.provider}:{self.type}:{self.name}"
-        return f"{self.provider}:{self.type}:{self.namespace}:{self.name}"
+        return self._str
+
+    def __repr__(self):
+        return f"ResourceID({self._str!r})"
 
     def __eq__(self, __value: object) -> bool:
         """method to compare two ResourceID objects
@@ -36,9 +70,11 @@ class ResourceID:
         Returns:
             bool: True if the values are equal, False otherwise
         """
+        if self is __value:
+            return True
         if not isinstance(__value, ResourceID):
             return False
-        return self.__str__() == __value.__str__()
+        return self._hash == __value._hash and self._str == __value._str
 
     def __hash__(self) -> int:
         """method to hash a Resource object
@@ -46,7 +82,10 @@ class ResourceID:
         Returns:
             int: the hash value
         """
-        return hash(self.__str__())
+        return self._hash
+
+    def __reduce__(self):
+        return (ResourceID, (self._provider, self._type, self._namespace, self._name))
 
     @staticmethod
     def from_string(id_string) -> "ResourceID":
@@ -56,13 +95,18 @@ class ResourceID:
         :param id_string: The string representation of the resource ID.
         :return: A ResourceID object.
         """
-        id = ResourceID()
-        parts = id_string.split(":")
-        id.provider = parts[0]
-        id.type = parts[1]
-        id.namespace = parts[2] if len(parts) > 3 else None
-        id.name = parts[-1]
-        return id
+        return _parse_resource_id(id_string)
+
+
+@lru_cache(maxsize=RESOURCE_ID_CACHE_SIZE)
+def _parse_resource_id(id_string: str) -> ResourceID:
+    parts = id_string.split(":")
+    return ResourceID(
+        provider=parts[0],
+        type=parts[1],
+        namespace=parts[2] if len(parts) > 3 else None,
+        name=parts[-1],
+    )
 
 
 class Resource:
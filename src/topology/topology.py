@@ -1,10 +1,9 @@
 from enum import Enum
-from typing import List, Dict
-
-import yaml
+from typing import List, Dict, Optional, Set
 
 from src.topology.edge import Edge
 from src.topology.resource import Resource, ResourceID
+from src.util.yaml_loader import safe_load
 
 
 class DiffStatus(Enum):
@@ -109,11 +108,51 @@ class Topology:
         """
         Initialize Topology with list of resources and edges.
 
+        The resources are indexed by id and the edges kept in a set along with each resource's
+        upstream and downstream neighbours, so lookups and diffs don't scan the lists.
+        Use add_resource and add_edge rather than appending to the lists to keep the indexes current.
+
         :param resources: The list of resources in the topology.
         :param edges: The list of edges in the topology.
         """
-        self.resources = resources
-        self.edges = edges
+        self.resources = []
+        self.edges = []
+        self._resources_by_id: Dict[ResourceID, Resource] = {}
+        self._edge_set: Set[Edge] = set()
+        self._downstream: Dict[ResourceID, Set[ResourceID]] = {}
+        self._upstream: Dict[ResourceID, Set[ResourceID]] = {}
+        for resource in resources:
+            self.add_resource(resource)
+        for edge in edges:
+            self.add_edge(edge)
+
+    def add_resource(self, resource: Resource):
+        self.resources.append(resource)
+        # the first resource with an id wins, matching a scan of the list
+        self._resources_by_id.setdefault(resource.id, resource)
+
+    def add_edge(self, edge: Edge):
+        self.edges.append(edge)
+        self._edge_set.add(edge)
+        self._downstream.setdefault(edge.source, set()).add(edge.target)
+        self._upstream.setdefault(edge.target, set()).add(edge.source)
+
+    def get_resource(self, id: ResourceID) -> Optional[Resource]:
+        return self._resources_by_id.get(id)
+
+    def has_resource(self, id: ResourceID) -> bool:
+        return id in self._resources_by_id
+
+    def has_edge(self, edge: Edge) -> bool:
+        return edge in self._edge_set
+
+    def downstream(self, id: ResourceID) -> Set[ResourceID]:
+        """Returns the ids of the resources this resource has edges to."""
+        return self._downstream.get(id, set())
+
+    def upstream(self, id: ResourceID) -> Set[ResourceID]:
+        """Returns the ids of the resources that have edges to this resource."""
+        return self._upstream.get(id, set())
 
     @staticmethod
     def from_string(yaml_string) -> "Topology":
@@ -123,7 +162,7 @@ class Topology:
         :param yaml_string: The YAML string representation of the topology.
         :return: A Topology object.
         """
-        data = yaml.safe_load(yaml_string)
+        data = safe_load(yaml_string)
 
         if data is None:
             return Topology([], [])
@@ -150,6 +189,8 @@ class Topology:
         """
         Compare this topology with another topology and return the differences.
 
+        Runs in time linear in the size of both topologies.
+
         :param other: The other Topology object to compare with.
         :return: A TopologyDiff object with the differences.
         """
@@ -157,33 +198,30 @@ class Topology:
         edge_diffs = {}
 
         # Compare resources
-        for id in set([r.id for r in self.resources]).union(
-            [r.id for r in other.resources]
-        ):
-            if id not in [r.id for r in self.resources]:
+        for id in self._resources_by_id.keys() | other._resources_by_id.keys():
+            current_resource = self._resources_by_id.get(id)
+            previous_resource = other._resources_by_id.get(id)
+            if current_resource is None:
                 resource_diffs[id] = Diff(
                     DiffStatus.ADDED,
                     target=id,
-                    properties=next(
-                        r for r in other.resources if r.id == id
-                    ).properties,
+                    properties=previous_resource.properties,
                 )
-            elif id not in [r.id for r in other.resources]:
+            elif previous_resource is None:
                 resource_diffs[id] = Diff(DiffStatus.REMOVED, target=id)
             elif include_properties_diff:
-                current_resource = next(r for r in self.resources if r.id == id)
-                previous_resource = next(r for r in other.resources if r.id == id)
                 diff_properties = current_resource.diff_properties(previous_resource)
                 if diff_properties:
                     resource_diffs[id] = Diff(
                         DiffStatus.CHANGED, properties=diff_properties
                     )
 
-        # Compare edges
-        for edge in set(self.edges).union(other.edges):
-            if edge not in self.edges:
+        # Compare edges. Several edges can share a source and the last one visited wins, so iterate in
+        # the same order as a union of the edge lists would.
+        for edge in self._edge_set.union(other.edges):
+            if edge not in self._edge_set:
                 edge_diffs[edge.source] = Diff(DiffStatus.ADDED, target=edge.target)
-            elif edge not in other.edges:
+            elif edge not in other._edge_set:
                 edge_diffs[edge.source] = Diff(DiffStatus.REMOVED, target=edge.target)
 
         return TopologyDiff(resource_diffs, edge_diffs)
@@ -202,7 +240,7 @@ class Topology:
         :param yaml_string: The topology YAML string representation of the topology.
         :return: A Topology object.
         """
-        data = yaml.safe_load(yaml_string)
+        data = safe_load(yaml_string)
 
         if (
             data is None
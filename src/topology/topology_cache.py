@@ -0,0 +1,63 @@
+import hashlib
+import os
+from typing import Callable
+
+from src.topology.topology import Topology
+from src.util.cache import LRUCache
+from src.util.metrics import metrics
+
+# Budget of the cache, measured in bytes of source YAML. 0 disables caching.
+TOPOLOGY_CACHE_MAX_BYTES = int(
+    os.getenv("TOPOLOGY_CACHE_MAX_BYTES", str(64 * 1024 * 1024))
+)
+
+
+class TopologyCache:
+    """
+    Cache of parsed Topology objects keyed by the content hash of the YAML they were parsed from.
+
+    Every chat message and run re-reads the resources and topology YAML of the current version, which
+    rarely changes between requests, so hashing the document is much cheaper than parsing it again.
+    Cached topologies are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, max_bytes: int = TOPOLOGY_CACHE_MAX_BYTES):
+        self._entries: LRUCache[tuple[str, str], tuple[Topology, int]] = LRUCache(
+            max_bytes, sizeof=lambda entry: entry[1]
+        )
+
+    def from_string(self, yaml_string: str) -> Topology:
+        """Cached equivalent of Topology.from_string for resources YAML."""
+        return self._get("resources", yaml_string, Topology.from_string)
+
+    def from_topology_yaml(self, yaml_string: str) -> Topology:
+        """Cached equivalent of Topology.from_topology_yaml for topology YAML."""
+        return self._get("topology", yaml_string, Topology.from_topology_yaml)
+
+    def _get(
+        self, kind: str, yaml_string: str, parse: Callable[[str], Topology]
+    ) -> Topology:
+        if not yaml_string or self._entries.max_bytes <= 0:
+            return parse(yaml_string)
+        key = (kind, hashlib.sha256(yaml_string.encode()).hexdigest())
+        entry = self._entries.get(key)
+        if entry is not None:
+            metrics.counter(
+                "topology_cache_hits_total", "Parsed topologies served from cache"
+            ).inc()
+            return entry[0]
+        metrics.counter(
+            "topology_cache_misses_total", "Topologies parsed from YAML"
+        ).inc()
+        topology = parse(yaml_string)
+        self._entries.put(key, (topology, len(yaml_string)))
+        return topology
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+topology_cache = TopologyCache()
@@ -1,5 +1,6 @@
 from src.engine_service.engine_commands.run import RunEngineResult
 from src.topology.topology import Topology, TopologyDiff
+from src.topology.topology_cache import topology_cache
 
 
 def diff_engine_results(
@@ -19,9 +20,9 @@ def diff_engine_results(
     """
     prev_topology = Topology(resources=[], edges=[])
     if previous is not None:
-        prev_topology = Topology.from_string(previous.resources_yaml)
+        prev_topology = topology_cache.from_string(previous.resources_yaml)
     curr_topology = Topology(resources=[], edges=[])
     if current is not None:
-        curr_topology = Topology.from_string(current.resources_yaml)
+        curr_topology = topology_cache.from_string(current.resources_yaml)
     diff: TopologyDiff = prev_topology.diff_topology(curr_topology, include_properties)
     return diff
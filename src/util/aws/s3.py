@@ -1,9 +1,26 @@
+import asyncio
+import functools
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 
 from botocore.exceptions import ClientError
 
 logger = logging.getLogger(__name__)
 
+# Blocking S3 calls run on a dedicated pool so a slow request never stalls the event loop. The default
+# matches botocore's connection pool size, more threads than connections would just queue on the pool.
+S3_MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", "10"))
+
+_executor = ThreadPoolExecutor(max_workers=S3_MAX_CONCURRENCY, thread_name_prefix="s3")
+
+
+async def run_in_s3_pool(fn, *args, **kwargs):
+    """Runs a blocking boto3 call on the S3 thread pool and awaits its result."""
+    return await asyncio.get_running_loop().run_in_executor(
+        _executor, functools.partial(fn, *args, **kwargs)
+    )
+
 
 def put_object(obj, data):
     """
@@ -48,7 +65,11 @@ def get_object(obj):
     :return: The object data in bytes.
     """
     try:
-        body = obj.get()["Body"].read()
+        stream = obj.get()["Body"]
+        try:
+            body = stream.read()
+        finally:
+            stream.close()
         logger.info(
             "Got object '%s' from bucket '%s'.",
             obj.key,
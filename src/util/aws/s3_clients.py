@@ -0,0 +1,62 @@
+import os
+import threading
+from typing import Any, Callable
+
+from botocore.config import Config
+
+from src.util.aws.s3 import S3_MAX_CONCURRENCY
+
+# Connections kept open per bucket client, defaults to the number of threads that can call S3 at once
+S3_MAX_POOL_CONNECTIONS = int(
+    os.getenv("S3_MAX_POOL_CONNECTIONS", str(S3_MAX_CONCURRENCY))
+)
+S3_TCP_KEEPALIVE = os.getenv("S3_TCP_KEEPALIVE", "true").lower() == "true"
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", "5"))
+# "standard" or "adaptive", see https://boto3.amazonaws.com/v1/documentation/api/latest/guide/retries.html
+S3_RETRY_MODE = os.getenv("S3_RETRY_MODE", "standard")
+S3_CONNECT_TIMEOUT = float(os.getenv("S3_CONNECT_TIMEOUT", "5"))
+S3_READ_TIMEOUT = float(os.getenv("S3_READ_TIMEOUT", "60"))
+
+
+def s3_client_config() -> Config:
+    return Config(
+        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=S3_TCP_KEEPALIVE,
+        retries={"max_attempts": S3_MAX_ATTEMPTS, "mode": S3_RETRY_MODE},
+        connect_timeout=S3_CONNECT_TIMEOUT,
+        read_timeout=S3_READ_TIMEOUT,
+    )
+
+
+class S3ClientRegistry:
+    """
+    Application-scoped S3 resources, one per bucket, each with its own connection pool so a slow bucket
+    cannot exhaust the connections of another.
+
+    Creating a resource resolves credentials and builds a session, which is expensive and not thread-safe,
+    so it is done once per bucket under a lock (ideally at startup via warm) and the Bucket is reused by
+    every request afterwards. The underlying clients are thread-safe and shared with the S3 thread pool.
+    """
+
+    def __init__(self, resource_factory: Callable[[], Any]):
+        self._resource_factory = resource_factory
+        self._buckets: dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, name: str):
+        bucket = self._buckets.get(name)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(name)
+                if bucket is None:
+                    bucket = self._resource_factory().Bucket(name)
+                    self._buckets[name] = bucket
+        return bucket
+
+    def warm(self, *names: str):
+        for name in names:
+            self.bucket(name)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
@@ -0,0 +1,185 @@
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Generic, Hashable, Optional, TypeVar
+
+log = logging.getLogger(__name__)
+
+# Share of its bound a disk cache is brought down to when it outgrows it, so the directory is not
+# scanned again on the next write
+DISK_CACHE_EVICT_TO = 0.9
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """
+    Thread-safe least recently used cache bounded by the total size of its values.
+
+    :param max_bytes: The budget for the sum of sizeof(value) across all entries.
+    :param sizeof: Returns the size of a value in bytes. Values larger than the budget are not cached.
+    """
+
+    def __init__(self, max_bytes: int, sizeof: Callable[[V], int] = len):
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._entries: OrderedDict[K, tuple[V, int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: K) -> Optional[V]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: K, value: V):
+        size = self._sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def delete(self, key: K):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._entries
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+
+class DiskCache:
+    """
+    Byte cache on the local disk, shared by every process on the host. Entries are written to a
+    temporary file and renamed into place, so readers never see partial values.
+
+    :param max_bytes: Bound for the total size of the entries, None for no bound. Hits refresh an entry's
+        modification time, and when the entries outgrow the bound the least recently used ones are deleted
+        until they fit in DISK_CACHE_EVICT_TO of it. Every process keeps its own estimate of the total,
+        which is corrected by the directory scan that eviction does.
+    """
+
+    def __init__(self, root: str | Path, max_bytes: Optional[int] = None):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._bytes: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            value = path.read_bytes()
+            if self.max_bytes is not None:
+                os.utime(path)
+            return value
+        except FileNotFoundError:
+            return None
+        except OSError:
+            log.warning("Could not read disk cache entry %s", key, exc_info=True)
+            return None
+
+    def put(self, key: str, value: bytes):
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(value)
+                os.replace(tmp, path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        except OSError:
+            log.warning("Could not write disk cache entry %s", key, exc_info=True)
+            return
+        if self.max_bytes is not None:
+            self._grow(len(value))
+
+    def _grow(self, size: int):
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = sum(s for _, s, _ in self._entries())
+            else:
+                self._bytes += size
+            if self._bytes > self.max_bytes:
+                self._bytes = self._evict(int(self.max_bytes * DISK_CACHE_EVICT_TO))
+
+    def _entries(self) -> list[tuple[float, int, Path]]:
+        entries = []
+        if not self.root.exists():
+            return entries
+        for shard in self.root.iterdir():
+            if not shard.is_dir():
+                continue
+            for entry in shard.iterdir():
+                if entry.name.startswith(".tmp-"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry))
+        return entries
+
+    def _evict(self, target: int) -> int:
+        """Deletes the least recently used entries until they total at most target bytes, returns the total."""
+        entries = sorted(self._entries(), key=lambda e: e[0])
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= target:
+                break
+            try:
+                entry.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
+
+    def delete(self, key: str):
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        self._bytes = None
+        if not self.root.exists():
+            return
+        for shard in self.root.iterdir():
+            if not shard.is_dir():
+                continue
+            for entry in shard.iterdir():
+                try:
+                    entry.unlink()
+                except FileNotFoundError:
+                    pass
@@ -1,17 +1,59 @@
 import os
+import shutil
 import zipfile
-from io import BytesIO
+from typing import BinaryIO, Iterable
 
+CHUNK_SIZE = 64 * 1024
 
-def zip_directory_recurse(io: BytesIO, output_dir: str) -> bytes:
+# Formats that are already compressed, deflating them again costs CPU and saves nothing
+STORED_SUFFIXES = frozenset(
+    [
+        ".zip",
+        ".gz",
+        ".tgz",
+        ".bz2",
+        ".xz",
+        ".zst",
+        ".jar",
+        ".png",
+        ".jpg",
+        ".jpeg",
+        ".gif",
+        ".webp",
+        ".ico",
+        ".woff",
+        ".woff2",
+        ".mp4",
+        ".pdf",
+    ]
+)
+
+
+def zip_directory_recurse(
+    out: BinaryIO,
+    output_dir: str,
+    stored_suffixes: Iterable[str] = STORED_SUFFIXES,
+):
+    """
+    Writes a zip of output_dir (excluding its secrets directory) to out. Files are copied into the
+    archive in chunks, so memory use is bounded by the chunk size rather than the file sizes.
+
+    :param stored_suffixes: File extensions that are added uncompressed.
+    """
+    stored_suffixes = {s.lower() for s in stored_suffixes}
     secrets_dir = os.path.join(output_dir, "secrets")
-    with zipfile.ZipFile(io, mode="w", compression=zipfile.ZIP_DEFLATED) as out_zip:
+    with zipfile.ZipFile(out, mode="w", compression=zipfile.ZIP_DEFLATED) as out_zip:
         for subdir, dirs, files in os.walk(output_dir):
             for file in files:
                 if subdir == secrets_dir:
                     continue  # skip secrets
                 srcpath = os.path.join(subdir, file)
                 dstpath_in_zip = os.path.relpath(srcpath, start=output_dir)
-                with open(srcpath, "rb") as infile:
-                    out_zip.writestr(dstpath_in_zip, infile.read())
-    return io.getvalue()
+                info = zipfile.ZipInfo.from_file(srcpath, dstpath_in_zip)
+                info.compress_type = (
+                    zipfile.ZIP_STORED
+                    if os.path.splitext(file)[1].lower() in stored_suffixes
+                    else zipfile.ZIP_DEFLATED
+                )
+                with open(srcpath, "rb") as infile, out_zip.open(info, "w") as outfile:
+                    shutil.copyfileobj(infile, outfile, CHUNK_SIZE)
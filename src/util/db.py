@@ -0,0 +1,136 @@
+import time
+from typing import List, Optional
+
+from sqlalchemy import Connection, MetaData, inspect, text
+from sqlalchemy.schema import CreateColumn, CreateIndex
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from src.util.metrics import metrics
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    The default pool of async engines, recording how long checkouts wait for a connection (including opening
+    a new one while the pool is below its size) and how many give up after pool_timeout.
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            metrics.counter(
+                "db_pool_timeouts_total",
+                "Checkouts that gave up waiting for a pooled database connection",
+            ).inc()
+            raise
+        finally:
+            metrics.histogram(
+                "db_pool_wait_seconds",
+                "Time spent waiting for a pooled database connection",
+            ).observe(time.perf_counter() - start)
+            metrics.gauge(
+                "db_pool_checked_out", "Pooled database connections in use"
+            ).set(self.checkedout())
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        metrics.gauge("db_pool_checked_out", "Pooled database connections in use").set(
+            self.checkedout()
+        )
+
+
+async def end_phase(session: Optional[AsyncSession]):
+    """
+    Commits the session's transaction, returning its connection to the pool until the next statement.
+
+    Handlers doing slow work between their reads and writes (engine runs, LLM calls) end the read phase with
+    it, so the slow work holds no connection. The session must not expire objects on commit, see
+    PhasedSessionLocal.
+    """
+    if session is not None:
+        await session.commit()
+
+
+async def rollback_phase(session: Optional[AsyncSession]):
+    """Rolls back what the current phase did, e.g. before recording that the slow work failed."""
+    if session is not None:
+        await session.rollback()
+
+
+# Key of the transaction-level advisory lock serializing schema changes across processes on Postgres.
+SCHEMA_LOCK_ID = 0x494E4652414350
+
+
+def lock_schema(connection: Connection):
+    """
+    Holds off concurrent schema changes until the caller's transaction ends, so the existence checks of
+    create_all and the migrations are not raced by another process. A no-op on databases without advisory locks.
+    """
+    if connection.dialect.name == "postgresql":
+        connection.execute(
+            text("SELECT pg_advisory_xact_lock(:id)"), {"id": SCHEMA_LOCK_ID}
+        )
+
+
+def create_missing_indexes(connection: Connection, metadata: MetaData):
+    """
+    Creates the indexes of metadata's tables that do not exist yet. create_all only creates the indexes of the
+    tables it creates, so this adds indexes declared later to existing databases.
+
+    On Postgres the indexes are built CONCURRENTLY so writes to the table go on meanwhile, which requires an
+    AUTOCOMMIT connection. An index left invalid by an interrupted build is dropped and built again.
+    """
+    postgres = connection.dialect.name == "postgresql"
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            if postgres and _is_invalid_index(connection, index.name):
+                connection.exec_driver_sql(
+                    f"DROP INDEX CONCURRENTLY IF EXISTS {index.name}"
+                )
+            ddl = str(
+                CreateIndex(index, if_not_exists=True).compile(
+                    dialect=connection.dialect
+                )
+            )
+            if postgres:
+                ddl = ddl.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1)
+            connection.exec_driver_sql(ddl)
+
+
+def _is_invalid_index(connection: Connection, name: str) -> bool:
+    return bool(
+        connection.execute(
+            text(
+                "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid"
+                " WHERE c.relname = :name AND NOT i.indisvalid"
+            ),
+            {"name": name},
+        ).scalar()
+    )
+
+
+def add_missing_columns(connection: Connection, metadata: MetaData) -> List[str]:
+    """
+    Adds the columns of metadata's existing tables that are missing from the database, which create_all leaves
+    out. Columns declared after their table was created must be nullable. Returns the added columns as
+    "table.column". Call it under lock_schema so two processes do not both add a column.
+    """
+    inspector = inspect(connection)
+    if_not_exists = "IF NOT EXISTS " if connection.dialect.name == "postgresql" else ""
+    added = []
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = CreateColumn(column).compile(dialect=connection.dialect)
+            connection.exec_driver_sql(
+                f"ALTER TABLE {table.name} ADD COLUMN {if_not_exists}{ddl}"
+            )
+            added.append(f"{table.name}.{column.name}")
+    return added
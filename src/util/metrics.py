@@ -0,0 +1,131 @@
+import threading
+from typing import Dict, Iterable, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Counter:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+class Gauge:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value: float):
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+class Histogram:
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+
+    def bucket_counts(self) -> list[tuple[float, int]]:
+        return list(zip(self.buckets, self._counts))
+
+
+class MetricsRegistry:
+    """
+    In-process metrics registry. Each API worker process keeps its own values, which are exposed in the
+    Prometheus text format by render().
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Tuple[str, str, Dict[Labels, object]]] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, description: str = "", **labels) -> Counter:
+        return self._get(name, "counter", description, labels, Counter)
+
+    def gauge(self, name: str, description: str = "", **labels) -> Gauge:
+        return self._get(name, "gauge", description, labels, Gauge)
+
+    def histogram(self, name: str, description: str = "", **labels) -> Histogram:
+        return self._get(name, "histogram", description, labels, Histogram)
+
+    def _get(self, name, kind, description, labels, factory):
+        key: Labels = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = (kind, description, {})
+            existing_kind, _, series = self._metrics[name]
+            if existing_kind != kind:
+                raise ValueError(
+                    f"Metric {name} is already registered as a {existing_kind}"
+                )
+            if key not in series:
+                series[key] = factory()
+            return series[key]
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            metrics = {
+                name: (kind, description, dict(series))
+                for name, (kind, description, series) in self._metrics.items()
+            }
+        for name, (kind, description, series) in sorted(metrics.items()):
+            if description:
+                lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in series.items():
+                if isinstance(metric, Histogram):
+                    for bound, count in metric.bucket_counts():
+                        lines.append(
+                            f"{name}_bucket{_format_labels(labels, le=bound)} {count}"
+                        )
+                    lines.append(
+                        f"{name}_bucket{_format_labels(labels, le='+Inf')} {metric.count}"
+                    )
+                    lines.append(f"{name}_sum{_format_labels(labels)} {metric.sum}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {metric.count}")
+                else:
+                    lines.append(f"{name}{_format_labels(labels)} {metric.value}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: Labels, **extra) -> str:
+    pairs = list(labels) + [(k, str(v)) for k, v in extra.items()]
+    if len(pairs) == 0:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+metrics = MetricsRegistry()
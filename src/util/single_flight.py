@@ -0,0 +1,146 @@
+import asyncio
+import contextlib
+import fcntl
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import AsyncContextManager, Awaitable, Callable, Optional, TypeVar
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from src.util.metrics import metrics
+
+T = TypeVar("T")
+
+# A cross-worker lock: called with a key, returns an async context manager that holds the lock
+JobLock = Callable[[str], AsyncContextManager[None]]
+
+SINGLE_FLIGHT_LOCK_DIR = os.getenv(
+    "SINGLE_FLIGHT_LOCK_DIR",
+    os.path.join(tempfile.gettempdir(), "infracopilot", "locks"),
+)
+LOCK_POLL_INTERVAL = 0.05
+LOCK_MAX_POLL_INTERVAL = 1.0
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one execution: the first caller runs the function
+    and every caller that arrives while it is in flight receives the same result or exception. The
+    execution runs in its own task, so a cancelled caller does not cancel the others.
+
+    Within a process that is all it takes. When a cross-worker lock is set, the execution additionally
+    holds the lock for its key, so identical jobs in other workers run one after another. The function
+    should then first look for a result a previous holder of the lock already stored (in S3 or a shared
+    cache) before doing the work itself.
+    """
+
+    def __init__(self, name: str, lock: Optional[JobLock] = None):
+        self.name = name
+        self.lock = lock
+        self._calls: dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._run(key, fn))
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            metrics.counter(
+                "single_flight_shared_total",
+                "Calls that waited on an identical in-flight call",
+                flight=self.name,
+            ).inc()
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: asyncio.Task):
+        self._calls.pop(key, None)
+        if not task.cancelled():
+            # mark the exception retrieved in case every caller was cancelled before it finished
+            task.exception()
+
+    async def _run(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        if self.lock is None:
+            return await fn()
+        async with self.lock(f"{self.name}:{key}"):
+            return await fn()
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._calls
+
+
+def _lock_id(key: str) -> str:
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class FileLock:
+    """Cross-process mutual exclusion for every process on the host, using flock'd files."""
+
+    def __init__(self, directory: str | Path = SINGLE_FLIGHT_LOCK_DIR):
+        self.directory = Path(directory)
+
+    @contextlib.asynccontextmanager
+    async def __call__(self, key: str):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.directory / f"{_lock_id(key)}.lock", os.O_RDWR | os.O_CREAT)
+        try:
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(LOCK_POLL_INTERVAL)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+
+class PostgresAdvisoryLock:
+    """
+    Cross-host mutual exclusion using a Postgres session-level advisory lock. Waiters poll
+    pg_try_advisory_lock with backoff, returning their connection to the pool between attempts, so only
+    the holder keeps a connection, for the duration of the block.
+    """
+
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+
+    @contextlib.asynccontextmanager
+    async def __call__(self, key: str):
+        # advisory locks take a bigint, so use the first 8 bytes of the key's hash
+        lock_id = int.from_bytes(
+            bytes.fromhex(_lock_id(key))[:8], byteorder="big", signed=True
+        )
+        conn = await self._acquire(lock_id)
+        try:
+            yield
+        finally:
+            try:
+                await conn.execute(
+                    text("SELECT pg_advisory_unlock(:id)"), {"id": lock_id}
+                )
+            finally:
+                await conn.close()
+
+    async def _acquire(self, lock_id: int) -> AsyncConnection:
+        delay = LOCK_POLL_INTERVAL
+        while True:
+            conn = await self.engine.connect()
+            try:
+                result = await conn.execute(
+                    text("SELECT pg_try_advisory_lock(:id)"), {"id": lock_id}
+                )
+                if result.scalar():
+                    return conn
+            except BaseException:
+                await conn.close()
+                raise
+            await conn.close()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, LOCK_MAX_POLL_INTERVAL)
@@ -0,0 +1,354 @@
+"""
+Object storage backends.
+
+Storages (ArchitectureStorage, BinaryStorage, the S3 run cache tier, the state migration and GC) are written
+against the subset of the boto3 S3 resource API described by the Bucket, ObjectCollection and StoredObject
+protocols below.
+A boto3 Bucket implements it for S3 and S3 compatible stores, LocalBucket implements it on local disk for
+single-node installs, tests and benchmarks.
+"""
+
+import hashlib
+import itertools
+import mmap
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, BinaryIO, Iterable, Iterator, Optional, Protocol
+from urllib.parse import quote, unquote
+
+from botocore.exceptions import ClientError
+
+# "s3", or "local" to store every bucket as a directory under LOCAL_STORAGE_PATH
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "s3")
+LOCAL_STORAGE_PATH = os.getenv("LOCAL_STORAGE_PATH", "./storage")
+# Files at least this large are read through a memory map instead of being copied through a file buffer
+LOCAL_STORAGE_MMAP_THRESHOLD = int(
+    os.getenv("LOCAL_STORAGE_MMAP_THRESHOLD", str(1024 * 1024))
+)
+# Whether writes are flushed to disk before they are renamed into place
+LOCAL_STORAGE_FSYNC = os.getenv("LOCAL_STORAGE_FSYNC", "true").lower() == "true"
+
+_TMP_PREFIX = ".tmp-"
+
+
+class StoredObject(Protocol):
+    key: str
+    bucket_name: str
+
+    @property
+    def last_modified(self) -> datetime: ...
+
+    @property
+    def size(self) -> int: ...
+
+    def load(self): ...
+
+    def get(self, Range: str = None) -> dict[str, Any]: ...
+
+    def put(self, Body) -> dict[str, Any]: ...
+
+    def upload_fileobj(self, Fileobj: BinaryIO): ...
+
+    def copy_from(self, CopySource: dict[str, str], **kwargs): ...
+
+    def delete(self): ...
+
+    def wait_until_exists(self): ...
+
+    def wait_until_not_exists(self): ...
+
+
+class ObjectCollection(Protocol):
+    def all(self) -> "ObjectCollection": ...
+
+    def filter(self, Prefix: str = "", **kwargs) -> "ObjectCollection": ...
+
+    def page_size(self, count: int) -> "ObjectCollection": ...
+
+    def pages(self) -> Iterator[Iterable[StoredObject]]: ...
+
+    def delete(self) -> list[dict[str, Any]]: ...
+
+    def __iter__(self) -> Iterator[StoredObject]: ...
+
+
+class Bucket(Protocol):
+    name: str
+    objects: ObjectCollection
+
+    def Object(self, key: str) -> StoredObject: ...
+
+    def delete_objects(self, Delete: dict[str, Any]) -> dict[str, Any]: ...
+
+
+def _not_found(code: str, operation: str, key: str) -> ClientError:
+    return ClientError(
+        {"Error": {"Code": code, "Message": f"Not Found: {key}"}}, operation
+    )
+
+
+class LocalStorage:
+    """A resource whose buckets are directories under root, used in place of a boto3 S3 resource."""
+
+    def __init__(self, root: str | Path = None):
+        self.root = Path(root or LOCAL_STORAGE_PATH)
+
+    def Bucket(self, name: str) -> "LocalBucket":
+        return LocalBucket(self.root / name, name)
+
+
+class LocalBucket:
+    """
+    A bucket stored in a directory. Objects are spread over two levels of directories by the hash of their
+    key, so no directory grows past a few thousand entries, and named after their escaped key so listings
+    can recover it. Writes go to a temporary file that is renamed into place, so readers only ever see
+    complete objects and concurrent writers of the same key leave one of their writes.
+    """
+
+    def __init__(self, root: str | Path, name: str = None):
+        self.root = Path(root)
+        self.name = name or self.root.name
+        self.objects = LocalObjectCollection(self)
+
+    def Object(self, key: str) -> "LocalObject":
+        return LocalObject(self, key)
+
+    def path(self, key: str) -> Path:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return self.root / digest[:2] / digest[2:4] / quote(key, safe="")
+
+    def delete_objects(self, Delete: dict[str, Any]) -> dict[str, Any]:
+        deleted = []
+        for entry in Delete["Objects"]:
+            self.Object(entry["Key"]).delete()
+            deleted.append({"Key": entry["Key"]})
+        return {"Deleted": deleted}
+
+    def keys(self) -> Iterator[str]:
+        if not self.root.exists():
+            return
+        for directory, _, files in os.walk(self.root):
+            for file in files:
+                if not file.startswith(_TMP_PREFIX):
+                    yield unquote(file)
+
+
+class LocalObjectCollection:
+    """The bucket.objects collection, iterating objects in key order like S3 listings."""
+
+    def __init__(self, bucket: LocalBucket, prefix: str = "", page_size: int = 1000):
+        self._bucket = bucket
+        self._prefix = prefix
+        self._page_size = page_size
+
+    def all(self) -> "LocalObjectCollection":
+        return LocalObjectCollection(self._bucket, page_size=self._page_size)
+
+    def filter(self, Prefix: str = "", **kwargs) -> "LocalObjectCollection":
+        return LocalObjectCollection(self._bucket, Prefix, self._page_size)
+
+    def page_size(self, count: int) -> "LocalObjectCollection":
+        return LocalObjectCollection(self._bucket, self._prefix, count)
+
+    def pages(self) -> Iterator[list["LocalObject"]]:
+        objects = iter(self)
+        while page := list(itertools.islice(objects, self._page_size)):
+            yield page
+
+    def __iter__(self) -> Iterator["LocalObject"]:
+        for key in sorted(k for k in self._bucket.keys() if k.startswith(self._prefix)):
+            obj = LocalObject(self._bucket, key)
+            try:
+                obj.load()
+            except ClientError:
+                # deleted while listing
+                continue
+            yield obj
+
+    def delete(self) -> list[dict[str, Any]]:
+        keys = [obj.key for obj in self]
+        if not keys:
+            return []
+        return [
+            self._bucket.delete_objects(Delete={"Objects": [{"Key": k} for k in keys]})
+        ]
+
+
+class LocalObject:
+    def __init__(self, bucket: LocalBucket, key: str):
+        self._bucket = bucket
+        self.key = key
+        self.bucket_name = bucket.name
+        self._path = bucket.path(key)
+        self._stat: Optional[os.stat_result] = None
+
+    def load(self):
+        try:
+            self._stat = self._path.stat()
+        except FileNotFoundError:
+            raise _not_found("404", "HeadObject", self.key)
+
+    @property
+    def last_modified(self) -> datetime:
+        if self._stat is None:
+            self.load()
+        return datetime.fromtimestamp(self._stat.st_mtime, tz=timezone.utc)
+
+    @property
+    def size(self) -> int:
+        if self._stat is None:
+            self.load()
+        return self._stat.st_size
+
+    def get(self, Range: str = None) -> dict[str, Any]:
+        try:
+            file = self._path.open("rb")
+        except FileNotFoundError:
+            raise _not_found("NoSuchKey", "GetObject", self.key)
+        stat = os.fstat(file.fileno())
+        response = {
+            "LastModified": datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+        }
+        start, end = 0, stat.st_size
+        if Range is not None:
+            try:
+                byte_range = _parse_range(Range, stat.st_size)
+            except ClientError:
+                file.close()
+                raise
+            if byte_range is not None:
+                start, end = byte_range
+                response["ContentRange"] = f"bytes {start}-{end - 1}/{stat.st_size}"
+        response["Body"] = LocalBody(file, stat.st_size, start, end)
+        response["ContentLength"] = end - start
+        return response
+
+    def put(self, Body) -> dict[str, Any]:
+        if isinstance(Body, str):
+            Body = Body.encode("utf-8")
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self._path.parent, prefix=_TMP_PREFIX)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                if isinstance(Body, (bytes, bytearray, memoryview)):
+                    file.write(Body)
+                else:
+                    shutil.copyfileobj(Body, file)
+                if LOCAL_STORAGE_FSYNC:
+                    file.flush()
+                    os.fsync(file.fileno())
+            os.replace(tmp, self._path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        self._stat = None
+        return {}
+
+    def upload_fileobj(self, Fileobj: BinaryIO, **kwargs):
+        self.put(Body=Fileobj)
+
+    def copy_from(self, CopySource: dict[str, str], **kwargs):
+        if CopySource["Bucket"] != self.bucket_name:
+            raise ValueError("Local objects can only be copied within their bucket")
+        if CopySource["Key"] == self.key:
+            # copying an object onto itself only refreshes its modification time
+            try:
+                os.utime(self._path)
+            except FileNotFoundError:
+                raise _not_found("NoSuchKey", "CopyObject", self.key)
+        else:
+            with self._bucket.Object(CopySource["Key"]).get()["Body"] as body:
+                self.put(Body=body)
+        self._stat = None
+
+    def delete(self):
+        try:
+            self._path.unlink()
+        except FileNotFoundError:
+            pass
+        self._stat = None
+
+    def wait_until_exists(self):
+        pass
+
+    def wait_until_not_exists(self):
+        pass
+
+
+def _parse_range(header: str, size: int) -> Optional[tuple[int, int]]:
+    """
+    Resolves a single "bytes=" range like S3 does, returning the start and exclusive end offsets, or None
+    for ranges S3 ignores.
+    """
+    unit, _, spec = header.partition("=")
+    first, dash, last = spec.partition("-")
+    if unit.strip() != "bytes" or not dash or "," in spec:
+        # S3 ignores ranges it cannot parse and returns the whole object
+        return None
+    try:
+        if first == "":
+            start, end = max(size - int(last), 0), size
+        else:
+            start = int(first)
+            end = size if last == "" else min(int(last) + 1, size)
+    except ValueError:
+        return None
+    if start >= size or start >= end:
+        raise ClientError(
+            {"Error": {"Code": "InvalidRange", "Message": f"{header} of {size}"}},
+            "GetObject",
+        )
+    return start, end
+
+
+class LocalBody:
+    """
+    A StreamingBody over the [start, end) range of a local file, memory mapping files of at least
+    LOCAL_STORAGE_MMAP_THRESHOLD. The file is closed once the range is read to the end, or by close().
+    """
+
+    def __init__(self, file: BinaryIO, size: int, start: int = 0, end: int = None):
+        self._file = file
+        self._map = None
+        self._offset = start
+        self._end = size if end is None else end
+        if 0 < size and size >= LOCAL_STORAGE_MMAP_THRESHOLD:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        elif start:
+            file.seek(start)
+
+    def read(self, amt: int = None) -> bytes:
+        if self._file.closed:
+            return b""
+        end = self._end if amt is None else min(self._offset + amt, self._end)
+        if self._map is None:
+            data = self._file.read(end - self._offset)
+        else:
+            data = self._map[self._offset : end]
+        self._offset += len(data)
+        if self._offset >= self._end:
+            self.close()
+        return data
+
+    def iter_chunks(self, chunk_size: int = 1024) -> Iterable[bytes]:
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self) -> "LocalBody":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -28,6 +28,7 @@ from src.environment_management.environment_version import (
     EnvironmentVersionDoesNotExistError,
 )
 from src.environment_management.models import Environment, EnvironmentVersion
+from src.state_manager.architecture_storage import ArchitectureStorage
 
 
 class TestArchitectureHandler(aiounittest.AsyncTestCase):
@@ -59,7 +60,7 @@ class TestArchitectureHandler(aiounittest.AsyncTestCase):
             iac_topology="test-yaml",
         )
 
-        cls.mock_store = mock.MagicMock()
+        cls.mock_store = mock.MagicMock(spec=ArchitectureStorage)
         cls.mock_ev_dao = mock.MagicMock()
         cls.mock_env_dao = mock.MagicMock()
         cls.mock_arch_dao = mock.MagicMock()
@@ -225,7 +226,9 @@ class TestArchitectureHandler(aiounittest.AsyncTestCase):
         self.mock_ev_dao.get_current_version = mock.AsyncMock(
             return_value=self.test_environment_version
         )
-        self.mock_store.get_state_from_fs = mock.Mock(return_value=self.test_result)
+        self.mock_store.get_state_from_fs = mock.AsyncMock(
+            return_value=self.test_result
+        )
         result = await self.arch_handler.get_version("test-id", "default")
         self.assertEqual(
             result.body,
@@ -236,8 +239,37 @@ class TestArchitectureHandler(aiounittest.AsyncTestCase):
             "test-id", "default"
         )
         self.mock_store.get_state_from_fs.assert_called_once_with(
-            self.test_environment_version
+            self.test_environment_version, fields=["resources_yaml", "topology_yaml"]
+        )
+
+    async def test_get_version_selected_fields(self):
+        self.mock_ev_dao.get_current_version = mock.AsyncMock(
+            return_value=self.test_environment_version
+        )
+        self.mock_store.get_state_from_fs = mock.AsyncMock(
+            return_value=self.test_result
+        )
+        result = await self.arch_handler.get_version(
+            "test-id", "default", fields=["topology_yaml"]
+        )
+        self.assertIn(
+            b'\\"state\\": {\\"resources_yaml\\": null, \\"topology_yaml\\": \\"test-yaml\\"}',
+            result.body,
+        )
+        self.mock_store.get_state_from_fs.assert_called_once_with(
+            self.test_environment_version, fields=["topology_yaml"]
+        )
+
+    async def test_get_version_unknown_field(self):
+        self.mock_ev_dao.get_current_version = mock.AsyncMock(
+            return_value=self.test_environment_version
         )
+        with self.assertRaises(HTTPException) as e:
+            await self.arch_handler.get_version(
+                "test-id", "default", fields=["iac_topology"]
+            )
+        self.assertEqual(e.exception.status_code, 400)
+        self.mock_ev_dao.get_current_version.assert_not_called()
 
     async def test_get_version_not_found(self):
         self.mock_ev_dao.get_current_version = mock.AsyncMock(return_value=None)
@@ -265,7 +297,9 @@ class TestArchitectureHandler(aiounittest.AsyncTestCase):
         self.mock_ev_dao.get_previous_state = mock.AsyncMock(
             return_value=self.test_environment_version
         )
-        self.mock_store.get_state_from_fs = mock.Mock(return_value=self.test_result)
+        self.mock_store.get_state_from_fs = mock.AsyncMock(
+            return_value=self.test_result
+        )
         result = await self.arch_handler.get_environments_previous_state(
             "test-id", "default", 1
         )
@@ -278,7 +312,7 @@ class TestArchitectureHandler(aiounittest.AsyncTestCase):
             "test-id", "default", 1
         )
         self.mock_store.get_state_from_fs.assert_called_once_with(
-            self.test_environment_version
+            self.test_environment_version, fields=["resources_yaml", "topology_yaml"]
         )
 
     async def test_get_environments_previous_state_not_found(self):
@@ -302,7 +336,9 @@ class TestArchitectureHandler(aiounittest.AsyncTestCase):
         self.mock_ev_dao.get_next_state = mock.AsyncMock(
             return_value=self.test_environment_version
         )
-        self.mock_store.get_state_from_fs = mock.Mock(return_value=self.test_result)
+        self.mock_store.get_state_from_fs = mock.AsyncMock(
+            return_value=self.test_result
+        )
         result = await self.arch_handler.get_environments_next_state(
             "test-id", "default", 1
         )
@@ -313,7 +349,7 @@ class TestArchitectureHandler(aiounittest.AsyncTestCase):
         self.assertEqual(result.status_code, 200)
         self.mock_ev_dao.get_next_state.assert_called_once_with("test-id", "default", 1)
         self.mock_store.get_state_from_fs.assert_called_once_with(
-            self.test_environment_version
+            self.test_environment_version, fields=["resources_yaml", "topology_yaml"]
         )
 
     async def test_get_environments_next_state_not_found(self):
@@ -450,12 +486,22 @@ class TestArchitectureHandler(aiounittest.AsyncTestCase):
             return_value=[self.test_environment]
         )
         self.mock_env_dao.add_environment = mock.Mock(return_value=None)
-        self.mock_ev_dao.list_environment_versions = mock.AsyncMock(
-            return_value=[self.test_environment_version]
+        self.mock_ev_dao.clone_environment_versions = mock.AsyncMock(return_value=1)
+        cloned = EnvironmentVersion(
+            architecture_id=test_hash,
+            id="default",
+            version=0,
+            version_hash="test-hash",
+            state_location="test-id/default/0/state.json",
         )
-        self.mock_ev_dao.add_environment_version = mock.Mock(return_value=None)
-        self.mock_store.get_state_from_fs = mock.Mock(return_value=self.test_result)
-        self.mock_store.write_state_to_fs = mock.Mock(return_value="location")
+        self.mock_ev_dao.list_versions_with_unshared_state = mock.AsyncMock(
+            return_value=[cloned]
+        )
+        self.mock_store.share_state = mock.AsyncMock(
+            return_value="cas/manifests/ab/abc/manifest.json"
+        )
+        self.mock_store.get_state_from_fs = mock.AsyncMock()
+        self.mock_store.write_state_to_fs = mock.AsyncMock()
         mock_authz = mock.MagicMock()
         mock_authz.add_architecture_owner = mock.AsyncMock(return_value=None)
         result = await self.arch_handler.clone_architecture(
@@ -486,21 +532,49 @@ class TestArchitectureHandler(aiounittest.AsyncTestCase):
         self.mock_env_dao.get_environments_for_architecture.assert_called_once_with(
             "test-id"
         )
-        self.mock_store.get_state_from_fs.assert_called_once_with(
-            self.test_environment_version
+        self.mock_ev_dao.clone_environment_versions.assert_called_once_with(
+            "test-id", test_hash
         )
-        v = EnvironmentVersion(
-            architecture_id=test_hash,
-            id="default",
-            version=0,
-            version_hash="test-hash",
-            state_location="location",
+        self.mock_ev_dao.list_versions_with_unshared_state.assert_called_once_with(
+            test_hash, "cas/"
         )
-        self.mock_store.write_state_to_fs.assert_called_once_with(v, self.test_result)
-        self.mock_ev_dao.list_environment_versions.assert_called_once_with(
-            "test-id", "default"
+        self.mock_store.share_state.assert_called_once_with(cloned)
+        self.assertEqual(cloned.state_location, "cas/manifests/ab/abc/manifest.json")
+        self.mock_store.get_state_from_fs.assert_not_called()
+        self.mock_store.write_state_to_fs.assert_not_called()
+
+    @mock.patch("src.backend_orchestrator.architecture_handler.datetime")
+    @mock.patch("src.backend_orchestrator.architecture_handler.uuid")
+    async def test_clone_architecture_shared_states(
+        self,
+        mock_uuid: mock.Mock,
+        mock_datetime: mock.Mock,
+    ):
+        mock_datetime.utcnow.return_value = self.created_at
+        mock_uuid.uuid4.return_value = "hash"
+        self.mock_arch_dao.get_architecture = mock.AsyncMock(
+            return_value=self.test_architecture
+        )
+        self.mock_arch_dao.add_architecture = mock.Mock(return_value=None)
+        self.mock_env_dao.get_environments_for_architecture = mock.AsyncMock(
+            return_value=[self.test_environment]
+        )
+        self.mock_env_dao.add_environment = mock.Mock(return_value=None)
+        self.mock_ev_dao.clone_environment_versions = mock.AsyncMock(return_value=3)
+        self.mock_ev_dao.list_versions_with_unshared_state = mock.AsyncMock(
+            return_value=[]
+        )
+        self.mock_store.share_state = mock.AsyncMock()
+        mock_authz = mock.MagicMock()
+        mock_authz.add_architecture_owner = mock.AsyncMock(return_value=None)
+        result = await self.arch_handler.clone_architecture(
+            "test-owner", "test-id", "new-name", "test-owner", mock_authz
+        )
+        self.assertEqual(result.status_code, 200)
+        self.mock_ev_dao.clone_environment_versions.assert_called_once_with(
+            "test-id", "hash"
         )
-        self.mock_ev_dao.add_environment_version.assert_called_once_with(v)
+        self.mock_store.share_state.assert_not_called()
 
     async def test_clone_architecture_not_found(self):
         self.mock_arch_dao.get_architecture = mock.AsyncMock(
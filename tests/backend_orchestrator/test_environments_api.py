@@ -378,7 +378,7 @@ class TestPromote(aiounittest.AsyncTestCase):
         new_callable=AsyncMock,
     )
     @patch("src.backend_orchestrator.environments_api.get_environment_manager")
-    @patch("src.backend_orchestrator.environments_api.SessionLocal")
+    @patch("src.backend_orchestrator.environments_api.PhasedSessionLocal")
     @patch(
         "src.backend_orchestrator.environments_api.deps.authz_service",
         new_callable=MagicMock,
@@ -413,7 +413,7 @@ class TestPromote(aiounittest.AsyncTestCase):
         session = MagicMock()
         authz_service.can_write_to_architecture = AsyncMock(return_value=True)
 
-        session_local.begin.return_value.__aenter__.return_value = session
+        session_local.return_value.__aenter__.return_value = session
 
         # Act
         result = await promote(request, "id", "env_id")
@@ -7,7 +7,8 @@ from src.backend_orchestrator.get_valid_edge_targets_handler import (
     EdgeTargetHandler,
 )
 
-from src.engine_service.binaries.fetcher import Binary
+from src.engine_service.binaries.fetcher import Binary, BinaryStorage
+from src.state_manager.architecture_storage import ArchitectureStorage
 from src.engine_service.engine_commands.get_valid_edge_targets import (
     GetValidEdgeTargetsRequest,
     GetValidEdgeTargetsResult,
@@ -56,9 +57,9 @@ class TestValidEdgeTargetsHandler(aiounittest.AsyncTestCase):
             topology_yaml="test-yaml",
             iac_topology="test-yaml",
         )
-        self.mock_store: mock.Mock = mock.Mock()
+        self.mock_store: mock.Mock = mock.Mock(spec=ArchitectureStorage)
         self.mock_ev_dao: mock.Mock = mock.Mock()
-        self.mock_binary_store: mock.Mock = mock.Mock()
+        self.mock_binary_store: mock.Mock = mock.Mock(spec=BinaryStorage)
         self.edge_handler = EdgeTargetHandler(
             self.mock_store,
             self.mock_ev_dao,
@@ -79,7 +80,9 @@ class TestValidEdgeTargetsHandler(aiounittest.AsyncTestCase):
         mock_get_valid_edge_targets: mock.Mock,
     ):
         self.mock_ev_dao.get_current_version = mock.AsyncMock(return_value=self.test_ev)
-        self.mock_store.get_state_from_fs = mock.Mock(return_value=self.input_graph)
+        self.mock_store.get_state_from_fs = mock.AsyncMock(
+            return_value=self.input_graph
+        )
         mock_get_valid_edge_targets.return_value = self.test_result
         result = await self.edge_handler.get_valid_edge_targets(
             "test-architecture-id",
@@ -95,7 +98,9 @@ class TestValidEdgeTargetsHandler(aiounittest.AsyncTestCase):
         self.mock_ev_dao.get_current_version.assert_called_once_with(
             "test-architecture-id", "test-id"
         )
-        self.mock_store.get_state_from_fs.assert_called_once_with(self.test_ev)
+        self.mock_store.get_state_from_fs.assert_called_once_with(
+            self.test_ev, fields=["resources_yaml"]
+        )
         mock_get_valid_edge_targets.assert_called_once_with(
             GetValidEdgeTargetsRequest(
                 id="test-architecture-id",
@@ -1,3 +1,4 @@
+import asyncio
 from io import BytesIO
 from unittest import mock
 
@@ -16,7 +17,12 @@ from src.environment_management.models import (
     Architecture,
 )
 
-from src.engine_service.binaries.fetcher import Binary
+from src.engine_service.binaries.fetcher import Binary, BinaryStorage
+from src.state_manager.architecture_storage import (
+    ArchitectureStorage,
+    IacDownload,
+    IacRangeNotSatisfiableError,
+)
 
 from src.engine_service.engine_commands.run import RunEngineResult
 
@@ -47,14 +53,19 @@ class TestGetIac(aiounittest.AsyncTestCase):
         iac_topology="test-yaml",
     )
     iobytes = b"test-bytes"
-    export_iac_result = ExportIacResult(iobytes)
+
+    def download(self, *args, **kwargs):
+        return IacDownload(iter([self.iobytes]), len(self.iobytes))
+
+    def export_iac_result(self):
+        return ExportIacResult(BytesIO(self.iobytes))
 
     @classmethod
     def setUpClass(cls):
-        cls.mock_architecture_storage = mock.Mock()
+        cls.mock_architecture_storage = mock.Mock(spec=ArchitectureStorage)
         cls.mock_ev_dao = mock.Mock()
         cls.mock_arch_dao = mock.Mock()
-        cls.mock_binary_store: mock.Mock = mock.Mock()
+        cls.mock_binary_store: mock.Mock = mock.Mock(spec=BinaryStorage)
         cls.iac_orchestrator = IaCOrchestrator(
             cls.mock_architecture_storage,
             cls.mock_arch_dao,
@@ -67,6 +78,10 @@ class TestGetIac(aiounittest.AsyncTestCase):
         self.mock_ev_dao.reset_mock()
         self.mock_arch_dao.reset_mock()
         self.mock_binary_store.reset_mock()
+        self.mock_architecture_storage.generated_iac_exists = mock.AsyncMock(
+            return_value=False
+        )
+        self.test_env_version.iac_location = None
 
     @mock.patch(
         "src.backend_orchestrator.iac_handler.export_iac", new_callable=mock.AsyncMock
@@ -78,37 +93,40 @@ class TestGetIac(aiounittest.AsyncTestCase):
         self.mock_arch_dao.get_architecture = mock.AsyncMock(
             return_value=self.test_architecture
         )
-        self.mock_architecture_storage.get_iac_from_fs = mock.Mock(return_value=None)
-        self.mock_architecture_storage.get_state_from_fs = mock.Mock(
+        self.mock_architecture_storage.open_iac = mock.AsyncMock(
+            side_effect=self.download
+        )
+        self.mock_architecture_storage.get_state_from_fs = mock.AsyncMock(
             return_value=self.test_result
         )
-        self.mock_architecture_storage.write_iac_to_fs = mock.Mock(
-            return_value="test-location"
+        written = []
+        self.mock_architecture_storage.write_iac_to_fs = mock.AsyncMock(
+            side_effect=lambda env, f: written.append(f.read()) or "test-location"
         )
-        mock_export_iac.return_value = self.export_iac_result
+        mock_export_iac.return_value = self.export_iac_result()
         self.mock_ev_dao.update_environment_version = mock.AsyncMock()
         result = await self.iac_orchestrator.get_iac(self.test_id, self.test_id, 0)
         content = await read_streaming_response(result)
-        self.assertEqual(content.decode(), self.export_iac_result.iac_bytes.decode())
+        self.assertEqual(content, self.iobytes)
         self.assertEqual(result.status_code, 200)
         self.assertEqual(result.media_type, "application/x-zip-compressed")
         self.mock_ev_dao.get_current_version.assert_called_once_with(
             self.test_id, self.test_id
         )
         self.mock_arch_dao.get_architecture.assert_called_once_with(self.test_id)
-        self.mock_architecture_storage.get_iac_from_fs.assert_called_once_with(
-            self.test_env_version
+        self.mock_architecture_storage.open_iac.assert_called_once_with(
+            self.test_env_version, byte_range=None
         )
         self.mock_architecture_storage.get_state_from_fs.assert_called_once_with(
-            self.test_env_version
-        )
-        self.mock_architecture_storage.write_iac_to_fs.assert_called_once_with(
-            self.test_env_version, self.iobytes
+            self.test_env_version, fields=["resources_yaml"]
         )
+        self.assertEqual(written, [self.iobytes])
+        self.assertTrue(mock_export_iac.return_value.iac_file.closed)
         mock_export_iac.assert_called_once_with(
             ExportIacRequest(
                 input_graph=self.test_result.resources_yaml,
                 name=self.test_architecture.name,
+                id=self.test_id,
             )
         )
         self.mock_ev_dao.update_environment_version.assert_called_once_with(
@@ -129,20 +147,21 @@ class TestGetIac(aiounittest.AsyncTestCase):
         self.mock_arch_dao.get_architecture = mock.AsyncMock(
             return_value=self.test_architecture
         )
-        self.mock_architecture_storage.get_iac_from_fs = mock.Mock(
-            return_value=self.iobytes
+        self.test_env_version.iac_location = "test-location"
+        self.mock_architecture_storage.open_iac = mock.AsyncMock(
+            side_effect=self.download
         )
         result = await self.iac_orchestrator.get_iac(self.test_id, self.test_id, 0)
         content = await read_streaming_response(result)
-        self.assertEqual(content.decode(), self.export_iac_result.iac_bytes.decode())
+        self.assertEqual(content, self.iobytes)
         self.assertEqual(result.status_code, 200)
         self.assertEqual(result.media_type, "application/x-zip-compressed")
         self.mock_ev_dao.get_current_version.assert_called_once_with(
             self.test_id, self.test_id
         )
         self.mock_arch_dao.get_architecture.assert_called_once_with(self.test_id)
-        self.mock_architecture_storage.get_iac_from_fs.assert_called_once_with(
-            self.test_env_version
+        self.mock_architecture_storage.open_iac.assert_called_once_with(
+            self.test_env_version, byte_range=None
         )
         self.mock_architecture_storage.get_state_from_fs.assert_not_called()
         self.mock_architecture_storage.write_iac_to_fs.assert_not_called()
@@ -150,6 +169,76 @@ class TestGetIac(aiounittest.AsyncTestCase):
         self.mock_ev_dao.update_environment_version.assert_not_called()
         self.mock_binary_store.ensure_binary.assert_not_called()
 
+    @mock.patch(
+        "src.backend_orchestrator.iac_handler.export_iac", new_callable=mock.AsyncMock
+    )
+    async def test_get_iac_concurrent_requests_share_export(
+        self, mock_export_iac: mock.Mock
+    ):
+        self.mock_ev_dao.get_current_version = mock.AsyncMock(
+            return_value=self.test_env_version
+        )
+        self.mock_arch_dao.get_architecture = mock.AsyncMock(
+            return_value=self.test_architecture
+        )
+        self.mock_architecture_storage.open_iac = mock.AsyncMock(
+            side_effect=self.download
+        )
+        self.mock_architecture_storage.get_state_from_fs = mock.AsyncMock(
+            return_value=self.test_result
+        )
+        self.mock_architecture_storage.write_iac_to_fs = mock.AsyncMock(
+            return_value="test-location"
+        )
+
+        async def slow_export(request):
+            await asyncio.sleep(0.05)
+            return self.export_iac_result()
+
+        mock_export_iac.side_effect = slow_export
+        self.mock_ev_dao.update_environment_version = mock.AsyncMock()
+        results = await asyncio.gather(
+            *[
+                self.iac_orchestrator.get_iac(self.test_id, self.test_id, 0)
+                for _ in range(3)
+            ]
+        )
+        for result in results:
+            content = await read_streaming_response(result)
+            self.assertEqual(content, self.iobytes)
+        mock_export_iac.assert_called_once()
+        self.mock_architecture_storage.write_iac_to_fs.assert_called_once()
+
+    @mock.patch(
+        "src.backend_orchestrator.iac_handler.export_iac", new_callable=mock.AsyncMock
+    )
+    async def test_get_iac_already_generated_by_another_worker(
+        self, mock_export_iac: mock.Mock
+    ):
+        self.mock_ev_dao.get_current_version = mock.AsyncMock(
+            return_value=self.test_env_version
+        )
+        self.mock_arch_dao.get_architecture = mock.AsyncMock(
+            return_value=self.test_architecture
+        )
+        self.mock_architecture_storage.open_iac = mock.AsyncMock(
+            side_effect=self.download
+        )
+        self.mock_architecture_storage.generated_iac_exists = mock.AsyncMock(
+            return_value=True
+        )
+        self.mock_ev_dao.update_environment_version = mock.AsyncMock()
+        result = await self.iac_orchestrator.get_iac(self.test_id, self.test_id, 0)
+        content = await read_streaming_response(result)
+        self.assertEqual(content, self.iobytes)
+        mock_export_iac.assert_not_called()
+        self.mock_architecture_storage.write_iac_to_fs.assert_not_called()
+        self.mock_ev_dao.update_environment_version.assert_called_once()
+        self.assertEqual(
+            self.test_env_version.iac_location,
+            "state/test-id/default/0/iac.zip",
+        )
+
     async def test_get_iac_version_not_found(self):
         self.mock_ev_dao.get_current_version = mock.AsyncMock(return_value=None)
         self.mock_arch_dao.get_architecture = mock.AsyncMock(
@@ -166,7 +255,7 @@ class TestGetIac(aiounittest.AsyncTestCase):
             self.test_id, self.test_id
         )
         self.mock_arch_dao.get_architecture.assert_called_once_with(self.test_id)
-        self.mock_architecture_storage.get_iac_from_fs.assert_not_called()
+        self.mock_architecture_storage.open_iac.assert_not_called()
         self.mock_architecture_storage.get_state_from_fs.assert_not_called()
         self.mock_architecture_storage.write_iac_to_fs.assert_not_called()
         self.mock_ev_dao.update_environment_version.assert_not_called()
@@ -189,7 +278,7 @@ class TestGetIac(aiounittest.AsyncTestCase):
             self.test_id, self.test_id
         )
         self.mock_arch_dao.get_architecture.assert_called_once_with(self.test_id)
-        self.mock_architecture_storage.get_iac_from_fs.assert_not_called()
+        self.mock_architecture_storage.open_iac.assert_not_called()
         self.mock_architecture_storage.get_state_from_fs.assert_not_called()
         self.mock_architecture_storage.write_iac_to_fs.assert_not_called()
         self.mock_ev_dao.update_environment_version.assert_not_called()
@@ -202,7 +291,7 @@ class TestGetIac(aiounittest.AsyncTestCase):
         self.mock_arch_dao.get_architecture = mock.AsyncMock(
             return_value=self.test_architecture
         )
-        self.mock_architecture_storage.get_iac_from_fs = mock.Mock(return_value=None)
+        self.mock_architecture_storage.open_iac = mock.AsyncMock()
         self.mock_ev_dao.update_environment_version = mock.AsyncMock()
         with self.assertRaises(HTTPException) as e:
             await self.iac_orchestrator.get_iac(self.test_id, self.test_id, 1)
@@ -212,7 +301,7 @@ class TestGetIac(aiounittest.AsyncTestCase):
             self.test_id, self.test_id
         )
         self.mock_arch_dao.get_architecture.assert_called_once_with(self.test_id)
-        self.mock_architecture_storage.get_iac_from_fs.assert_not_called()
+        self.mock_architecture_storage.open_iac.assert_not_called()
         self.mock_architecture_storage.get_state_from_fs.assert_not_called()
         self.mock_architecture_storage.write_iac_to_fs.assert_not_called()
         self.mock_ev_dao.update_environment_version.assert_not_called()
@@ -225,8 +314,8 @@ class TestGetIac(aiounittest.AsyncTestCase):
         self.mock_arch_dao.get_architecture = mock.AsyncMock(
             return_value=self.test_architecture
         )
-        self.mock_architecture_storage.get_iac_from_fs = mock.Mock(return_value=None)
-        self.mock_architecture_storage.get_state_from_fs = mock.Mock(
+        self.mock_architecture_storage.open_iac = mock.AsyncMock()
+        self.mock_architecture_storage.get_state_from_fs = mock.AsyncMock(
             side_effect=Exception("test-error")
         )
         self.mock_ev_dao.update_environment_version = mock.AsyncMock()
@@ -238,12 +327,118 @@ class TestGetIac(aiounittest.AsyncTestCase):
             self.test_id, self.test_id
         )
         self.mock_arch_dao.get_architecture.assert_called_once_with(self.test_id)
-        self.mock_architecture_storage.get_iac_from_fs.assert_called_once_with(
-            self.test_env_version
-        )
+        self.mock_architecture_storage.open_iac.assert_not_called()
         self.mock_architecture_storage.get_state_from_fs.assert_called_once_with(
-            self.test_env_version
+            self.test_env_version, fields=["resources_yaml"]
         )
         self.mock_architecture_storage.write_iac_to_fs.assert_not_called()
         self.mock_ev_dao.update_environment_version.assert_not_called()
         self.mock_binary_store.ensure_binary.assert_not_called()
+
+    async def test_get_iac_range(self):
+        self.mock_ev_dao.get_current_version = mock.AsyncMock(
+            return_value=self.test_env_version
+        )
+        self.mock_arch_dao.get_architecture = mock.AsyncMock(
+            return_value=self.test_architecture
+        )
+        self.test_env_version.iac_location = "test-location"
+        self.mock_architecture_storage.open_iac = mock.AsyncMock(
+            return_value=IacDownload(iter([b"bytes"]), 5, "bytes 5-9/10")
+        )
+        result = await self.iac_orchestrator.get_iac(
+            self.test_id, self.test_id, 0, byte_range="bytes=5-"
+        )
+        self.assertEqual(await read_streaming_response(result), b"bytes")
+        self.assertEqual(result.status_code, 206)
+        self.assertEqual(result.headers["Content-Range"], "bytes 5-9/10")
+        self.assertEqual(result.headers["Content-Length"], "5")
+        self.mock_architecture_storage.open_iac.assert_called_once_with(
+            self.test_env_version, byte_range="bytes=5-"
+        )
+
+        # multipart ranges are answered with the whole archive
+        self.mock_architecture_storage.open_iac = mock.AsyncMock(
+            side_effect=self.download
+        )
+        result = await self.iac_orchestrator.get_iac(
+            self.test_id, self.test_id, 0, byte_range="bytes=0-1,5-6"
+        )
+        self.assertEqual(result.status_code, 200)
+        self.mock_architecture_storage.open_iac.assert_called_once_with(
+            self.test_env_version, byte_range=None
+        )
+
+        self.mock_architecture_storage.open_iac = mock.AsyncMock(
+            side_effect=IacRangeNotSatisfiableError("bytes=20-")
+        )
+        with self.assertRaises(HTTPException) as e:
+            await self.iac_orchestrator.get_iac(
+                self.test_id, self.test_id, 0, byte_range="bytes=20-"
+            )
+        self.assertEqual(e.exception.status_code, 416)
+
+    @mock.patch("src.backend_orchestrator.iac_handler.IAC_DOWNLOAD_MODE", "redirect")
+    async def test_get_iac_redirect(self):
+        self.mock_ev_dao.get_current_version = mock.AsyncMock(
+            return_value=self.test_env_version
+        )
+        self.mock_arch_dao.get_architecture = mock.AsyncMock(
+            return_value=self.test_architecture
+        )
+        self.test_env_version.iac_location = "test-location"
+        self.mock_architecture_storage.open_iac = mock.AsyncMock(
+            side_effect=self.download
+        )
+        self.mock_architecture_storage.get_iac_url = mock.Mock(
+            return_value="https://bucket/test-location?signature"
+        )
+        result = await self.iac_orchestrator.get_iac(self.test_id, self.test_id, 0)
+        self.assertEqual(result.status_code, 307)
+        self.assertEqual(
+            result.headers["Location"], "https://bucket/test-location?signature"
+        )
+        self.mock_architecture_storage.get_iac_url.assert_called_once_with(
+            self.test_env_version, 300, "images.zip"
+        )
+        self.mock_architecture_storage.open_iac.assert_not_called()
+
+        # storages that cannot presign URLs stream the iac instead
+        self.mock_architecture_storage.get_iac_url.return_value = None
+        result = await self.iac_orchestrator.get_iac(self.test_id, self.test_id, 0)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(await read_streaming_response(result), self.iobytes)
+
+    @mock.patch(
+        "src.backend_orchestrator.iac_handler.export_iac", new_callable=mock.AsyncMock
+    )
+    async def test_pregenerate_iac(self, mock_export_iac: mock.Mock):
+        self.mock_ev_dao.get_current_version = mock.AsyncMock(
+            return_value=self.test_env_version
+        )
+        self.mock_arch_dao.get_architecture = mock.AsyncMock(
+            return_value=self.test_architecture
+        )
+        self.mock_architecture_storage.get_state_from_fs = mock.AsyncMock(
+            return_value=self.test_result
+        )
+        self.mock_architecture_storage.write_iac_to_fs = mock.AsyncMock(
+            return_value="test-location"
+        )
+        mock_export_iac.return_value = self.export_iac_result()
+        self.mock_ev_dao.update_environment_version = mock.AsyncMock()
+        await self.iac_orchestrator.pregenerate_iac(self.test_id, self.test_id)
+        mock_export_iac.assert_called_once()
+        self.assertEqual(self.test_env_version.iac_location, "test-location")
+        self.mock_ev_dao.update_environment_version.assert_called_once_with(
+            self.test_env_version
+        )
+
+        # failures are logged, not raised
+        mock_export_iac.reset_mock()
+        self.test_env_version.iac_location = None
+        self.mock_architecture_storage.get_state_from_fs.side_effect = Exception(
+            "test-error"
+        )
+        await self.iac_orchestrator.pregenerate_iac(self.test_id, self.test_id)
+        mock_export_iac.assert_not_called()
@@ -3,14 +3,19 @@ from unittest import mock
 
 import datetime
 
+from src.backend_orchestrator.models import EnvironmentVersionNotLatestError
 from src.backend_orchestrator.run_engine_handler import (
     CopilotRunRequest,
     EngineOrchestrator,
 )
 from src.constraints.application_constraint import ApplicationConstraint
-from src.engine_service.binaries.fetcher import Binary
+from src.engine_service.binaries.fetcher import Binary, BinaryStorage
+from src.state_manager.architecture_storage import ArchitectureStorage
 from src.environment_management.environment_version import (
     EnvironmentVersionDoesNotExistError,
+    EnvironmentVersionReservedError,
+    VersionHead,
+    VersionReservation,
 )
 from src.environment_management.models import (
     Architecture,
@@ -73,10 +78,10 @@ class TestArchitectureRun(aiounittest.AsyncTestCase):
         self.test_constraints = [
             {"scope": "application", "operator": "add", "node": "aws:lambda_function:a"}
         ]
-        self.mock_store: mock.Mock = mock.Mock()
+        self.mock_store: mock.Mock = mock.Mock(spec=ArchitectureStorage)
         self.mock_ev_dao: mock.Mock = mock.Mock()
         self.mock_env_dao: mock.Mock = mock.Mock()
-        self.mock_binary_store: mock.Mock = mock.Mock()
+        self.mock_binary_store: mock.Mock = mock.Mock(spec=BinaryStorage)
 
         self.arch_handler = EngineOrchestrator(
             self.mock_store,
@@ -90,6 +95,11 @@ class TestArchitectureRun(aiounittest.AsyncTestCase):
         self.mock_ev_dao.reset_mock()
         self.mock_env_dao.reset_mock()
         self.mock_binary_store.reset_mock()
+        self.reservation = VersionReservation(
+            "test-architecture-id", "test-id", 2, "test-token"
+        )
+        self.mock_ev_dao.reserve_version = mock.AsyncMock(return_value=self.reservation)
+        self.mock_ev_dao.release_version = mock.AsyncMock()
 
     @mock.patch(
         "src.backend_orchestrator.run_engine_handler.run_engine",
@@ -124,10 +134,15 @@ class TestArchitectureRun(aiounittest.AsyncTestCase):
         mock_uuid.uuid4.return_value = test_hash
         self.mock_ev_dao.get_current_version = mock.AsyncMock(return_value=self.test_ev)
         self.mock_env_dao.get_environment = mock.AsyncMock(return_value=self.test_env)
-        self.mock_store.get_state_from_fs = mock.Mock(return_value=self.test_result)
+        self.mock_store.get_state_from_fs = mock.AsyncMock(
+            return_value=self.test_result
+        )
         mock_run_engine.return_value = self.test_result
         self.mock_ev_dao.get_latest_version = mock.AsyncMock(return_value=self.test_ev)
-        self.mock_store.write_state_to_fs = mock.Mock(return_value="test-location")
+        self.mock_ev_dao.get_version_head = mock.AsyncMock(
+            return_value=VersionHead("test-hash", 1)
+        )
+        self.mock_store.write_state_to_fs = mock.AsyncMock(return_value="test-location")
         self.mock_ev_dao.add_environment_version = mock.Mock(return_value=None)
         self.mock_env_dao.set_current_version = mock.AsyncMock(return_value=None)
         mock_diff_engine_results.return_value = TopologyDiff(
@@ -160,7 +175,9 @@ class TestArchitectureRun(aiounittest.AsyncTestCase):
         self.mock_ev_dao.get_current_version.assert_called_once_with(
             "test-architecture-id", "test-id"
         )
-        self.mock_store.get_state_from_fs.assert_called_once_with(self.test_ev)
+        self.mock_store.get_state_from_fs.assert_called_once_with(
+            self.test_ev, fields=["resources_yaml"]
+        )
         mock_run_engine.assert_called_once_with(
             RunEngineRequest(
                 id="test-architecture-id",
@@ -193,6 +210,7 @@ class TestArchitectureRun(aiounittest.AsyncTestCase):
         self.mock_store.write_state_to_fs.assert_called_once_with(
             version_with_state,
             self.test_result,
+            base=self.test_ev,
         )
         self.mock_ev_dao.add_environment_version.assert_called_once_with(
             version_with_state,
@@ -201,6 +219,12 @@ class TestArchitectureRun(aiounittest.AsyncTestCase):
         self.mock_env_dao.set_current_version.assert_called_once_with(
             "test-architecture-id", "test-id", 2
         )
+        self.mock_ev_dao.reserve_version.assert_called_once_with(
+            "test-architecture-id", "test-id", 1
+        )
+        self.mock_ev_dao.release_version.assert_called_once_with(
+            self.reservation, written=True
+        )
         self.mock_env_dao.get_environment.assert_called_once_with(
             "test-architecture-id", "test-id"
         )
@@ -247,10 +271,15 @@ class TestArchitectureRun(aiounittest.AsyncTestCase):
             return_value=self.test_ev
         )
         self.mock_env_dao.get_environment = mock.AsyncMock(return_value=self.test_env)
-        self.mock_store.get_state_from_fs = mock.Mock(return_value=self.test_result)
+        self.mock_store.get_state_from_fs = mock.AsyncMock(
+            return_value=self.test_result
+        )
         mock_run_engine.return_value = self.test_result
         self.mock_ev_dao.get_latest_version = mock.AsyncMock(return_value=self.test_ev)
-        self.mock_store.write_state_to_fs = mock.Mock(return_value="test-location")
+        self.mock_ev_dao.get_version_head = mock.AsyncMock(
+            return_value=VersionHead("test-hash", 1)
+        )
+        self.mock_store.write_state_to_fs = mock.AsyncMock(return_value="test-location")
         self.mock_ev_dao.add_environment_version = mock.Mock(return_value=None)
         self.mock_ev_dao.delete_future_versions = mock.AsyncMock(return_value=None)
         self.mock_env_dao.set_current_version = mock.AsyncMock(return_value=None)
@@ -273,7 +302,9 @@ class TestArchitectureRun(aiounittest.AsyncTestCase):
         self.mock_ev_dao.get_current_version.assert_called_once_with(
             "test-architecture-id", "test-id"
         )
-        self.mock_store.get_state_from_fs.assert_called_once_with(self.test_ev)
+        self.mock_store.get_state_from_fs.assert_called_once_with(
+            self.test_ev, fields=["resources_yaml"]
+        )
         mock_run_engine.assert_called_once_with(
             RunEngineRequest(
                 id="test-architecture-id",
@@ -310,6 +341,7 @@ class TestArchitectureRun(aiounittest.AsyncTestCase):
         self.mock_store.write_state_to_fs.assert_called_once_with(
             version_with_state,
             self.test_result,
+            base=self.test_ev,
         )
         self.mock_ev_dao.add_environment_version.assert_called_once_with(
             version_with_state,
@@ -365,11 +397,13 @@ class TestArchitectureRun(aiounittest.AsyncTestCase):
             return_value=self.test_ev
         )
         self.mock_env_dao.get_environment = mock.AsyncMock(return_value=self.test_env)
-        self.mock_store.get_state_from_fs = mock.Mock(return_value=self.test_result)
+        self.mock_store.get_state_from_fs = mock.AsyncMock(
+            return_value=self.test_result
+        )
         test_result = EngineException([], 1, '[{"error_code": "internal"}]', "")
         mock_run_engine.side_effect = test_result
         self.mock_ev_dao.get_latest_version = mock.AsyncMock(return_value=self.test_ev)
-        self.mock_store.write_state_to_fs = mock.Mock(return_value="test-location")
+        self.mock_store.write_state_to_fs = mock.AsyncMock(return_value="test-location")
         self.mock_ev_dao.add_environment_version = mock.Mock(return_value=None)
         self.mock_ev_dao.delete_future_versions = mock.AsyncMock(return_value=None)
         self.mock_env_dao.set_current_version = mock.AsyncMock(return_value=None)
@@ -506,7 +540,10 @@ class TestArchitectureRun(aiounittest.AsyncTestCase):
             )
         )
         mock_find_mutating_constraints.return_value = []
-        self.mock_store.get_state_from_fs = mock.Mock(return_value=self.test_result)
+        self.mock_ev_dao.get_latest_version = mock.AsyncMock(return_value=self.test_ev)
+        self.mock_store.get_state_from_fs = mock.AsyncMock(
+            return_value=self.test_result
+        )
         mock_run_engine.return_value = self.test_result
         mock_diff_engine_results.return_value = TopologyDiff(
             resources={
@@ -553,13 +590,106 @@ class TestArchitectureRun(aiounittest.AsyncTestCase):
             self.test_result,
         )
 
-        self.mock_store.get_state_from_fs.assert_called_once_with(self.test_ev)
-        self.mock_ev_dao.get_latest_version.assert_not_called()
+        self.mock_store.get_state_from_fs.assert_called_once_with(
+            self.test_ev, fields=["resources_yaml"]
+        )
+        self.mock_ev_dao.get_latest_version.assert_called_once_with(
+            "test-architecture-id", "test-id"
+        )
         self.mock_store.write_state_to_fs.assert_not_called()
+        self.mock_ev_dao.get_version_head.assert_not_called()
         self.mock_ev_dao.add_environment_version.assert_not_called()
 
         self.mock_env_dao.set_current_version.assert_not_called()
 
+    @mock.patch(
+        "src.backend_orchestrator.run_engine_handler.run_engine",
+        new_callable=mock.AsyncMock,
+    )
+    @mock.patch(
+        "src.backend_orchestrator.run_engine_handler.diff_engine_results",
+        new_callable=mock.Mock,
+    )
+    async def test_run_engine_environment_changed_while_running(
+        self, mock_diff_engine_results: mock.Mock, mock_run_engine: mock.AsyncMock
+    ):
+        mock_diff_engine_results.return_value = TopologyDiff()
+        session = mock.Mock(commit=mock.AsyncMock(), rollback=mock.AsyncMock())
+        handler = EngineOrchestrator(
+            self.mock_store,
+            self.mock_ev_dao,
+            self.mock_env_dao,
+            self.mock_binary_store,
+            session=session,
+        )
+        self.mock_ev_dao.get_current_version = mock.AsyncMock(return_value=self.test_ev)
+        self.mock_ev_dao.get_latest_version = mock.AsyncMock(return_value=self.test_ev)
+        self.mock_env_dao.get_environment = mock.AsyncMock(return_value=self.test_env)
+        self.mock_store.get_state_from_fs = mock.AsyncMock(
+            return_value=self.test_result
+        )
+        self.mock_store.write_state_to_fs = mock.AsyncMock(return_value="test-location")
+        commits_before_run = []
+
+        async def run(request):
+            commits_before_run.append(session.commit.await_count)
+            return self.test_result
+
+        mock_run_engine.side_effect = run
+        # another run added version 2 while the engine ran
+        self.mock_ev_dao.get_version_head = mock.AsyncMock(
+            return_value=VersionHead("other-hash", 2)
+        )
+
+        with self.assertRaises(EnvironmentVersionNotLatestError):
+            await handler.run(
+                "test-architecture-id",
+                "test-id",
+                1,
+                CopilotRunRequest(constraints=self.test_constraints),
+            )
+
+        # the read phase was committed, releasing its connection, before the engine ran
+        self.assertEqual(commits_before_run, [1])
+        # the failed write phase was rolled back and the version released in its own transaction
+        session.rollback.assert_awaited_once()
+        self.assertEqual(session.commit.await_count, 2)
+        self.mock_ev_dao.release_version.assert_called_once_with(
+            self.reservation, written=False
+        )
+        self.mock_ev_dao.get_version_head.assert_called_once_with(
+            "test-architecture-id", "test-id"
+        )
+        self.mock_ev_dao.add_environment_version.assert_not_called()
+        self.mock_env_dao.set_current_version.assert_not_called()
+
+    @mock.patch(
+        "src.backend_orchestrator.run_engine_handler.run_engine",
+        new_callable=mock.AsyncMock,
+    )
+    async def test_run_engine_version_reserved(self, mock_run_engine: mock.AsyncMock):
+        self.mock_ev_dao.get_current_version = mock.AsyncMock(return_value=self.test_ev)
+        self.mock_ev_dao.get_latest_version = mock.AsyncMock(return_value=self.test_ev)
+        self.mock_env_dao.get_environment = mock.AsyncMock(return_value=self.test_env)
+        self.mock_ev_dao.reserve_version = mock.AsyncMock(
+            side_effect=EnvironmentVersionReservedError
+        )
+
+        with self.assertRaises(EnvironmentVersionReservedError):
+            await self.arch_handler.run(
+                "test-architecture-id",
+                "test-id",
+                1,
+                CopilotRunRequest(constraints=self.test_constraints),
+            )
+
+        self.mock_ev_dao.reserve_version.assert_called_once_with(
+            "test-architecture-id", "test-id", 1
+        )
+        mock_run_engine.assert_not_called()
+        self.mock_store.get_state_from_fs.assert_not_called()
+        self.mock_ev_dao.release_version.assert_not_called()
+
     async def test_run_engine_architecture_not_found(
         self,
     ):
@@ -607,7 +737,7 @@ class TestArchitectureRun(aiounittest.AsyncTestCase):
 
     async def test_run_engine_environment_version_not_latest(self):
         self.mock_ev_dao.get_current_version = mock.AsyncMock(return_value=self.test_ev)
-        with self.assertRaises(HTTPException) as e:
+        with self.assertRaises(EnvironmentVersionNotLatestError):
             await self.arch_handler.run(
                 "test-architecture-id",
                 "test-id",
@@ -617,8 +747,6 @@ class TestArchitectureRun(aiounittest.AsyncTestCase):
                 ),
                 False,
             )
-        self.assertEqual(e.exception.detail, "Environment version is not the latest")
-        self.assertEqual(e.exception.status_code, 400)
         self.mock_store.get_state_from_fs.assert_not_called()
         self.mock_binary_store.ensure_binary.assert_not_called()
 
@@ -649,7 +777,9 @@ class TestArchitectureRun(aiounittest.AsyncTestCase):
             return_value=self.test_ev
         )
         self.mock_env_dao.get_environment = mock.AsyncMock(return_value=self.test_env)
-        self.mock_store.get_state_from_fs = mock.Mock(return_value=self.test_result)
+        self.mock_store.get_state_from_fs = mock.AsyncMock(
+            return_value=self.test_result
+        )
         mock_run_engine.side_effect = EngineException(
             "test", returncode=1, stdout="[]", stderr=""
         )
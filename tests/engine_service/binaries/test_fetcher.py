@@ -1,5 +1,12 @@
-import aiounittest
+import os
+import tempfile
+from pathlib import Path
 from unittest.mock import patch, MagicMock
+
+import aiounittest
+import boto3
+from moto import mock_aws
+
 from src.engine_service.binaries.fetcher import (
     Binary,
     BinaryNotFoundException,
@@ -9,7 +16,7 @@ from src.engine_service.binaries.fetcher import (
 
 class TestBinaryStorage(aiounittest.AsyncTestCase):
     @patch("src.engine_service.binaries.fetcher.get_object")
-    def test_get_binary(self, mock_get_object):
+    async def test_get_binary(self, mock_get_object):
         # Arrange
         mock_bucket = MagicMock()
         mock_object = MagicMock()
@@ -18,7 +25,7 @@ class TestBinaryStorage(aiounittest.AsyncTestCase):
         binary_storage = BinaryStorage(mock_bucket)
 
         # Act
-        result = binary_storage.get_binary(Binary.ENGINE)
+        result = await binary_storage.get_binary(Binary.ENGINE)
 
         # Assert
         self.assertEqual(result.getvalue(), b"mock_binary_raw")
@@ -26,7 +33,7 @@ class TestBinaryStorage(aiounittest.AsyncTestCase):
         mock_get_object.assert_called_with(mock_object)
 
     @patch("src.engine_service.binaries.fetcher.get_object")
-    def test_get_binary_not_found(self, mock_get_object):
+    async def test_get_binary_not_found(self, mock_get_object):
         # Arrange
         mock_bucket = MagicMock()
         mock_bucket.Object.return_value = "mock_object"
@@ -35,12 +42,12 @@ class TestBinaryStorage(aiounittest.AsyncTestCase):
 
         # Act & Assert
         with self.assertRaises(BinaryNotFoundException):
-            binary_storage.get_binary(Binary.ENGINE)
+            await binary_storage.get_binary(Binary.ENGINE)
 
     @patch("src.engine_service.binaries.fetcher.get_object")
     @patch("src.engine_service.binaries.fetcher.Path")
     @patch("src.engine_service.binaries.fetcher.os")
-    def test_ensure_binary(self, mock_os, mock_path, mock_get_object):
+    async def test_ensure_binary(self, mock_os, mock_path, mock_get_object):
         # Arrange
         mock_bucket = MagicMock()
         mock_object = MagicMock()
@@ -56,7 +63,7 @@ class TestBinaryStorage(aiounittest.AsyncTestCase):
         mock_binary.path.parent.mkdir.return_value = None
         mock_binary.path.open.return_value = mock_file
         # Act
-        binary_storage.ensure_binary(mock_binary)
+        await binary_storage.ensure_binary(mock_binary)
 
         # Assert
         mock_binary.path.exists.call_count == 2
@@ -64,3 +71,28 @@ class TestBinaryStorage(aiounittest.AsyncTestCase):
         mock_binary.path.open.assert_called_once()
         mock_file.__enter__().write.assert_called()
         mock_os.chmod.assert_called_with(mock_binary.path, 0o755)
+
+
+class TestBinaryStorageS3(aiounittest.AsyncTestCase):
+    @mock_aws
+    async def test_ensure_binary_from_s3(self):
+        bucket = boto3.resource("s3", region_name="us-east-1").create_bucket(
+            Bucket="test-binaries"
+        )
+        bucket.put_object(Key="engine", Body=b"#!/bin/sh\n")
+        binary_storage = BinaryStorage(bucket)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mock_binary = MagicMock()
+            mock_binary.value = "engine"
+            mock_binary.path = Path(tmp_dir) / "bin" / "engine"
+            await binary_storage.ensure_binary(mock_binary)
+            self.assertEqual(mock_binary.path.read_bytes(), b"#!/bin/sh\n")
+            self.assertTrue(os.access(mock_binary.path, os.X_OK))
+
+    @mock_aws
+    async def test_get_binary_missing_from_s3(self):
+        bucket = boto3.resource("s3", region_name="us-east-1").create_bucket(
+            Bucket="test-binaries"
+        )
+        with self.assertRaises(BinaryNotFoundException):
+            await BinaryStorage(bucket).get_binary(Binary.ENGINE)
@@ -3,6 +3,7 @@ import aiounittest
 import tempfile
 import shutil
 import os
+import zipfile
 from unittest import mock
 
 from src.engine_service.engine_commands.export_iac import (
@@ -56,4 +57,5 @@ class TestExportIac(aiounittest.AsyncTestCase):
             "test",
             cwd=PosixPath(self.temp_dir.name),
         )
-        self.assertIsNotNone(result.iac_bytes)
+        with result.iac_file, zipfile.ZipFile(result.iac_file) as iac_zip:
+            self.assertEqual(iac_zip.read("index.ts"), b"index")
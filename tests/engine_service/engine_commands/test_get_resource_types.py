@@ -29,7 +29,7 @@ class TestRunEngine(aiounittest.AsyncTestCase):
             "",
         )
         binary_store = mock.MagicMock()
-        binary_store.ensure_binary = mock.Mock()
+        binary_store.ensure_binary = mock.AsyncMock()
         result = await get_resource_types(binary_store)
         mock_eng_cmd.assert_called_once_with("ListResourceTypes")
         self.assertEqual(
@@ -0,0 +1,177 @@
+import asyncio
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+import aiounittest
+
+from src.engine_service.engine_commands.pool import (
+    EngineWorkerPool,
+    PoolConfig,
+    WorkerError,
+)
+
+FAKE_WORKER = """
+import json, os, sys, time
+deaf = False
+for line in sys.stdin:
+    req = json.loads(line)
+    if req.get("ping"):
+        if deaf:
+            time.sleep(60)
+        print(json.dumps({"id": req["id"], "pong": True}), flush=True)
+        continue
+    args = req["args"]
+    if args[0] == "crash":
+        sys.exit(3)
+    deaf = deaf or args[0] == "deaf"
+    out = json.dumps({"pid": os.getpid(), "args": args, "cwd": req["cwd"]})
+    print(json.dumps({"id": req["id"], "returncode": int(args[0] == "fail"), "stdout": out, "stderr": "err"}), flush=True)
+"""
+
+
+class TestEngineWorkerPool(aiounittest.AsyncTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        script = Path(self.temp_dir.name) / "worker.py"
+        script.write_text(FAKE_WORKER)
+        self.command = [sys.executable, str(script)]
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def pool(self, size=1, max_jobs=100) -> EngineWorkerPool:
+        return EngineWorkerPool(
+            self.command,
+            PoolConfig(
+                size=size,
+                max_jobs_per_worker=max_jobs,
+                health_check_interval=0,
+                health_check_timeout=0.5,
+            ),
+        )
+
+    @staticmethod
+    async def concurrently(*calls):
+        return await asyncio.wait_for(
+            asyncio.gather(*calls, return_exceptions=True), timeout=10
+        )
+
+    async def test_reuses_warm_worker(self):
+        pool = self.pool()
+        try:
+            code, out, err = await pool.execute(["Run", "--x"], cwd=Path("/tmp"))
+            self.assertEqual(code, 0)
+            self.assertEqual(err, "err")
+            first = json.loads(out)
+            self.assertEqual(first["args"], ["Run", "--x"])
+            self.assertEqual(first["cwd"], "/tmp")
+            _, out, _ = await pool.execute(["Run"])
+            self.assertEqual(json.loads(out)["pid"], first["pid"])
+            self.assertEqual(pool.size, 1)
+        finally:
+            await pool.close()
+
+    async def test_returns_nonzero_returncode(self):
+        pool = self.pool()
+        try:
+            code, _, _ = await pool.execute(["fail"])
+            self.assertEqual(code, 1)
+        finally:
+            await pool.close()
+
+    async def test_recycles_worker_after_max_jobs(self):
+        pool = self.pool(max_jobs=2)
+        try:
+            pids = [
+                json.loads((await pool.execute(["Run"]))[1])["pid"] for _ in range(3)
+            ]
+            self.assertEqual(pids[0], pids[1])
+            self.assertNotEqual(pids[1], pids[2])
+        finally:
+            await pool.close()
+
+    async def test_replaces_crashed_worker(self):
+        pool = self.pool()
+        try:
+            with self.assertRaises(WorkerError):
+                await pool.execute(["crash"])
+            self.assertEqual(pool.size, 0)
+            code, _, _ = await pool.execute(["Run"])
+            self.assertEqual(code, 0)
+            self.assertEqual(pool.size, 1)
+        finally:
+            await pool.close()
+
+    async def test_health_check_discards_dead_workers(self):
+        pool = self.pool()
+        try:
+            _, out, _ = await pool.execute(["Run"])
+            worker = pool._idle.get_nowait()
+            worker.kill()
+            await worker.process.wait()
+            pool._idle.put_nowait(worker)
+            await pool.check_health()
+            self.assertEqual(pool.size, 0)
+        finally:
+            await pool.close()
+
+    async def test_waiter_gets_replacement_of_recycled_worker(self):
+        pool = self.pool(max_jobs=1)
+        try:
+            results = await self.concurrently(
+                pool.execute(["Run"]), pool.execute(["Run"])
+            )
+            pids = [json.loads(out)["pid"] for _, out, _ in results]
+            self.assertNotEqual(pids[0], pids[1])
+            self.assertEqual(pool.size, 0)
+        finally:
+            await pool.close()
+        self.assertEqual(pool._stopping, set())
+
+    async def test_waiter_gets_replacement_of_crashed_worker(self):
+        pool = self.pool()
+        try:
+            crashed, (code, _, _) = await self.concurrently(
+                pool.execute(["crash"]), pool.execute(["Run"])
+            )
+            self.assertIsInstance(crashed, WorkerError)
+            self.assertEqual(code, 0)
+            self.assertEqual(pool.size, 1)
+        finally:
+            await pool.close()
+
+    async def test_waiter_gets_replacement_of_unhealthy_worker(self):
+        pool = self.pool()
+        try:
+            _, out, _ = await pool.execute(["deaf"])
+            # the caller waits for the worker being health checked
+            _, (_, replaced, _) = await self.concurrently(
+                pool.check_health(), pool.execute(["Run"])
+            )
+            self.assertNotEqual(json.loads(replaced)["pid"], json.loads(out)["pid"])
+            self.assertEqual(pool.size, 1)
+        finally:
+            await pool.close()
+
+    async def test_never_exceeds_size(self):
+        pool = self.pool(size=2, max_jobs=2)
+        sizes = []
+        acquire = pool._acquire
+
+        async def recording_acquire():
+            worker = await acquire()
+            sizes.append(pool.size)
+            return worker
+
+        pool._acquire = recording_acquire
+        try:
+            results = await self.concurrently(
+                *[pool.execute(["Run"]) for _ in range(8)]
+            )
+            self.assertTrue(all(code == 0 for code, _, _ in results))
+            self.assertEqual(len(sizes), 8)
+            self.assertEqual(max(sizes), 2)
+        finally:
+            await pool.close()
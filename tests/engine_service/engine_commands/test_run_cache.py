@@ -0,0 +1,114 @@
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import aiounittest
+
+from src.engine_service.engine_commands.run import (
+    RunEngineRequest,
+    RunEngineResult,
+    run_engine,
+)
+from src.engine_service.engine_commands.run_cache import (
+    DiskCacheTier,
+    RunResultCache,
+    engine_digest,
+)
+from src.util.cache import LRUCache
+
+
+class TestRunResultCache(aiounittest.AsyncTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.engine = Path(self.temp_dir.name) / "engine"
+        self.engine.write_bytes(b"engine-v1")
+        self.request = RunEngineRequest(
+            id="arch",
+            templates=[],
+            input_graph="resources: {}",
+            constraints=[{"scope": "application", "operator": "add", "node": "a"}],
+            engine_version=1.0,
+        )
+        self.result = RunEngineResult(
+            resources_yaml="resources",
+            topology_yaml="topology",
+            iac_topology="iac",
+            config_errors=[{"error_code": "config_invalid"}],
+        )
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def cache(self, tiers=None) -> RunResultCache:
+        return RunResultCache(RunEngineResult, LRUCache(1024 * 1024), tiers)
+
+    async def key(self, cache, request):
+        with mock.patch(
+            "src.engine_service.engine_commands.run_cache.Binary"
+        ) as mock_binary:
+            mock_binary.ENGINE.path = self.engine
+            return await cache.key_for(request)
+
+    async def test_key_ignores_id_and_overwrite(self):
+        cache = self.cache()
+        key = await self.key(cache, self.request)
+        other = await self.key(cache, self.request._replace(id="other", overwrite=True))
+        self.assertEqual(key, other)
+
+    async def test_key_depends_on_inputs_and_engine(self):
+        cache = self.cache()
+        key = await self.key(cache, self.request)
+        self.assertNotEqual(
+            key, await self.key(cache, self.request._replace(input_graph="x"))
+        )
+        self.assertNotEqual(
+            key, await self.key(cache, self.request._replace(constraints=[]))
+        )
+        self.engine.write_bytes(b"engine-v2-upgraded")
+        self.assertNotEqual(key, await self.key(cache, self.request))
+
+    async def test_no_key_without_engine_binary(self):
+        cache = self.cache()
+        self.engine.unlink()
+        self.assertIsNone(await self.key(cache, self.request))
+
+    async def test_round_trip_through_disk_tier(self):
+        tier = DiskCacheTier(Path(self.temp_dir.name) / "cache")
+        cache = self.cache([tier])
+        key = await self.key(cache, self.request)
+        self.assertIsNone(await cache.get(key))
+        await cache.put(key, self.result)
+
+        fresh = self.cache([tier])
+        self.assertEqual(await fresh.get(key), self.result)
+        self.assertEqual(fresh.memory.get(key), self.result)
+
+    async def test_invalidate(self):
+        tier = DiskCacheTier(Path(self.temp_dir.name) / "cache")
+        cache = self.cache([tier])
+        key = await self.key(cache, self.request)
+        await cache.put(key, self.result)
+        cache.invalidate()
+        self.assertIsNone(await cache.get(key))
+
+    def test_engine_digest_missing_binary(self):
+        self.assertIsNone(engine_digest(Path(self.temp_dir.name) / "missing"))
+
+    @mock.patch(
+        "src.engine_service.engine_commands.run._run_engine",
+        new_callable=mock.AsyncMock,
+    )
+    async def test_run_engine_uses_cache(self, mock_run: mock.AsyncMock):
+        mock_run.return_value = self.result
+        cache = self.cache()
+        with mock.patch(
+            "src.engine_service.engine_commands.run.run_cache", cache
+        ), mock.patch(
+            "src.engine_service.engine_commands.run_cache.Binary"
+        ) as mock_binary:
+            mock_binary.ENGINE.path = self.engine
+            first = await run_engine(self.request)
+            second = await run_engine(self.request)
+        self.assertEqual(first, self.result)
+        self.assertEqual(second, self.result)
+        mock_run.assert_called_once_with(self.request)
@@ -0,0 +1,118 @@
+import asyncio
+import tempfile
+
+import aiounittest
+
+from src.engine_service.scheduler import (
+    EngineOverloadedError,
+    EngineScheduler,
+    HostSlots,
+    Priority,
+)
+
+
+class TestEngineScheduler(aiounittest.AsyncTestCase):
+    async def hold(self, scheduler, priority, tenant, started, release, order):
+        async with scheduler.slot(priority, "test", tenant):
+            order.append(tenant)
+            started.set()
+            await release.wait()
+
+    async def test_bounds_concurrency(self):
+        scheduler = EngineScheduler(max_concurrency=1, max_queue_wait=60)
+        release = asyncio.Event()
+        order = []
+        first = asyncio.create_task(
+            self.hold(scheduler, Priority.RUN, "a", asyncio.Event(), release, order)
+        )
+        second = asyncio.create_task(
+            self.hold(scheduler, Priority.RUN, "b", asyncio.Event(), release, order)
+        )
+        await asyncio.sleep(0.01)
+        self.assertEqual(order, ["a"])
+        self.assertEqual(scheduler.running, 1)
+        self.assertEqual(scheduler.queue_depth(), 1)
+        release.set()
+        await asyncio.gather(first, second)
+        self.assertEqual(order, ["a", "b"])
+        self.assertEqual(scheduler.running, 0)
+
+    async def test_interactive_before_run_and_tenants_round_robin(self):
+        scheduler = EngineScheduler(max_concurrency=1, max_queue_wait=60)
+        release = asyncio.Event()
+        order = []
+        blocker = asyncio.create_task(
+            self.hold(
+                scheduler, Priority.RUN, "blocker", asyncio.Event(), release, order
+            )
+        )
+        await asyncio.sleep(0.01)
+        waiters = [
+            asyncio.create_task(
+                self.hold(scheduler, priority, tenant, asyncio.Event(), release, order)
+            )
+            for priority, tenant in [
+                (Priority.EXPORT, "export"),
+                (Priority.RUN, "a"),
+                (Priority.RUN, "a"),
+                (Priority.RUN, "b"),
+                (Priority.INTERACTIVE, "interactive"),
+            ]
+        ]
+        await asyncio.sleep(0.01)
+        release.set()
+        await asyncio.gather(blocker, *waiters)
+        self.assertEqual(order, ["blocker", "interactive", "a", "b", "a", "export"])
+
+    async def test_sheds_load_when_wait_exceeds_budget(self):
+        scheduler = EngineScheduler(max_concurrency=1, max_queue_wait=1.5)
+        release = asyncio.Event()
+        blocker = asyncio.create_task(
+            self.hold(scheduler, Priority.RUN, "a", asyncio.Event(), release, [])
+        )
+        await asyncio.sleep(0.01)
+        queued = asyncio.create_task(
+            self.hold(scheduler, Priority.RUN, "b", asyncio.Event(), release, [])
+        )
+        await asyncio.sleep(0.01)
+        with self.assertRaises(EngineOverloadedError) as ctx:
+            async with scheduler.slot(Priority.RUN, "test", "c"):
+                pass
+        self.assertGreaterEqual(ctx.exception.retry_after, 2)
+        release.set()
+        await asyncio.gather(blocker, queued)
+        self.assertEqual(scheduler.running, 0)
+
+    async def test_cancelled_waiter_leaves_queue(self):
+        scheduler = EngineScheduler(max_concurrency=1, max_queue_wait=60)
+        release = asyncio.Event()
+        blocker = asyncio.create_task(
+            self.hold(scheduler, Priority.RUN, "a", asyncio.Event(), release, [])
+        )
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(
+            self.hold(scheduler, Priority.RUN, "b", asyncio.Event(), release, [])
+        )
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.sleep(0.01)
+        self.assertEqual(scheduler.queue_depth(), 0)
+        release.set()
+        await blocker
+        self.assertEqual(scheduler.running, 0)
+
+
+class TestHostSlots(aiounittest.AsyncTestCase):
+    async def test_slots_are_exclusive(self):
+        with tempfile.TemporaryDirectory() as directory:
+            slots = HostSlots(directory, 2)
+            first = slots.try_acquire()
+            second = slots.try_acquire()
+            self.assertIsNotNone(first)
+            self.assertIsNotNone(second)
+            self.assertIsNone(await slots.acquire(timeout=0.1))
+            HostSlots.release(first)
+            third = await slots.acquire(timeout=0.1)
+            self.assertIsNotNone(third)
+            HostSlots.release(second)
+            HostSlots.release(third)
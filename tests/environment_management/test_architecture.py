@@ -1,6 +1,6 @@
 import asyncio
 import aiounittest
-from sqlalchemy import select
+from sqlalchemy import event, select
 from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from src.environment_management.architecture import (
     ArchitectureDAO,
@@ -221,6 +221,39 @@ class TestArchitectureDAO(aiounittest.AsyncTestCase):
         all = result.fetchall()
         self.assertEqual(len(all), 0)
 
+    async def test_delete_architecture_is_set_based(self):
+        for env in range(3):
+            self.session.add(Environment(architecture_id="test-id", id=f"env-{env}"))
+            for version in range(50):
+                self.session.add(
+                    EnvironmentVersion(
+                        architecture_id="test-id",
+                        id=f"env-{env}",
+                        version=version,
+                        version_hash="test-hash",
+                        created_by="test-owner",
+                    )
+                )
+        await self.session.flush()
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement.split()[0])
+
+        event.listen(self.engine.sync_engine, "before_cursor_execute", capture)
+        try:
+            await self.dao.delete_architecture("test-id")
+        finally:
+            event.remove(self.engine.sync_engine, "before_cursor_execute", capture)
+        # one statement per table, whatever the number of versions
+        self.assertEqual(statements, ["DELETE"] * 4)
+        result = await self.session.execute(
+            select(EnvironmentVersion).where(
+                EnvironmentVersion.architecture_id == "test-id"
+            )
+        )
+        self.assertEqual(result.fetchall(), [])
+
     async def test_delete_architecture_none_exist(self):
         await self.dao.delete_architecture("test-id2")
         stmt = select(Architecture).where(Architecture.id == "test-id2")
@@ -11,6 +11,8 @@ from src.environment_management.environment import (
 from src.environment_management.models import (
     ModelsBase,
     Environment,
+    EnvironmentVersion,
+    EnvironmentVersionReservation,
 )
 
 
@@ -159,6 +161,30 @@ class TestEnvironmentDAO(aiounittest.AsyncTestCase):
         result = result.fetchone()
         self.assertEqual(result, None)
 
+    async def test_delete_environment_deletes_versions(self):
+        env = await self.dao.get_environment("test-architecture-id", "test-id")
+        self.session.add(
+            EnvironmentVersion(
+                architecture_id="test-architecture-id",
+                id="test-id",
+                version=1,
+                version_hash="test-hash",
+                created_by="user:test-owner",
+            )
+        )
+        self.session.add(
+            EnvironmentVersionReservation(
+                architecture_id="test-architecture-id", id="test-id", version=1
+            )
+        )
+        await self.session.flush()
+        await self.dao.delete_environment("test-architecture-id", "test-id")
+        # the loaded environment is no longer part of the session, as after session.delete
+        self.assertNotIn(env, self.session)
+        for model in (EnvironmentVersion, EnvironmentVersionReservation):
+            result = await self.session.execute(select(model))
+            self.assertEqual(result.fetchall(), [])
+
     async def test_delete_environment_none_exist(self):
         await self.dao.delete_environment("test-architecture-id", "test-id-2")
         stmt = (
@@ -198,3 +224,12 @@ class TestEnvironmentDAO(aiounittest.AsyncTestCase):
         result = await self.session.execute(statement=stmt)
         result = result.fetchone()
         self.assertEqual(result[0].current, 2)
+
+    async def test_set_current_version_updates_loaded_environment(self):
+        env = await self.dao.get_environment("test-architecture-id", "test-id")
+        await self.dao.set_current_version("test-architecture-id", "test-id", 3)
+        self.assertEqual(env.current, 3)
+
+    async def test_set_current_version_none_exist(self):
+        with self.assertRaises(EnvironmentDoesNotExistError):
+            await self.dao.set_current_version("test-architecture-id", "test-id-2", 2)
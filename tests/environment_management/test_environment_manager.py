@@ -4,13 +4,19 @@ from unittest.mock import MagicMock, AsyncMock, Mock, patch
 from src.auth_service.entity import User
 from src.constraints.constraint import ConstraintOperator
 from src.constraints.resource_constraint import ResourceConstraint
-from src.engine_service.binaries.fetcher import Binary
+from src.engine_service.binaries.fetcher import Binary, BinaryStorage
+from src.state_manager.architecture_storage import ArchitectureStorage
 from src.engine_service.engine_commands.run import RunEngineRequest
 from src.environment_management.environment_manager import (
     EnvironmentManager,
     EnvironmentTrackingError,
     EnvironmentNotTrackedError,
 )
+from src.environment_management.environment_version import (
+    VersionHead,
+    VersionReservation,
+)
+from src.backend_orchestrator.models import EnvironmentVersionNotLatestError
 from src.environment_management.models import (
     EnvironmentResourceConfiguration,
     EnvironmentTracker,
@@ -23,11 +29,11 @@ from src.topology.topology import Topology, TopologyDiff, DiffStatus, Diff
 class TestEnvironmentManager(aiounittest.AsyncTestCase):
     @classmethod
     def setUpClass(self):
-        self.architecture_storage = MagicMock()
+        self.architecture_storage = MagicMock(spec=ArchitectureStorage)
         self.arch_dao = MagicMock()
         self.env_dao = MagicMock()
         self.ev_dao = MagicMock()
-        self.binary_storage = MagicMock()
+        self.binary_storage = MagicMock(spec=BinaryStorage)
         self.manager = EnvironmentManager(
             self.architecture_storage,
             self.arch_dao,
@@ -41,6 +47,9 @@ class TestEnvironmentManager(aiounittest.AsyncTestCase):
         self.arch_dao.reset_mock()
         self.env_dao.reset_mock()
         self.ev_dao.reset_mock()
+        self.reservation = VersionReservation("architecture_id", "env_id", 2, "token")
+        self.ev_dao.reserve_version = AsyncMock(return_value=self.reservation)
+        self.ev_dao.release_version = AsyncMock()
         self.binary_storage.reset_mock()
 
     async def test_is_in_sync(self):
@@ -172,7 +181,7 @@ class TestEnvironmentManager(aiounittest.AsyncTestCase):
 
         mock_base_result = (MagicMock(resources_yaml="base_env_yaml"),)
         mock_env_result = (MagicMock(resources_yaml="env_yaml"),)
-        self.architecture_storage.get_state_from_fs = Mock(
+        self.architecture_storage.get_state_from_fs = AsyncMock(
             side_effect=[
                 mock_base_result,
                 mock_env_result,
@@ -197,8 +206,12 @@ class TestEnvironmentManager(aiounittest.AsyncTestCase):
 
         self.ev_dao.get_current_version.assert_any_call("arch_id", "base_env_id")
         self.ev_dao.get_current_version.assert_any_call("arch_id", "env_id")
-        self.architecture_storage.get_state_from_fs.assert_any_call(base_env)
-        self.architecture_storage.get_state_from_fs.assert_any_call(env)
+        self.architecture_storage.get_state_from_fs.assert_any_call(
+            base_env, fields=["resources_yaml"]
+        )
+        self.architecture_storage.get_state_from_fs.assert_any_call(
+            env, fields=["resources_yaml"]
+        )
         mock_diff_engine_results.assert_called_once_with(
             mock_env_result, mock_base_result, False
         )
@@ -262,13 +275,16 @@ class TestEnvironmentManager(aiounittest.AsyncTestCase):
         ]
         mock_get_overrides.return_value = overrides
         base_state = MagicMock(resources_yaml="base_env_yaml")
-        self.architecture_storage.get_state_from_fs = Mock(
+        self.architecture_storage.get_state_from_fs = AsyncMock(
             return_value=base_state,
         )
         run_result = MagicMock()
         mock_run_engine.return_value = run_result
         mock_diff_engine_results.return_value = TopologyDiff()
-        self.architecture_storage.write_state_to_fs = Mock(return_value="location")
+        self.architecture_storage.write_state_to_fs = AsyncMock(return_value="location")
+        self.ev_dao.get_version_head = AsyncMock(
+            return_value=VersionHead("version_hash", 1)
+        )
         self.env_dao.set_current_version = AsyncMock()
         user = User(id="user_id")
 
@@ -312,7 +328,9 @@ class TestEnvironmentManager(aiounittest.AsyncTestCase):
         mock_get_overrides.assert_called_once_with(
             "architecture_id", "base_env_id", "env_id"
         )
-        self.architecture_storage.get_state_from_fs.assert_called_once_with(curr_base)
+        self.architecture_storage.get_state_from_fs.assert_called_once_with(
+            curr_base, fields=["resources_yaml"]
+        )
         self.binary_storage.ensure_binary.assert_called_once_with(Binary.ENGINE)
         mock_run_engine.assert_called_once_with(
             RunEngineRequest(
@@ -325,13 +343,90 @@ class TestEnvironmentManager(aiounittest.AsyncTestCase):
         )
         mock_diff_engine_results.assert_called_once_with(run_result, base_state)
         self.architecture_storage.write_state_to_fs.assert_called_once_with(
-            new_version, run_result
+            new_version, run_result, base=env_version
+        )
+        self.ev_dao.get_version_head.assert_called_with("architecture_id", "env_id")
+        self.ev_dao.reserve_version.assert_called_once_with(
+            "architecture_id", "env_id", 1
+        )
+        self.ev_dao.release_version.assert_called_once_with(
+            self.reservation, written=True
         )
         self.ev_dao.add_environment_version.assert_called_once_with(new_version)
         self.env_dao.set_current_version.assert_called_once_with(
             "architecture_id", "env_id", new_version.version
         )
 
+    @patch.object(EnvironmentManager, "is_in_sync")
+    @patch.object(EnvironmentManager, "get_constraint_list_stream_since_last_promotion")
+    @patch.object(EnvironmentManager, "get_overrides")
+    @mock.patch(
+        "src.environment_management.environment_manager.run_engine",
+        new_callable=AsyncMock,
+    )
+    @mock.patch(
+        "src.environment_management.environment_manager.diff_engine_results",
+        new_callable=Mock,
+    )
+    async def test_promote_environment_changed_while_running(
+        self,
+        mock_diff_engine_results: Mock,
+        mock_run_engine,
+        mock_get_overrides: AsyncMock,
+        mock_constraints_list: AsyncMock,
+        mock_is_in_sync: AsyncMock,
+    ):
+        session = MagicMock(commit=AsyncMock(), rollback=AsyncMock())
+        manager = EnvironmentManager(
+            self.architecture_storage,
+            self.arch_dao,
+            self.env_dao,
+            self.ev_dao,
+            self.binary_storage,
+            session=session,
+        )
+        env_version = MagicMock(id="env_id", version_hash="version_hash", version=1)
+        curr_base = MagicMock(id="base_env_id", version_hash="base_hash")
+        self.ev_dao.get_current_version = AsyncMock(
+            side_effect=[env_version, curr_base]
+        )
+        mock_is_in_sync.return_value = (False, "base_hash", "version_hash")
+        mock_constraints_list.return_value = []
+        mock_get_overrides.return_value = []
+        self.architecture_storage.get_state_from_fs = AsyncMock(
+            return_value=MagicMock(resources_yaml="base_env_yaml")
+        )
+        commits_before_run = []
+
+        async def run(request):
+            commits_before_run.append(session.commit.await_count)
+            return MagicMock()
+
+        mock_run_engine.side_effect = run
+        mock_diff_engine_results.return_value = TopologyDiff()
+        self.architecture_storage.write_state_to_fs = AsyncMock(return_value="location")
+        # the environment was run while the promotion ran
+        self.ev_dao.get_version_head = AsyncMock(
+            return_value=VersionHead("other_hash", 2)
+        )
+        self.env_dao.set_current_version = AsyncMock()
+
+        with self.assertRaises(EnvironmentVersionNotLatestError):
+            await manager.promote(
+                "architecture_id", "base_env_id", "env_id", User(id="user_id")
+            )
+
+        # the read phase was committed, releasing its connection, before the engine ran
+        self.assertEqual(commits_before_run, [1])
+        # the failed write phase was rolled back and the version released in its own transaction
+        session.rollback.assert_awaited_once()
+        self.assertEqual(session.commit.await_count, 2)
+        self.ev_dao.release_version.assert_called_once_with(
+            self.reservation, written=False
+        )
+        self.ev_dao.add_environment_version.assert_not_called()
+        self.env_dao.set_current_version.assert_not_called()
+
     @mock.patch(
         "src.environment_management.environment_manager.parse_constraints",
         new_callable=Mock,
@@ -0,0 +1,86 @@
+import json
+
+import aiounittest
+from sqlalchemy import insert, inspect, select
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.environment_management.migrate_schema import migrate_schema
+from src.environment_management.models import (
+    Architecture,
+    Environment,
+    EnvironmentVersion,
+    ModelsBase,
+    create_schema,
+)
+
+
+class TestMigrateSchema(aiounittest.AsyncTestCase):
+    async def test_adds_and_backfills_tracking_columns(self):
+        engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(ModelsBase.metadata.create_all)
+                # a database created before the tracking columns were declared
+                await conn.exec_driver_sql("DROP INDEX ix_environment_versions_tracks")
+                for column in ("tracks_environment", "tracks_version_hash"):
+                    await conn.exec_driver_sql(
+                        f"ALTER TABLE environment_versions DROP COLUMN {column}"
+                    )
+                await conn.execute(
+                    insert(Architecture), [{"id": "arch", "owner": "user:owner"}]
+                )
+                await conn.execute(
+                    insert(Environment), [{"architecture_id": "arch", "id": "prod"}]
+                )
+                for version, config in enumerate(
+                    [
+                        {"tracks": {"environment": "dev", "version_hash": "dev-1"}},
+                        {"overrides": []},
+                        None,
+                    ]
+                ):
+                    await conn.exec_driver_sql(
+                        "INSERT INTO environment_versions (architecture_id, id, version, version_hash,"
+                        " env_resource_configuration, created_by) VALUES (?, ?, ?, ?, ?, ?)",
+                        (
+                            "arch",
+                            "prod",
+                            version,
+                            f"hash-{version}",
+                            None if config is None else json.dumps(config),
+                            "user:owner",
+                        ),
+                    )
+
+            # starting workers leave existing tables alone
+            async with engine.begin() as conn:
+                await conn.run_sync(create_schema)
+                columns = await conn.run_sync(
+                    lambda c: inspect(c).get_columns("environment_versions")
+                )
+                self.assertNotIn("tracks_version_hash", [c["name"] for c in columns])
+
+            await migrate_schema(engine)
+            # running it again finds nothing to do
+            await migrate_schema(engine)
+
+            async with engine.connect() as conn:
+                indexes = await conn.run_sync(
+                    lambda c: inspect(c).get_indexes("environment_versions")
+                )
+                self.assertIn(
+                    "ix_environment_versions_tracks", [i["name"] for i in indexes]
+                )
+                rows = await conn.execute(
+                    select(
+                        EnvironmentVersion.version,
+                        EnvironmentVersion.tracks_environment,
+                        EnvironmentVersion.tracks_version_hash,
+                    ).order_by(EnvironmentVersion.version)
+                )
+                self.assertEqual(
+                    [tuple(r) for r in rows],
+                    [(0, "dev", "dev-1"), (1, None, None), (2, None, None)],
+                )
+        finally:
+            await engine.dispose()
@@ -2,6 +2,7 @@ from io import BytesIO
 from unittest import mock
 from unittest.mock import Mock
 import jsons
+from botocore.exceptions import ClientError
 from src.engine_service.engine_commands.run import RunEngineResult
 from src.state_manager.architecture_storage import (
     ArchitectureStorage,
@@ -9,6 +10,7 @@ from src.state_manager.architecture_storage import (
     WriteIacError,
     WriteStateError,
 )
+from src.state_manager.state_format import encode_state
 from src.environment_management.models import (
     EnvironmentVersion,
 )
@@ -75,7 +77,7 @@ class TestArchitectureStore(aiounittest.AsyncTestCase):
         get_object_mock.return_value = jsons.dumps(self.test_content)
         mock_object = Mock()
         self.mock_s3.Object.return_value = mock_object
-        result = self.arch_storage.get_state_from_fs(self.test_env)
+        result = await self.arch_storage.get_state_from_fs(self.test_env)
         self.assertEqual(result, self.test_content)
         self.mock_s3.Object.assert_called_once_with(self.test_env.state_location)
         get_object_mock.assert_called_once_with(mock_object)
@@ -91,7 +93,7 @@ class TestArchitectureStore(aiounittest.AsyncTestCase):
         self.mock_s3.Object.return_value = mock_object
         get_object_mock.side_effect = ArchitectureStateDoesNotExistError()
         with self.assertRaises(ArchitectureStateDoesNotExistError):
-            self.arch_storage.get_state_from_fs(
+            await self.arch_storage.get_state_from_fs(
                 EnvironmentVersion(
                     architecture_id="test-architecture-id",
                     id="test-id",
@@ -106,6 +108,7 @@ class TestArchitectureStore(aiounittest.AsyncTestCase):
                 )
             )
 
+    @mock.patch("src.state_manager.state_format.STATE_LAYOUT", "single")
     @mock.patch(
         "src.state_manager.architecture_storage.put_object",
         new_callable=mock.Mock,
@@ -113,7 +116,24 @@ class TestArchitectureStore(aiounittest.AsyncTestCase):
     async def test_can_write_architecture_state(self, put_object_mock: mock.Mock):
         mock_object = Mock()
         self.mock_s3.Object.return_value = mock_object
-        self.arch_storage.write_state_to_fs(self.test_env, self.test_content)
+        await self.arch_storage.write_state_to_fs(self.test_env, self.test_content)
+        put_object_mock.assert_called_once_with(
+            self.mock_s3.Object.return_value,
+            encode_state(self.test_content),
+        )
+        self.mock_s3.Object.assert_called_once_with(
+            "state/test-architecture-id/test-id/0/state.bin"
+        )
+
+    @mock.patch("src.state_manager.state_format.STATE_FORMAT", "json")
+    @mock.patch(
+        "src.state_manager.architecture_storage.put_object",
+        new_callable=mock.Mock,
+    )
+    async def test_can_write_legacy_architecture_state(
+        self, put_object_mock: mock.Mock
+    ):
+        await self.arch_storage.write_state_to_fs(self.test_env, self.test_content)
         put_object_mock.assert_called_once_with(
             self.mock_s3.Object.return_value,
             bytes(jsons.dumps(self.test_content), "utf-8"),
@@ -122,6 +142,15 @@ class TestArchitectureStore(aiounittest.AsyncTestCase):
             "state/test-architecture-id/test-id/0/state.json"
         )
 
+    @mock.patch(
+        "src.state_manager.architecture_storage.get_object",
+        new_callable=mock.Mock,
+    )
+    async def test_can_get_binary_architecture_state(self, get_object_mock: mock.Mock):
+        get_object_mock.return_value = encode_state(self.test_content)
+        result = await self.arch_storage.get_state_from_fs(self.test_env)
+        self.assertEqual(result, self.test_content)
+
     @mock.patch(
         "src.state_manager.architecture_storage.put_object",
         new_callable=mock.Mock,
@@ -132,7 +161,7 @@ class TestArchitectureStore(aiounittest.AsyncTestCase):
         mock_object = Mock()
         self.mock_s3.Object.return_value = mock_object
         with self.assertRaises(WriteStateError):
-            self.arch_storage.write_state_to_fs(self.test_env, "test-content")
+            await self.arch_storage.write_state_to_fs(self.test_env, "test-content")
 
     @mock.patch(
         "src.state_manager.architecture_storage.get_object",
@@ -142,7 +171,7 @@ class TestArchitectureStore(aiounittest.AsyncTestCase):
         mock_object = Mock()
         self.mock_s3.Object.return_value = mock_object
         get_object_mock.return_value = b"test-content"
-        result = self.arch_storage.get_iac_from_fs(self.test_env)
+        result = await self.arch_storage.get_iac_from_fs(self.test_env)
         self.assertEqual(result, b"test-content")
         self.mock_s3.Object.assert_called_once_with(self.test_env.iac_location)
         get_object_mock.assert_called_once_with(mock_object)
@@ -155,7 +184,7 @@ class TestArchitectureStore(aiounittest.AsyncTestCase):
         mock_object = Mock()
         self.mock_s3.Object.return_value = mock_object
         get_object_mock.return_value = "test-content"
-        result = self.arch_storage.get_iac_from_fs(self.test_env)
+        result = await self.arch_storage.get_iac_from_fs(self.test_env)
         self.assertEqual(result, b"test-content")
         self.mock_s3.Object.assert_called_once_with(self.test_env.iac_location)
         get_object_mock.assert_called_once_with(mock_object)
@@ -171,7 +200,7 @@ class TestArchitectureStore(aiounittest.AsyncTestCase):
         self.mock_s3.Object.return_value = mock_object
         get_object_mock.side_effect = ArchitectureStateDoesNotExistError()
         with self.assertRaises(ArchitectureStateDoesNotExistError):
-            self.arch_storage.get_iac_from_fs(
+            await self.arch_storage.get_iac_from_fs(
                 EnvironmentVersion(
                     architecture_id="test-architecture-id",
                     id="test-id",
@@ -194,7 +223,7 @@ class TestArchitectureStore(aiounittest.AsyncTestCase):
         mock_object = Mock()
         self.mock_s3.Object.return_value = mock_object
         content = b"test-content"
-        self.arch_storage.write_iac_to_fs(self.test_env, content)
+        await self.arch_storage.write_iac_to_fs(self.test_env, content)
         put_object_mock.assert_called_once_with(
             self.mock_s3.Object.return_value,
             content,
@@ -203,6 +232,52 @@ class TestArchitectureStore(aiounittest.AsyncTestCase):
             "state/test-architecture-id/test-id/0/iac.zip"
         )
 
+    async def test_can_write_iac_from_file(self):
+        mock_object = Mock()
+        self.mock_s3.Object.return_value = mock_object
+        content = BytesIO(b"test-content")
+        key = await self.arch_storage.write_iac_to_fs(self.test_env, content)
+        self.assertEqual(key, "state/test-architecture-id/test-id/0/iac.zip")
+        mock_object.upload_fileobj.assert_called_once_with(content)
+
+    async def test_can_stream_iac(self):
+        body = Mock()
+        body.iter_chunks.return_value = iter([b"test-", b"content"])
+        mock_object = Mock()
+        mock_object.get.return_value = {"Body": body}
+        self.mock_s3.Object.return_value = mock_object
+        result = await self.arch_storage.get_iac_stream(self.test_env, chunk_size=5)
+        self.assertEqual(b"".join([chunk async for chunk in result]), b"test-content")
+        self.mock_s3.Object.assert_called_once_with(self.test_env.iac_location)
+        body.iter_chunks.assert_called_once_with(5)
+        body.close.assert_called_once()
+
+    async def test_stream_iac_raises_error_if_iac_does_not_exist(self):
+        mock_object = Mock()
+        mock_object.get.side_effect = ClientError(
+            {"Error": {"Code": "NoSuchKey"}}, "GetObject"
+        )
+        self.mock_s3.Object.return_value = mock_object
+        with self.assertRaises(ArchitectureStateDoesNotExistError):
+            await self.arch_storage.get_iac_stream(self.test_env)
+
+    async def test_generated_iac_exists(self):
+        mock_object = Mock()
+        mock_object.last_modified = datetime.datetime(
+            2011, 11, 5, tzinfo=datetime.timezone.utc
+        )
+        self.mock_s3.Object.return_value = mock_object
+        self.assertTrue(await self.arch_storage.generated_iac_exists(self.test_env))
+        # left behind by an older version with the same number
+        mock_object.last_modified = datetime.datetime(
+            2011, 11, 3, tzinfo=datetime.timezone.utc
+        )
+        self.assertFalse(await self.arch_storage.generated_iac_exists(self.test_env))
+        mock_object.load.side_effect = ClientError(
+            {"Error": {"Code": "404"}}, "HeadObject"
+        )
+        self.assertFalse(await self.arch_storage.generated_iac_exists(self.test_env))
+
     @mock.patch(
         "src.state_manager.architecture_storage.put_object",
         new_callable=mock.Mock,
@@ -213,7 +288,7 @@ class TestArchitectureStore(aiounittest.AsyncTestCase):
         mock_object = Mock()
         self.mock_s3.Object.return_value = mock_object
         with self.assertRaises(WriteIacError):
-            self.arch_storage.write_iac_to_fs(self.test_env, "test-content")
+            await self.arch_storage.write_iac_to_fs(self.test_env, "test-content")
 
     @mock.patch(
         "src.state_manager.architecture_storage.delete_objects",
@@ -222,11 +297,22 @@ class TestArchitectureStore(aiounittest.AsyncTestCase):
     async def test_can_delete_architecture_version(
         self, delete_objects_mock: mock.Mock
     ):
-        self.arch_storage.delete_state_from_fs(self.test_env)
+        await self.arch_storage.delete_state_from_fs(self.test_env)
+        keys = [
+            "manifest.json",
+            "state.bin",
+            "state.json",
+            "parts/resources_yaml.bin",
+            "parts/topology_yaml.bin",
+            "parts/iac_topology.bin",
+            "parts/config_errors.bin",
+            "iac.zip",
+        ]
+        # objects are deleted from the path of every key layout
         delete_objects_mock.assert_called_once_with(
             self.mock_s3,
             [
-                "state/test-architecture-id/test-id/0/state.json",
-                "state/test-architecture-id/test-id/0/iac.zip",
+                *[f"state/test-architecture-id/test-id/0/{key}" for key in keys],
+                *[f"shards/56/test-architecture-id/test-id/0/{key}" for key in keys],
             ],
         )
@@ -0,0 +1,266 @@
+import asyncio
+import time
+from io import BytesIO
+from unittest import mock
+
+import aiounittest
+import boto3
+from moto import mock_aws
+
+from src.engine_service.engine_commands.run import RunEngineResult
+from src.environment_management.models import EnvironmentVersion
+from src.state_manager.architecture_storage import (
+    ArchitectureStorage,
+    ArchitectureStateDoesNotExistError,
+    IacRangeNotSatisfiableError,
+)
+
+
+class TestArchitectureStoreS3(aiounittest.AsyncTestCase):
+    def setUp(self):
+        self.mock_aws = mock_aws()
+        self.mock_aws.start()
+        s3 = boto3.resource("s3", region_name="us-east-1")
+        self.bucket = s3.create_bucket(Bucket="test-bucket")
+        self.arch_storage = ArchitectureStorage(self.bucket)
+        self.env = EnvironmentVersion(
+            architecture_id="test-architecture-id",
+            id="test-id",
+            version=1,
+            version_hash="test-hash",
+        )
+
+    def tearDown(self):
+        self.mock_aws.stop()
+
+    async def test_state_round_trip(self):
+        state = RunEngineResult(
+            resources_yaml="resources", topology_yaml="topology", iac_topology="iac"
+        )
+        self.env.state_location = await self.arch_storage.write_state_to_fs(
+            self.env, state
+        )
+        result = await self.arch_storage.get_state_from_fs(self.env)
+        self.assertEqual(result, state)
+
+    async def test_iac_round_trip(self):
+        self.assertFalse(await self.arch_storage.generated_iac_exists(self.env))
+        self.env.iac_location = await self.arch_storage.write_iac_to_fs(
+            self.env, BytesIO(b"iac-content" * 1000)
+        )
+        self.assertTrue(await self.arch_storage.generated_iac_exists(self.env))
+        stream = await self.arch_storage.get_iac_stream(self.env, chunk_size=1000)
+        chunks = [chunk async for chunk in stream]
+        self.assertEqual(len(chunks), 11)
+        self.assertEqual(b"".join(chunks), b"iac-content" * 1000)
+
+    async def test_delete(self):
+        self.env.iac_location = await self.arch_storage.write_iac_to_fs(
+            self.env, b"iac"
+        )
+        await self.arch_storage.delete_state_from_fs(self.env)
+        with self.assertRaises(ArchitectureStateDoesNotExistError):
+            await self.arch_storage.get_iac_stream(self.env)
+
+    async def test_slow_read_does_not_block_event_loop(self):
+        self.env.iac_location = await self.arch_storage.write_iac_to_fs(
+            self.env, b"iac"
+        )
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            for _ in range(5):
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        def slow_get_object(obj):
+            time.sleep(0.2)
+            return obj.get()["Body"].read()
+
+        with mock.patch(
+            "src.state_manager.architecture_storage.get_object",
+            side_effect=slow_get_object,
+        ):
+            read = asyncio.create_task(self.arch_storage.get_iac_from_fs(self.env))
+            await tick()
+            self.assertFalse(read.done())
+            self.assertEqual(await read, b"iac")
+        self.assertEqual(ticks, 5)
+
+    @mock.patch("src.state_manager.state_format.STATE_STORE", "version")
+    async def test_split_state_reads_only_selected_parts(self):
+        state = RunEngineResult(
+            resources_yaml="resources",
+            topology_yaml="topology",
+            iac_topology="iac",
+            config_errors=[{"error": "invalid"}],
+        )
+        self.env.state_location = await self.arch_storage.write_state_to_fs(
+            self.env, state
+        )
+        self.assertTrue(self.env.state_location.endswith("/manifest.json"))
+        with mock.patch(
+            "src.state_manager.architecture_storage.get_object",
+            side_effect=lambda obj: obj.get()["Body"].read(),
+        ) as get_object:
+            result = await self.arch_storage.get_state_from_fs(
+                self.env, fields=["resources_yaml"]
+            )
+        self.assertEqual(
+            result,
+            RunEngineResult(
+                resources_yaml="resources", topology_yaml="", iac_topology=""
+            ),
+        )
+        self.assertEqual(
+            [call.args[0].key.rsplit("/", 1)[-1] for call in get_object.call_args_list],
+            ["manifest.json", "resources_yaml.bin"],
+        )
+        self.assertEqual(await self.arch_storage.get_state_from_fs(self.env), state)
+
+    async def test_single_state_selects_fields(self):
+        with mock.patch("src.state_manager.state_format.STATE_LAYOUT", "single"):
+            self.env.state_location = await self.arch_storage.write_state_to_fs(
+                self.env,
+                RunEngineResult(
+                    resources_yaml="resources",
+                    topology_yaml="topology",
+                    iac_topology="iac",
+                ),
+            )
+        self.assertTrue(self.env.state_location.endswith("/state.bin"))
+        result = await self.arch_storage.get_state_from_fs(
+            self.env, fields=["topology_yaml"]
+        )
+        self.assertEqual(
+            result,
+            RunEngineResult(
+                resources_yaml="", topology_yaml="topology", iac_topology=""
+            ),
+        )
+
+    async def test_unknown_field(self):
+        self.env.state_location = "state/test-architecture-id/test-id/1/manifest.json"
+        with self.assertRaises(ValueError):
+            await self.arch_storage.get_state_from_fs(self.env, fields=["unknown"])
+
+    async def test_identical_states_share_objects(self):
+        state = RunEngineResult(
+            resources_yaml="resources", topology_yaml="topology", iac_topology="iac"
+        )
+        first = await self.arch_storage.write_state_to_fs(self.env, state)
+        self.assertTrue(first.startswith("cas/manifests/"))
+        keys = sorted(o.key for o in self.bucket.objects.all())
+        other = EnvironmentVersion(
+            architecture_id="other-architecture-id",
+            id="prod",
+            version=7,
+            version_hash="other-hash",
+        )
+        other.state_location = await self.arch_storage.write_state_to_fs(other, state)
+        self.assertEqual(other.state_location, first)
+        self.assertEqual(sorted(o.key for o in self.bucket.objects.all()), keys)
+        self.assertEqual(await self.arch_storage.get_state_from_fs(other), state)
+
+        changed = await self.arch_storage.write_state_to_fs(
+            self.env, state._replace(iac_topology="changed")
+        )
+        self.assertNotEqual(changed, first)
+        # only the changed part and the new manifest are added
+        self.assertEqual(len(list(self.bucket.objects.all())), len(keys) + 2)
+
+    async def test_share_state(self):
+        state = RunEngineResult(
+            resources_yaml="resources", topology_yaml="topology", iac_topology="iac"
+        )
+        with mock.patch("src.state_manager.state_format.STATE_STORE", "version"):
+            self.env.state_location = await self.arch_storage.write_state_to_fs(
+                self.env, state
+            )
+        self.assertFalse(
+            ArchitectureStorage.is_shared_location(self.env.state_location)
+        )
+        shared = await self.arch_storage.share_state(self.env)
+        self.assertTrue(ArchitectureStorage.is_shared_location(shared))
+        self.assertEqual(
+            await self.arch_storage.get_state_from_fs(
+                EnvironmentVersion(state_location=shared, version=1)
+            ),
+            state,
+        )
+        self.env.state_location = shared
+        self.assertEqual(await self.arch_storage.share_state(self.env), shared)
+
+    async def test_delta_history(self):
+        resources = "".join(f"  aws:s3_bucket:bucket{i}:\n" for i in range(200))
+        states = [
+            RunEngineResult(
+                resources_yaml=resources + f"  aws:sqs_queue:queue{i}:\n",
+                topology_yaml="topology",
+                iac_topology="iac",
+                config_errors=[{"error": i}],
+            )
+            for i in range(5)
+        ]
+        versions = []
+        with mock.patch(
+            "src.state_manager.state_format.STATE_HISTORY", "delta"
+        ), mock.patch("src.state_manager.state_format.STATE_DELTA_CHAIN_LENGTH", 2):
+            base = None
+            for i, state in enumerate(states):
+                ev = EnvironmentVersion(
+                    architecture_id="test-architecture-id",
+                    id="test-id",
+                    version=i + 1,
+                    version_hash=f"hash-{i}",
+                )
+                ev.state_location = await self.arch_storage.write_state_to_fs(
+                    ev, state, base=base
+                )
+                versions.append(ev)
+                base = ev
+
+        chains = [
+            (await self.arch_storage.get_manifest(v.state_location))["resources_yaml"]
+            for v in versions
+        ]
+        # two deltas on a snapshot at most, then a new snapshot
+        self.assertIsInstance(chains[0], str)
+        self.assertEqual(chains[1][0], chains[0])
+        self.assertEqual(len(chains[2]), 3)
+        self.assertIsInstance(chains[3], str)
+        self.assertEqual(len(chains[4]), 2)
+        # unchanged fields keep pointing at the same part
+        manifests = [
+            await self.arch_storage.get_manifest(v.state_location) for v in versions
+        ]
+        self.assertEqual(len({m["topology_yaml"] for m in manifests}), 1)
+        for version, state in zip(versions, states):
+            self.assertEqual(await self.arch_storage.get_state_from_fs(version), state)
+
+    async def test_iac_ranges_and_urls(self):
+        self.assertIsNone(await self.arch_storage.open_iac(self.env))
+        self.assertIsNone(self.arch_storage.get_iac_url(self.env, 60, "images.zip"))
+        self.env.iac_location = await self.arch_storage.write_iac_to_fs(
+            self.env, bytes(range(100))
+        )
+        download = await self.arch_storage.open_iac(self.env, byte_range="bytes=10-19")
+        self.assertEqual(
+            b"".join([c async for c in download.chunks]), bytes(range(10, 20))
+        )
+        self.assertEqual(download.content_length, 10)
+        self.assertEqual(download.content_range, "bytes 10-19/100")
+        download = await self.arch_storage.open_iac(self.env, byte_range="bytes=-5")
+        self.assertEqual(
+            b"".join([c async for c in download.chunks]), bytes(range(95, 100))
+        )
+        download = await self.arch_storage.open_iac(self.env)
+        self.assertEqual((download.content_length, download.content_range), (100, None))
+        with self.assertRaises(IacRangeNotSatisfiableError):
+            await self.arch_storage.open_iac(self.env, byte_range="bytes=200-")
+
+        url = self.arch_storage.get_iac_url(self.env, 60, "images.zip")
+        self.assertIn(self.env.iac_location, url)
+        self.assertIn("Expires", url)
+        self.assertIn("attachment", url)
@@ -0,0 +1,133 @@
+import datetime
+from unittest import mock
+
+import aiounittest
+import boto3
+from moto import mock_aws
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from src.engine_service.engine_commands.run import RunEngineResult
+from src.environment_management.models import (
+    Environment,
+    EnvironmentVersion,
+    ModelsBase,
+)
+from src.state_manager.architecture_storage import ArchitectureStorage
+from src.state_manager.migrate_key_layout import migrate_key_layout
+from src.state_manager.state_format import version_path
+
+
+class TestMigrateKeyLayout(aiounittest.AsyncTestCase):
+    def setUp(self):
+        self.mock_aws = mock_aws()
+        self.mock_aws.start()
+        s3 = boto3.resource("s3", region_name="us-east-1")
+        self.bucket = s3.create_bucket(Bucket="test-bucket")
+        self.storage = ArchitectureStorage(self.bucket)
+
+    def tearDown(self):
+        self.mock_aws.stop()
+
+    async def setup_db(self):
+        self.engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+        self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+        async with self.engine.begin() as conn:
+            await conn.run_sync(ModelsBase.metadata.create_all)
+        async with self.sessions.begin() as session:
+            session.add(
+                Environment(architecture_id="arch", id="prod", current=3, tags={})
+            )
+            for version in range(1, 4):
+                ev = EnvironmentVersion(
+                    architecture_id="arch",
+                    id="prod",
+                    version=version,
+                    version_hash=f"hash-{version}",
+                    created_by="user:test",
+                    created_at=datetime.datetime.fromisoformat("2011-11-04"),
+                )
+                path = version_path("arch", "prod", version, layout="flat")
+                # split states stored under the version path, a single state and a content-addressed one
+                if version == 1:
+                    with mock.patch(
+                        "src.state_manager.state_format.STATE_STORE", "version"
+                    ):
+                        ev.state_location = await self.storage._write_state(
+                            path, self.state(version)
+                        )
+                elif version == 2:
+                    ev.state_location = await self.storage._write_state(
+                        path, self.state(version), state_format="json"
+                    )
+                else:
+                    ev.state_location = await self.storage.write_state_to_fs(
+                        ev, self.state(version)
+                    )
+                ev.iac_location = f"{path}/iac.zip"
+                self.bucket.put_object(Key=ev.iac_location, Body=b"iac")
+                session.add(ev)
+
+    @staticmethod
+    def state(version: int) -> RunEngineResult:
+        return RunEngineResult(
+            resources_yaml=f"resources {version}",
+            topology_yaml="topology",
+            iac_topology="iac",
+        )
+
+    async def versions(self) -> list[EnvironmentVersion]:
+        async with self.sessions() as session:
+            return list(
+                (
+                    await session.execute(
+                        EnvironmentVersion.__table__.select().order_by("version")
+                    )
+                ).all()
+            )
+
+    async def test_moves_objects_and_repoints_versions(self):
+        await self.setup_db()
+        with self.assertRaises(ValueError):
+            await migrate_key_layout(self.sessions, self.storage, layout="nested")
+        report = await migrate_key_layout(
+            self.sessions, self.storage, layout="sharded", batch_size=2, delete_old=True
+        )
+        self.assertEqual((report.scanned, report.migrated, report.failed), (3, 3, []))
+        for version in await self.versions():
+            self.assertTrue(version.iac_location.startswith("shards/"))
+            self.assertEqual(await self.storage.get_iac_from_fs(version), b"iac")
+            self.assertEqual(
+                await self.storage.get_state_from_fs(version),
+                self.state(version.version),
+            )
+        versions = await self.versions()
+        self.assertTrue(versions[0].state_location.endswith("/manifest.json"))
+        self.assertTrue(versions[2].state_location.startswith("cas/"))
+        self.assertFalse(list(self.bucket.objects.filter(Prefix="state/")))
+
+        report = await migrate_key_layout(self.sessions, self.storage, layout="sharded")
+        self.assertEqual(report.scanned, 0)
+
+    async def test_old_locations_resolve_after_the_move(self):
+        await self.setup_db()
+        stale = (await self.versions())[0]
+        await migrate_key_layout(
+            self.sessions, self.storage, layout="sharded", delete_old=True
+        )
+        # a request that read the version before it was repointed
+        self.assertTrue(stale.state_location.startswith("state/"))
+        self.assertEqual(await self.storage.get_state_from_fs(stale), self.state(1))
+        self.assertEqual(await self.storage.get_iac_from_fs(stale), b"iac")
+        download = await self.storage.open_iac(stale)
+        self.assertEqual(b"".join([c async for c in download.chunks]), b"iac")
+
+    async def test_dry_run_changes_nothing(self):
+        await self.setup_db()
+        keys = {o.key for o in self.bucket.objects.all()}
+        report = await migrate_key_layout(
+            self.sessions, self.storage, layout="sharded", dry_run=True
+        )
+        self.assertEqual((report.scanned, report.migrated), (3, 0))
+        self.assertEqual({o.key for o in self.bucket.objects.all()}, keys)
+        for version in await self.versions():
+            self.assertTrue(version.iac_location.startswith("state/"))
@@ -0,0 +1,104 @@
+import datetime
+
+import aiounittest
+import boto3
+import jsons
+from moto import mock_aws
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from src.engine_service.engine_commands.run import RunEngineResult
+from src.environment_management.models import (
+    Environment,
+    EnvironmentVersion,
+    ModelsBase,
+)
+from src.state_manager.architecture_storage import ArchitectureStorage
+from src.state_manager.migrate_state_format import migrate_state_format
+
+
+class TestMigrateStateFormat(aiounittest.AsyncTestCase):
+    def setUp(self):
+        self.mock_aws = mock_aws()
+        self.mock_aws.start()
+        s3 = boto3.resource("s3", region_name="us-east-1")
+        self.bucket = s3.create_bucket(Bucket="test-bucket")
+        self.storage = ArchitectureStorage(self.bucket)
+
+    def tearDown(self):
+        self.mock_aws.stop()
+
+    async def setup_db(self):
+        self.engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+        self.sessions = async_sessionmaker(self.engine)
+        async with self.engine.begin() as conn:
+            await conn.run_sync(ModelsBase.metadata.create_all)
+        async with self.sessions.begin() as session:
+            session.add(
+                Environment(architecture_id="arch", id="prod", current=3, tags={})
+            )
+            for version in range(1, 4):
+                location = f"state/arch/prod/{version}/state.json"
+                self.bucket.put_object(
+                    Key=location,
+                    Body=jsons.dumps(self.state(version)).encode(),
+                )
+                session.add(
+                    EnvironmentVersion(
+                        architecture_id="arch",
+                        id="prod",
+                        version=version,
+                        version_hash=f"hash-{version}",
+                        state_location=location,
+                        created_by="user:test",
+                        created_at=datetime.datetime.fromisoformat("2011-11-04"),
+                    )
+                )
+
+    @staticmethod
+    def state(version: int) -> RunEngineResult:
+        return RunEngineResult(
+            resources_yaml=f"resources {version}",
+            topology_yaml="topology",
+            iac_topology="iac",
+            config_errors=[{"resource": "aws:s3_bucket:bucket", "error": version}],
+        )
+
+    async def versions(self) -> list[EnvironmentVersion]:
+        async with self.sessions() as session:
+            return list(
+                (
+                    await session.execute(
+                        EnvironmentVersion.__table__.select().order_by("version")
+                    )
+                ).all()
+            )
+
+    async def test_migrates_and_repoints_versions(self):
+        await self.setup_db()
+        report = await migrate_state_format(
+            self.sessions, self.storage, batch_size=2, delete_legacy=True
+        )
+        self.assertEqual((report.scanned, report.migrated, report.failed), (3, 3, []))
+        for version in await self.versions():
+            self.assertTrue(version.state_location.endswith("/manifest.json"))
+            self.assertEqual(
+                await self.storage.get_state_from_fs(version),
+                self.state(version.version),
+            )
+        keys = [o.key for o in self.bucket.objects.all()]
+        self.assertFalse([k for k in keys if k.endswith("state.json")])
+
+    async def test_dry_run_changes_nothing(self):
+        await self.setup_db()
+        report = await migrate_state_format(self.sessions, self.storage, dry_run=True)
+        self.assertEqual((report.scanned, report.migrated), (3, 0))
+        for version in await self.versions():
+            self.assertTrue(version.state_location.endswith("/state.json"))
+        self.assertEqual(len(list(self.bucket.objects.all())), 3)
+
+    async def test_missing_object_is_reported(self):
+        await self.setup_db()
+        self.bucket.Object("state/arch/prod/2/state.json").delete()
+        report = await migrate_state_format(self.sessions, self.storage)
+        self.assertEqual(report.migrated, 2)
+        self.assertEqual(report.failed, ["state/arch/prod/2/state.json"])
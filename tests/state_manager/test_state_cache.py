@@ -0,0 +1,124 @@
+import tempfile
+from unittest import mock
+
+import aiounittest
+import boto3
+from moto import mock_aws
+
+from src.engine_service.engine_commands.run import RunEngineResult
+from src.engine_service.engine_commands.run_cache import result_size
+from src.environment_management.models import EnvironmentVersion
+from src.state_manager.architecture_storage import ArchitectureStorage
+from src.state_manager.state_cache import StateCache
+from src.util.cache import DiskCache, LRUCache
+from src.util.metrics import metrics
+
+
+class TestStateCache(aiounittest.AsyncTestCase):
+    state = RunEngineResult(
+        resources_yaml="resources", topology_yaml="topology", iac_topology="iac"
+    )
+
+    def test_key_depends_on_location_and_version_hash(self):
+        key = StateCache.key("state/a/b/1/state.json", "hash-1")
+        self.assertEqual(key, StateCache.key("state/a/b/1/state.json", "hash-1"))
+        self.assertNotEqual(key, StateCache.key("state/a/b/1/state.json", "hash-2"))
+        self.assertNotEqual(key, StateCache.key("state/a/b/2/state.json", "hash-1"))
+
+    async def test_memory_round_trip_and_eviction(self):
+        cache = StateCache(memory=LRUCache(result_size(self.state), sizeof=result_size))
+        await cache.put("a", self.state)
+        self.assertEqual(await cache.get("a"), self.state)
+        await cache.put("b", self.state)
+        self.assertIsNone(await cache.get("a"))
+        self.assertEqual(await cache.get("b"), self.state)
+        self.assertEqual(
+            metrics.gauge("state_cache_bytes", "").value, result_size(self.state)
+        )
+
+    async def test_disk_tier_populates_memory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            writer = StateCache(disk=DiskCache(directory))
+            await writer.put("a", self.state)
+            # another worker sharing the disk tier
+            reader = StateCache(
+                memory=LRUCache(1024 * 1024, sizeof=result_size),
+                disk=DiskCache(directory),
+            )
+            self.assertEqual(await reader.get("a"), self.state)
+            self.assertIn("a", reader.memory)
+            await reader.delete("a")
+            self.assertIsNone(await reader.get("a"))
+
+
+class TestArchitectureStorageStateCache(aiounittest.AsyncTestCase):
+    def setUp(self):
+        self.mock_aws = mock_aws()
+        self.mock_aws.start()
+        s3 = boto3.resource("s3", region_name="us-east-1")
+        self.bucket = s3.create_bucket(Bucket="test-bucket")
+        self.cache = StateCache(memory=LRUCache(1024 * 1024, sizeof=result_size))
+        self.arch_storage = ArchitectureStorage(self.bucket, state_cache=self.cache)
+        self.env = EnvironmentVersion(
+            architecture_id="test-architecture-id",
+            id="test-id",
+            version=1,
+            version_hash="test-hash",
+        )
+
+    def tearDown(self):
+        self.mock_aws.stop()
+
+    async def test_reads_through_cache(self):
+        self.env.state_location = await self.arch_storage.write_state_to_fs(
+            self.env,
+            RunEngineResult(
+                resources_yaml="resources", topology_yaml="topology", iac_topology="iac"
+            ),
+        )
+        with mock.patch(
+            "src.state_manager.architecture_storage.get_object",
+            side_effect=lambda obj: obj.get()["Body"].read(),
+        ) as get_object:
+            first = await self.arch_storage.get_state_from_fs(self.env)
+            reads = get_object.call_count
+            second = await self.arch_storage.get_state_from_fs(self.env)
+        self.assertEqual(first, second)
+        self.assertEqual(get_object.call_count, reads)
+
+    @mock.patch("src.state_manager.state_format.STATE_STORE", "version")
+    async def test_overwritten_version_is_not_served_stale(self):
+        self.env.state_location = await self.arch_storage.write_state_to_fs(
+            self.env,
+            RunEngineResult(resources_yaml="v1", topology_yaml="", iac_topology=""),
+        )
+        self.assertEqual(
+            (await self.arch_storage.get_state_from_fs(self.env)).resources_yaml, "v1"
+        )
+        # an overwriting run writes a new version with the same number and location
+        rewritten = EnvironmentVersion(
+            architecture_id="test-architecture-id",
+            id="test-id",
+            version=1,
+            version_hash="new-hash",
+        )
+        rewritten.state_location = await self.arch_storage.write_state_to_fs(
+            rewritten,
+            RunEngineResult(resources_yaml="v2", topology_yaml="", iac_topology=""),
+        )
+        self.assertEqual(rewritten.state_location, self.env.state_location)
+        self.assertEqual(
+            (await self.arch_storage.get_state_from_fs(rewritten)).resources_yaml,
+            "v2",
+        )
+
+    async def test_delete_evicts(self):
+        self.env.state_location = await self.arch_storage.write_state_to_fs(
+            self.env,
+            RunEngineResult(resources_yaml="v1", topology_yaml="", iac_topology=""),
+        )
+        await self.arch_storage.get_state_from_fs(self.env)
+        # one entry per part of the split state
+        self.assertEqual(len(self.cache.memory), 4)
+        await self.arch_storage.delete_state_from_fs(self.env)
+        self.assertEqual(len(self.cache.memory), 0)
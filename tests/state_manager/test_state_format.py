@@ -0,0 +1,169 @@
+import json
+import struct
+import zlib
+from unittest import mock
+
+import aiounittest
+import jsons
+
+from src.engine_service.engine_commands.run import RunEngineResult
+from src.state_manager.state_format import (
+    MAGIC,
+    StateFormatError,
+    alternate_keys,
+    apply_delta,
+    decode_chain,
+    decode_manifest,
+    decode_state,
+    encode_delta,
+    encode_manifest,
+    encode_state,
+    key_layout,
+    manifest_keys,
+    parse_version_path,
+    part_digest,
+    relocate_key,
+    state_file_name,
+    version_path,
+    version_paths,
+)
+
+
+class TestStateFormat(aiounittest.AsyncTestCase):
+    state = RunEngineResult(
+        resources_yaml="resources:\n  aws:s3_bucket:bucket:\n" * 100,
+        topology_yaml="provider: aws\nresources:\n  s3_bucket/bucket:\n" * 100,
+        iac_topology="iac_topology: ü",
+        config_errors=[{"resource": "aws:s3_bucket:bucket", "error": "invalid"}],
+    )
+
+    def test_binary_round_trip(self):
+        encoded = encode_state(self.state, state_format="binary")
+        self.assertTrue(encoded.startswith(MAGIC))
+        self.assertEqual(decode_state(encoded), self.state)
+        self.assertLess(len(encoded), len(jsons.dumps(self.state)))
+
+    def test_reads_legacy_json(self):
+        legacy = jsons.dumps(self.state)
+        self.assertEqual(decode_state(legacy), self.state)
+        self.assertEqual(decode_state(legacy.encode()), self.state)
+        # the key the reader used to expect
+        older = self.state._asdict()
+        older["config_errors_json"] = older.pop("config_errors")
+        self.assertEqual(decode_state(json.dumps(older)), self.state)
+
+    def test_json_to_binary_round_trip(self):
+        for legacy in (
+            jsons.dumps(self.state),
+            encode_state(self.state, state_format="json"),
+        ):
+            binary = encode_state(decode_state(legacy), state_format="binary")
+            self.assertEqual(decode_state(binary), self.state)
+            self.assertEqual(
+                decode_state(binary).config_errors, self.state.config_errors
+            )
+
+    def test_json_format(self):
+        encoded = encode_state(self.state, state_format="json")
+        self.assertEqual(encoded, bytes(jsons.dumps(self.state), "utf-8"))
+        self.assertEqual(state_file_name("json"), "state.json")
+        self.assertEqual(state_file_name("binary", "single"), "state.bin")
+        self.assertEqual(state_file_name("binary", "split"), "manifest.json")
+
+    def test_skips_unknown_sections(self):
+        sections = [("future", b"data"), ("resources_yaml", b"resources")]
+        body = b"".join(
+            struct.pack(">HI", len(name), len(data)) + name.encode() + data
+            for name, data in sections
+        )
+        raw = MAGIC + bytes([1, 1]) + zlib.compress(body)
+        self.assertEqual(
+            decode_state(raw),
+            RunEngineResult(
+                resources_yaml="resources", topology_yaml="", iac_topology=""
+            ),
+        )
+
+    def test_rejects_newer_versions_and_truncated_states(self):
+        encoded = encode_state(self.state, state_format="binary")
+        with self.assertRaises(StateFormatError):
+            decode_state(MAGIC + bytes([2, 1]) + encoded[6:])
+        truncated = MAGIC + bytes([1, 0]) + zlib.decompress(encoded[6:])[:-10]
+        with self.assertRaises(StateFormatError):
+            decode_state(truncated)
+
+    def test_delta_round_trip(self):
+        base = self.state.resources_yaml
+        for target in [
+            base.replace("bucket:\n", "bucket2:\n", 1),
+            base + "  aws:sqs_queue:queue:",
+            "",
+            "crlf\r\nlines\r\nno final newline",
+            base[: len(base) // 2],
+        ]:
+            delta = encode_delta(base, target)
+            self.assertEqual(apply_delta(base, delta), target)
+        small_change = encode_delta(base, base.replace("s3_bucket", "sqs_queue", 1))
+        self.assertLess(len(small_change), 100)
+
+    def test_decode_chain_checks_digest(self):
+        v1 = self.state.topology_yaml
+        v2 = v1 + "  lambda_function/fn:\n"
+        v3 = v2.replace("fn", "handler")
+        snapshot = encode_state(self.state, fields=["topology_yaml"])
+        deltas = [encode_delta(v1, v2), encode_delta(v2, v3)]
+        expected = self.state._replace(
+            resources_yaml="", iac_topology="", config_errors=[], topology_yaml=v3
+        )
+        digest = part_digest(expected, "topology_yaml")
+        self.assertEqual(
+            decode_chain("topology_yaml", snapshot, deltas, digest), expected
+        )
+        with self.assertRaises(StateFormatError):
+            decode_chain("topology_yaml", snapshot, deltas[:1], digest)
+        with self.assertRaises(StateFormatError):
+            apply_delta(v1, snapshot)
+
+    def test_manifest_versions(self):
+        full = {"resources_yaml": "cas/blobs/ab/abc"}
+        self.assertIn(b'"version": 1', encode_manifest(full))
+        chained = {
+            **full,
+            "topology_yaml": ["cas/blobs/cd/cde", "cas/deltas/ef/efg/cde"],
+        }
+        self.assertEqual(decode_manifest(encode_manifest(chained)), chained)
+        self.assertEqual(
+            manifest_keys(chained),
+            ["cas/blobs/ab/abc", "cas/blobs/cd/cde", "cas/deltas/ef/efg/cde"],
+        )
+
+    def test_key_layouts(self):
+        flat = version_path("arch", "prod", 3, layout="flat")
+        sharded = version_path("arch", "prod", 3, layout="sharded")
+        self.assertEqual(flat, "state/arch/prod/3")
+        self.assertRegex(sharded, r"^shards/[0-9a-f]{2}/arch/prod/3$")
+        # versions of one architecture spread over shards
+        self.assertGreater(
+            len({version_path("arch", "prod", v, layout="sharded") for v in range(20)}),
+            1,
+        )
+        with mock.patch("src.state_manager.state_format.STATE_KEY_LAYOUT", "sharded"):
+            self.assertEqual(version_path("arch", "prod", 3), sharded)
+            self.assertEqual(version_paths("arch", "prod", 3), [sharded, flat])
+        self.assertEqual(version_paths("arch", "prod", 3), [flat, sharded])
+        with self.assertRaises(StateFormatError):
+            version_path("arch", "prod", 3, layout="nested")
+
+        for path, layout in ((flat, "flat"), (sharded, "sharded")):
+            key = f"{path}/parts/resources_yaml.bin"
+            self.assertEqual(key_layout(key), layout)
+            self.assertEqual(parse_version_path(key), path)
+        self.assertIsNone(parse_version_path(flat))
+        self.assertIsNone(key_layout("cas/blobs/ab/abcd"))
+
+        self.assertEqual(
+            relocate_key(f"{flat}/iac.zip", "sharded"), f"{sharded}/iac.zip"
+        )
+        self.assertEqual(relocate_key(f"{sharded}/iac.zip", "flat"), f"{flat}/iac.zip")
+        self.assertEqual(alternate_keys(f"{flat}/iac.zip"), [f"{sharded}/iac.zip"])
+        self.assertEqual(alternate_keys("cas/blobs/ab/abcd"), [])
@@ -0,0 +1,249 @@
+import asyncio
+import datetime
+import tempfile
+from unittest import mock
+from datetime import timedelta
+
+import aiounittest
+import boto3
+from moto import mock_aws
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from src.engine_service.engine_commands.run import RunEngineResult
+from src.environment_management.models import (
+    Environment,
+    EnvironmentVersion,
+    ModelsBase,
+)
+from src.state_manager.architecture_storage import ArchitectureStorage
+from src.state_manager.state_gc import collect_periodically, collect_state_garbage
+from src.util.storage import LocalStorage
+
+
+class TestStateGarbageCollection(aiounittest.AsyncTestCase):
+    def setUp(self):
+        self.mock_aws = mock_aws()
+        self.mock_aws.start()
+        s3 = boto3.resource("s3", region_name="us-east-1")
+        self.bucket = s3.create_bucket(Bucket="test-bucket")
+        self.storage = ArchitectureStorage(self.bucket)
+
+    def tearDown(self):
+        self.mock_aws.stop()
+
+    async def setup_db(self):
+        engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+        self.sessions = async_sessionmaker(engine, expire_on_commit=False)
+        async with engine.begin() as conn:
+            await conn.run_sync(ModelsBase.metadata.create_all)
+        async with self.sessions.begin() as session:
+            session.add(Environment(architecture_id="arch", id="prod", current=1))
+
+    async def add_version(self, version: int, state: RunEngineResult):
+        ev = EnvironmentVersion(
+            architecture_id="arch",
+            id="prod",
+            version=version,
+            version_hash=f"hash-{version}",
+            created_by="user:test",
+            created_at=datetime.datetime.fromisoformat("2011-11-04"),
+        )
+        ev.state_location = await self.storage.write_state_to_fs(ev, state)
+        async with self.sessions.begin() as session:
+            session.add(ev)
+        return ev
+
+    async def test_collects_unreferenced_objects(self):
+        await self.setup_db()
+        live = await self.add_version(
+            1, RunEngineResult(resources_yaml="a", topology_yaml="t", iac_topology="i")
+        )
+        # written but never committed to a version, shares topology and iac parts with the live state
+        orphan = await self.storage.write_state_to_fs(
+            live,
+            RunEngineResult(resources_yaml="b", topology_yaml="t", iac_topology="i"),
+        )
+        before = {o.key for o in self.bucket.objects.all()}
+
+        report = await collect_state_garbage(
+            self.sessions, self.storage, grace_period=timedelta(0), dry_run=True
+        )
+        self.assertEqual((len(report.garbage), report.found), (2, 2))
+        self.assertIn(orphan, report.garbage)
+        self.assertEqual({o.key for o in self.bucket.objects.all()}, before)
+        garbage = set(report.garbage)
+
+        report = await collect_state_garbage(
+            self.sessions, self.storage, grace_period=timedelta(0)
+        )
+        self.assertEqual((report.found, report.deleted), (2, 2))
+        self.assertEqual({o.key for o in self.bucket.objects.all()}, before - garbage)
+        self.assertEqual(
+            (await self.storage.get_state_from_fs(live)).resources_yaml, "a"
+        )
+
+    async def test_grace_period_protects_recent_objects(self):
+        await self.setup_db()
+        ev = await self.add_version(
+            1, RunEngineResult(resources_yaml="a", topology_yaml="t", iac_topology="i")
+        )
+        await self.storage.write_state_to_fs(
+            ev, RunEngineResult(resources_yaml="b", topology_yaml="t", iac_topology="i")
+        )
+        report = await collect_state_garbage(
+            self.sessions, self.storage, grace_period=timedelta(hours=1)
+        )
+        self.assertEqual((report.found, report.deleted), (0, 0))
+
+    async def test_keeps_delta_chains(self):
+        await self.setup_db()
+        resources = "".join(f"  aws:s3_bucket:bucket{i}:\n" for i in range(100))
+        with mock.patch("src.state_manager.state_format.STATE_HISTORY", "delta"):
+            first = await self.add_version(
+                1,
+                RunEngineResult(
+                    resources_yaml=resources, topology_yaml="t", iac_topology="i"
+                ),
+            )
+            second = EnvironmentVersion(
+                architecture_id="arch",
+                id="prod",
+                version=2,
+                version_hash="hash-2",
+                created_by="user:test",
+                created_at=datetime.datetime.fromisoformat("2011-11-04"),
+            )
+            state = RunEngineResult(
+                resources_yaml=resources + "  queue:\n",
+                topology_yaml="t",
+                iac_topology="i",
+            )
+            second.state_location = await self.storage.write_state_to_fs(
+                second, state, base=first
+            )
+        async with self.sessions.begin() as session:
+            await session.delete(await session.merge(first))
+            session.add(second)
+
+        report = await collect_state_garbage(
+            self.sessions, self.storage, grace_period=timedelta(0)
+        )
+        # only the first manifest goes, the snapshot its resources are in is still the chain's base
+        self.assertEqual(report.deleted, 1)
+        self.assertEqual(await self.storage.get_state_from_fs(second), state)
+
+    async def test_collects_objects_of_deleted_versions(self):
+        await self.setup_db()
+        state = RunEngineResult(resources_yaml="a", topology_yaml="t", iac_topology="i")
+        with mock.patch("src.state_manager.state_format.STATE_STORE", "version"):
+            kept = await self.add_version(1, state)
+            deleted = await self.add_version(2, state._replace(resources_yaml="b"))
+        kept.iac_location = await self.storage.write_iac_to_fs(kept, b"iac")
+        deleted.iac_location = await self.storage.write_iac_to_fs(deleted, b"iac")
+        async with self.sessions.begin() as session:
+            await session.merge(kept)
+            await session.delete(await session.merge(deleted))
+        deleted_path = ArchitectureStorage.get_path_for_architecture(deleted)
+        orphans = {o.key for o in self.bucket.objects.filter(Prefix=deleted_path + "/")}
+        self.assertIn(deleted.iac_location, orphans)
+
+        report = await collect_state_garbage(
+            self.sessions, self.storage, grace_period=timedelta(0), dry_run=True
+        )
+        self.assertEqual(set(report.garbage), orphans)
+        self.assertGreater(report.garbage_bytes, 0)
+
+        with mock.patch("src.state_manager.state_gc.DELETE_BATCH_SIZE", 2), mock.patch(
+            "src.state_manager.state_gc.asyncio.sleep", new_callable=mock.AsyncMock
+        ) as sleep:
+            report = await collect_state_garbage(
+                self.sessions, self.storage, grace_period=timedelta(0), delete_rate=4
+            )
+        self.assertEqual(report.deleted, len(orphans))
+        # every batch after the first waits for the rate limit
+        self.assertEqual(sleep.await_count, (len(orphans) - 1) // 2)
+        sleep.assert_awaited_with(0.5)
+        self.assertFalse(list(self.bucket.objects.filter(Prefix=deleted_path + "/")))
+        self.assertEqual(await self.storage.get_state_from_fs(kept), state)
+        self.assertTrue(await self.storage.generated_iac_exists(kept))
+
+    async def test_keeps_objects_of_every_key_layout(self):
+        await self.setup_db()
+        state = RunEngineResult(resources_yaml="a", topology_yaml="t", iac_topology="i")
+        with mock.patch("src.state_manager.state_format.STATE_STORE", "version"):
+            flat = await self.add_version(1, state)
+            with mock.patch(
+                "src.state_manager.state_format.STATE_KEY_LAYOUT", "sharded"
+            ):
+                sharded = await self.add_version(2, state)
+                deleted = await self.add_version(3, state)
+                deleted_path = ArchitectureStorage.get_path_for_architecture(deleted)
+        self.assertTrue(flat.state_location.startswith("state/"))
+        self.assertTrue(sharded.state_location.startswith("shards/"))
+        # a layout migration copied the flat version's objects and has not repointed it yet
+        moved, _ = await self.storage.relocate(flat.state_location, "sharded")
+        async with self.sessions.begin() as session:
+            await session.delete(await session.merge(deleted))
+
+        report = await collect_state_garbage(
+            self.sessions, self.storage, grace_period=timedelta(0), dry_run=True
+        )
+        self.assertTrue(report.garbage)
+        self.assertTrue(all(k.startswith(deleted_path + "/") for k in report.garbage))
+        self.assertNotIn(moved, report.garbage)
+
+    async def test_streams_listings_and_versions_in_batches(self):
+        await self.setup_db()
+        state = RunEngineResult(resources_yaml="a", topology_yaml="t", iac_topology="i")
+        with mock.patch("src.state_manager.state_format.STATE_STORE", "version"):
+            kept = [await self.add_version(v, state) for v in range(1, 4)]
+            deleted = [await self.add_version(v, state) for v in range(4, 7)]
+        async with self.sessions.begin() as session:
+            for ev in deleted:
+                await session.delete(await session.merge(ev))
+        orphans = {
+            o.key
+            for ev in deleted
+            for o in self.bucket.objects.filter(
+                Prefix=ArchitectureStorage.get_path_for_architecture(ev) + "/"
+            )
+        }
+
+        with mock.patch("src.state_manager.state_gc.MARK_BATCH_SIZE", 2):
+            report = await collect_state_garbage(
+                self.sessions, self.storage, grace_period=timedelta(0)
+            )
+        self.assertEqual((report.found, report.deleted), (len(orphans), len(orphans)))
+        self.assertEqual(report.garbage, [])
+        for ev in kept:
+            self.assertEqual(await self.storage.get_state_from_fs(ev), state)
+
+    async def test_collects_periodically(self):
+        await self.setup_db()
+        with mock.patch(
+            "src.state_manager.state_gc.collect_state_garbage",
+            side_effect=[Exception("S3 is down"), mock.DEFAULT, mock.DEFAULT],
+        ) as collect, mock.patch(
+            "src.state_manager.state_gc.asyncio.sleep",
+            side_effect=[None, None, asyncio.CancelledError()],
+        ) as sleep:
+            with self.assertRaises(asyncio.CancelledError):
+                await collect_periodically(
+                    self.sessions, self.storage, 60, dry_run=True
+                )
+        # a failed collection does not stop the next ones
+        self.assertEqual(collect.call_count, 3)
+        collect.assert_called_with(self.sessions, self.storage, dry_run=True)
+        sleep.assert_awaited_with(60)
+
+
+class TestLocalStateGarbageCollection(TestStateGarbageCollection):
+    """The same collections against the local storage backend."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.bucket = LocalStorage(self.dir.name).Bucket("test-bucket")
+        self.storage = ArchitectureStorage(self.bucket)
+
+    def tearDown(self):
+        self.dir.cleanup()
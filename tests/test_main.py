@@ -0,0 +1,41 @@
+import json
+
+import aiounittest
+
+from src.backend_orchestrator.models import EnvironmentVersionNotLatestError
+from src.engine_service.scheduler import EngineOverloadedError
+from src.environment_management.environment_version import (
+    EnvironmentVersionReservedError,
+)
+from src.main import (
+    handle_engine_overloaded,
+    handle_version_not_latest,
+    handle_version_reserved,
+)
+
+
+class TestExceptionHandlers(aiounittest.AsyncTestCase):
+    async def test_engine_overloaded(self):
+        response = await handle_engine_overloaded(None, EngineOverloadedError(7))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "7")
+        self.assertEqual(
+            json.loads(response.body),
+            {"detail": "The engine is busy, please try again shortly"},
+        )
+
+    async def test_version_not_latest(self):
+        response = await handle_version_not_latest(
+            None, EnvironmentVersionNotLatestError()
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            json.loads(response.body),
+            {"detail": "Environment version is not the latest"},
+        )
+
+    async def test_version_reserved(self):
+        response = await handle_version_reserved(
+            None, EnvironmentVersionReservedError()
+        )
+        self.assertEqual(response.status_code, 409)
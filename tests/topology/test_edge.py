@@ -0,0 +1,27 @@
+import aiounittest
+
+from src.topology.edge import Edge
+from src.topology.resource import ResourceID
+
+
+class TestEdge(aiounittest.AsyncTestCase):
+    def test_from_string_shares_resource_ids(self):
+        edge = Edge.from_string(
+            "aws:lambda_function:lambda-0 -> aws:s3_bucket:bucket-0"
+        )
+        self.assertIs(
+            edge.source, ResourceID.from_string("aws:lambda_function:lambda-0")
+        )
+        self.assertEqual(
+            str(edge), "aws:lambda_function:lambda-0->aws:s3_bucket:bucket-0"
+        )
+
+    def test_replacing_endpoint_rehashes(self):
+        a = ResourceID("aws", "lambda_function", None, "a")
+        b = ResourceID("aws", "s3_bucket", None, "b")
+        c = ResourceID("aws", "s3_bucket", None, "c")
+        edge = Edge(a, b)
+        edge.target = c
+        self.assertEqual(hash(edge), hash(Edge(a, c)))
+        self.assertEqual(edge, Edge(a, c))
+        self.assertNotIn(Edge(a, b), {edge})
@@ -161,3 +161,30 @@ class TestResource(aiounittest.AsyncTestCase):
 
         differences = resource1.diff_properties(resource2)
         self.assertEqual(len(differences), 0)
+
+
+class TestResourceID(aiounittest.AsyncTestCase):
+    def test_from_string_interns(self):
+        id1 = ResourceID.from_string("aws:subnet:vpc-0:subnet-0")
+        id2 = ResourceID.from_string("aws:subnet:vpc-0:subnet-0")
+        self.assertIs(id1, id2)
+        self.assertEqual(id1.namespace, "vpc-0")
+        self.assertEqual(str(id1), "aws:subnet:vpc-0:subnet-0")
+
+    def test_equality_and_hash(self):
+        parsed = ResourceID.from_string("aws:lambda_function:lambda-0")
+        constructed = ResourceID("aws", "lambda_function", None, "lambda-0")
+        self.assertEqual(parsed, constructed)
+        self.assertEqual(hash(parsed), hash(constructed))
+        self.assertEqual(len({parsed, constructed}), 1)
+        self.assertNotEqual(
+            parsed, ResourceID("aws", "lambda_function", "ns", "lambda-0")
+        )
+        self.assertNotEqual(parsed, "aws:lambda_function:lambda-0")
+
+    def test_immutable(self):
+        id = ResourceID("aws", "vpc", None, "vpc-0")
+        with self.assertRaises(AttributeError):
+            id.name = "vpc-1"
+        with self.assertRaises(AttributeError):
+            id.extra = "value"
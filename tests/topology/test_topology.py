@@ -139,3 +139,47 @@ class TestTopology(aiounittest.AsyncTestCase):
             ),
         )
         self.assertEqual(len(diff_with_properties.edges), 0)
+
+    async def test_indexes(self):
+        a = ResourceID.from_string("aws:lambda_function:a")
+        b = ResourceID.from_string("aws:lambda_function:b")
+        c = ResourceID.from_string("aws:s3_bucket:c")
+        first_a = Resource(a, {"Memory": 128})
+        topology = Topology(
+            [first_a, Resource(b, {}), Resource(a, {"Memory": 256})],
+            [Edge(a, c), Edge(b, c)],
+        )
+        self.assertIs(topology.get_resource(a), first_a)
+        self.assertIsNone(topology.get_resource(c))
+        self.assertTrue(topology.has_resource(ResourceID.from_string(str(b))))
+        self.assertTrue(topology.has_edge(Edge(a, c)))
+        self.assertFalse(topology.has_edge(Edge(c, a)))
+        self.assertEqual(topology.downstream(a), {c})
+        self.assertEqual(topology.upstream(c), {a, b})
+        self.assertEqual(topology.upstream(a), set())
+
+        topology.add_resource(Resource(c, {}))
+        topology.add_edge(Edge(c, a))
+        self.assertTrue(topology.has_resource(c))
+        self.assertEqual(topology.downstream(c), {a})
+        self.assertEqual(len(topology.resources), 4)
+        self.assertEqual(len(topology.edges), 3)
+
+    async def test_diff_topology_large(self):
+        ids = [
+            ResourceID("aws", "lambda_function", None, f"fn-{i}") for i in range(2000)
+        ]
+        previous = Topology(
+            [Resource(id, {"i": i}) for i, id in enumerate(ids[:1500])],
+            [Edge(ids[i], ids[i + 1]) for i in range(1499)],
+        )
+        current = Topology(
+            [Resource(id, {"i": i}) for i, id in enumerate(ids[500:], start=500)],
+            [Edge(ids[i], ids[i + 1]) for i in range(500, 1999)],
+        )
+        diff = previous.diff_topology(current, include_properties_diff=True)
+        statuses = [d.status for d in diff.resources.values()]
+        self.assertEqual(statuses.count(DiffStatus.ADDED), 500)
+        self.assertEqual(statuses.count(DiffStatus.REMOVED), 500)
+        self.assertEqual(statuses.count(DiffStatus.CHANGED), 0)
+        self.assertEqual(len(diff.edges), 1000)
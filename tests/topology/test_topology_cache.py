@@ -0,0 +1,64 @@
+import aiounittest
+import yaml
+
+from src.topology.resource import ResourceID
+from src.topology.topology_cache import TopologyCache
+from src.util.yaml_loader import safe_load
+
+RESOURCES_YAML = """resources:
+  aws:lambda_function:lambda_function_0:
+    MemorySize: 128
+  aws:s3_bucket:bucket:
+edges:
+  aws:lambda_function:lambda_function_0 -> aws:s3_bucket:bucket:
+"""
+
+TOPOLOGY_YAML = """provider: aws
+resources:
+  lambda_function/lambda_function_0:
+  s3_bucket/bucket:
+  lambda_function/lambda_function_0 -> s3_bucket/bucket:
+"""
+
+
+class TestTopologyCache(aiounittest.AsyncTestCase):
+    def test_reuses_parsed_topology(self):
+        cache = TopologyCache(max_bytes=1024 * 1024)
+        first = cache.from_string(RESOURCES_YAML)
+        self.assertIs(cache.from_string(RESOURCES_YAML), first)
+        self.assertTrue(
+            first.has_resource(ResourceID.from_string("aws:s3_bucket:bucket"))
+        )
+        self.assertEqual(len(first.edges), 1)
+
+    def test_kinds_are_cached_separately(self):
+        cache = TopologyCache(max_bytes=1024 * 1024)
+        resources = cache.from_string(RESOURCES_YAML)
+        topology = cache.from_topology_yaml(TOPOLOGY_YAML)
+        self.assertIsNot(resources, topology)
+        self.assertIs(cache.from_topology_yaml(TOPOLOGY_YAML), topology)
+        self.assertEqual(
+            [str(r.id) for r in topology.resources],
+            ["aws:lambda_function:lambda_function_0", "aws:s3_bucket:bucket"],
+        )
+        self.assertEqual(len(cache), 2)
+
+    def test_changed_content_is_reparsed(self):
+        cache = TopologyCache(max_bytes=1024 * 1024)
+        first = cache.from_string(RESOURCES_YAML)
+        second = cache.from_string(RESOURCES_YAML.replace("128", "256"))
+        self.assertIsNot(first, second)
+
+    def test_disabled(self):
+        cache = TopologyCache(max_bytes=0)
+        self.assertIsNot(
+            cache.from_string(RESOURCES_YAML), cache.from_string(RESOURCES_YAML)
+        )
+        self.assertEqual(len(cache), 0)
+
+    def test_empty_yaml(self):
+        cache = TopologyCache(max_bytes=1024 * 1024)
+        self.assertEqual(cache.from_string("").resources, [])
+
+    def test_fast_loader_matches_safe_load(self):
+        self.assertEqual(safe_load(RESOURCES_YAML), yaml.safe_load(RESOURCES_YAML))
@@ -0,0 +1,53 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import aiounittest
+import boto3
+from moto import mock_aws
+
+from src.util.aws.s3_clients import S3ClientRegistry, s3_client_config
+
+
+class TestS3ClientRegistry(aiounittest.AsyncTestCase):
+    def test_one_resource_per_bucket(self):
+        factory = mock.Mock(side_effect=lambda: mock.Mock())
+        registry = S3ClientRegistry(factory)
+        first = registry.bucket("a")
+        self.assertIs(registry.bucket("a"), first)
+        self.assertIsNot(registry.bucket("b"), first)
+        self.assertEqual(factory.call_count, 2)
+
+    def test_concurrent_first_use_creates_once(self):
+        factory = mock.Mock(side_effect=lambda: mock.Mock())
+        registry = S3ClientRegistry(factory)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            buckets = list(pool.map(lambda _: registry.bucket("a"), range(32)))
+        self.assertTrue(all(b is buckets[0] for b in buckets))
+        factory.assert_called_once()
+
+    def test_warm_and_clear(self):
+        factory = mock.Mock(side_effect=lambda: mock.Mock())
+        registry = S3ClientRegistry(factory)
+        registry.warm("a", "b")
+        self.assertEqual(factory.call_count, 2)
+        registry.clear()
+        registry.bucket("a")
+        self.assertEqual(factory.call_count, 3)
+
+    @mock_aws
+    def test_buckets_use_tuned_config(self):
+        registry = S3ClientRegistry(
+            lambda: boto3.session.Session().resource(
+                "s3", region_name="us-east-1", config=s3_client_config()
+            )
+        )
+        bucket = registry.bucket("mybucket")
+        bucket.create()
+        bucket.put_object(Key="key", Body=b"value")
+        self.assertEqual(bucket.Object("key").get()["Body"].read(), b"value")
+        config = bucket.meta.client.meta.config
+        self.assertEqual(
+            config.max_pool_connections, s3_client_config().max_pool_connections
+        )
+        self.assertTrue(config.tcp_keepalive)
+        self.assertEqual(config.retries["mode"], "standard")
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+
+from src.util.cache import DiskCache, LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_evicts_least_recently_used_over_budget(self):
+        cache = LRUCache(max_bytes=10)
+        cache.put("a", b"aaaa")
+        cache.put("b", b"bbbb")
+        self.assertEqual(cache.get("a"), b"aaaa")
+        cache.put("c", b"cccc")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), b"aaaa")
+        self.assertEqual(cache.get("c"), b"cccc")
+        self.assertEqual(cache.size_bytes, 8)
+
+    def test_does_not_cache_values_over_budget(self):
+        cache = LRUCache(max_bytes=2)
+        cache.put("a", b"aaaa")
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.size_bytes, 0)
+
+    def test_replacing_value_updates_size(self):
+        cache = LRUCache(max_bytes=10)
+        cache.put("a", b"aaaa")
+        cache.put("a", b"aa")
+        self.assertEqual(cache.size_bytes, 2)
+        cache.delete("a")
+        self.assertEqual(cache.size_bytes, 0)
+        self.assertEqual(len(cache), 0)
+
+
+class TestDiskCache(unittest.TestCase):
+    def test_put_get_delete(self):
+        with tempfile.TemporaryDirectory() as root:
+            cache = DiskCache(root)
+            self.assertIsNone(cache.get("abcdef"))
+            cache.put("abcdef", b"value")
+            self.assertEqual(cache.get("abcdef"), b"value")
+            self.assertEqual(DiskCache(root).get("abcdef"), b"value")
+            cache.delete("abcdef")
+            self.assertIsNone(cache.get("abcdef"))
+
+    def test_clear(self):
+        with tempfile.TemporaryDirectory() as root:
+            cache = DiskCache(root)
+            cache.put("abcdef", b"value")
+            cache.put("123456", b"value")
+            cache.clear()
+            self.assertIsNone(cache.get("abcdef"))
+            self.assertIsNone(cache.get("123456"))
+
+    def test_evicts_least_recently_used_entries(self):
+        with tempfile.TemporaryDirectory() as root:
+            cache = DiskCache(root, max_bytes=30)
+            for i, key in enumerate(["aaaa", "bbbb", "cccc"]):
+                cache.put(key, b"x" * 10)
+                os.utime(cache._path(key), (1000 + i, 1000 + i))
+            # a hit makes aaaa the most recently used entry
+            self.assertEqual(cache.get("aaaa"), b"x" * 10)
+            cache.put("dddd", b"x" * 10)
+            self.assertIsNone(cache.get("bbbb"))
+            self.assertIsNone(cache.get("cccc"))
+            for key in ("aaaa", "dddd"):
+                self.assertEqual(cache.get(key), b"x" * 10)
+
+    def test_counts_entries_written_by_other_processes(self):
+        with tempfile.TemporaryDirectory() as root:
+            DiskCache(root).put("aaaa", b"x" * 20)
+            os.utime(os.path.join(root, "aa", "aaaa"), (1000, 1000))
+            cache = DiskCache(root, max_bytes=30)
+            cache.put("bbbb", b"x" * 20)
+            self.assertIsNone(cache.get("aaaa"))
+            self.assertEqual(cache.get("bbbb"), b"x" * 20)
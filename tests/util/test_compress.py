@@ -0,0 +1,49 @@
+import os
+import tempfile
+import zipfile
+from io import BytesIO
+from unittest import TestCase
+
+from src.util.compress import zip_directory_recurse
+
+
+class TestZipDirectoryRecurse(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        root = self.temp_dir.name
+        os.makedirs(os.path.join(root, "src"))
+        os.makedirs(os.path.join(root, "secrets"))
+        with open(os.path.join(root, "index.ts"), "w") as f:
+            f.write("index" * 1000)
+        with open(os.path.join(root, "src", "logo.png"), "wb") as f:
+            f.write(os.urandom(1024))
+        with open(os.path.join(root, "secrets", "key"), "w") as f:
+            f.write("secret")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_zips_directory_without_secrets(self):
+        out = BytesIO()
+        zip_directory_recurse(out, self.temp_dir.name)
+        with zipfile.ZipFile(out) as z:
+            self.assertEqual(sorted(z.namelist()), ["index.ts", "src/logo.png"])
+            self.assertEqual(z.read("index.ts"), b"index" * 1000)
+
+    def test_stores_already_compressed_files(self):
+        out = BytesIO()
+        zip_directory_recurse(out, self.temp_dir.name)
+        with zipfile.ZipFile(out) as z:
+            self.assertEqual(z.getinfo("index.ts").compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(
+                z.getinfo("src/logo.png").compress_type, zipfile.ZIP_STORED
+            )
+
+    def test_custom_stored_suffixes(self):
+        out = BytesIO()
+        zip_directory_recurse(out, self.temp_dir.name, stored_suffixes=[".TS"])
+        with zipfile.ZipFile(out) as z:
+            self.assertEqual(z.getinfo("index.ts").compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(
+                z.getinfo("src/logo.png").compress_type, zipfile.ZIP_DEFLATED
+            )
@@ -0,0 +1,19 @@
+import unittest
+
+from src.util.metrics import MetricsRegistry
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def test_series_share_a_metric(self):
+        registry = MetricsRegistry()
+        registry.counter("requests_total", "Requests", route="a").inc()
+        registry.counter("requests_total", "Requests", route="a").inc(2)
+        registry.counter("requests_total", "Requests", route="b").inc()
+        self.assertEqual(registry.counter("requests_total", route="a").value, 3)
+        self.assertEqual(registry.counter("requests_total", route="b").value, 1)
+
+    def test_kind_conflict_names_the_registered_kind(self):
+        registry = MetricsRegistry()
+        registry.counter("requests_total")
+        with self.assertRaisesRegex(ValueError, "already registered as a counter"):
+            registry.gauge("requests_total")
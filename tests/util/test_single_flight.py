@@ -0,0 +1,109 @@
+import asyncio
+import tempfile
+from unittest import mock
+
+import aiounittest
+
+from src.util.single_flight import FileLock, PostgresAdvisoryLock, SingleFlight
+
+
+class TestSingleFlight(aiounittest.AsyncTestCase):
+    async def test_concurrent_calls_share_one_execution(self):
+        flight = SingleFlight("test")
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "result"
+
+        results = await asyncio.gather(*[flight.do("key", work) for _ in range(5)])
+        self.assertEqual(results, ["result"] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertFalse(flight.in_flight("key"))
+
+    async def test_different_keys_run_separately(self):
+        flight = SingleFlight("test")
+        results = await asyncio.gather(
+            flight.do("a", lambda: asyncio.sleep(0.01, result="a")),
+            flight.do("b", lambda: asyncio.sleep(0.01, result="b")),
+        )
+        self.assertEqual(results, ["a", "b"])
+
+    async def test_exception_is_shared_and_not_cached(self):
+        flight = SingleFlight("test")
+        calls = []
+
+        async def fail():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(
+            flight.do("key", fail), flight.do("key", fail), return_exceptions=True
+        )
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+        self.assertEqual(len(calls), 1)
+        with self.assertRaises(ValueError):
+            await flight.do("key", fail)
+        self.assertEqual(len(calls), 2)
+
+    async def test_cancelled_caller_does_not_cancel_others(self):
+        flight = SingleFlight("test")
+        first = asyncio.create_task(
+            flight.do("key", lambda: asyncio.sleep(0.05, result="done"))
+        )
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(
+            flight.do("key", lambda: asyncio.sleep(0, result="other"))
+        )
+        await asyncio.sleep(0.01)
+        first.cancel()
+        self.assertEqual(await second, "done")
+
+    async def test_lock_serializes_flights_across_instances(self):
+        with tempfile.TemporaryDirectory() as directory:
+            lock = FileLock(directory)
+            # separate instances stand in for separate workers
+            flights = [SingleFlight("test", lock), SingleFlight("test", lock)]
+            store = {}
+            calls = []
+
+            async def work():
+                if "key" in store:
+                    return store["key"]
+                calls.append(1)
+                await asyncio.sleep(0.05)
+                store["key"] = "result"
+                return "result"
+
+            results = await asyncio.gather(*[f.do("key", work) for f in flights])
+            self.assertEqual(results, ["result", "result"])
+            self.assertEqual(len(calls), 1)
+
+    async def test_postgres_lock_waiters_release_their_connection(self):
+        attempts = []
+
+        def connect():
+            conn = mock.AsyncMock()
+            result = mock.Mock()
+            # the lock is taken on the third attempt
+            result.scalar.return_value = len(attempts) == 2
+            conn.execute.return_value = result
+            attempts.append(conn)
+            return conn
+
+        engine = mock.Mock(connect=mock.AsyncMock(side_effect=connect))
+        with mock.patch("src.util.single_flight.LOCK_POLL_INTERVAL", 0.001):
+            async with PostgresAdvisoryLock(engine)("key"):
+                self.assertEqual(len(attempts), 3)
+                # connections of failed attempts went back to the pool while waiting
+                for conn in attempts[:2]:
+                    conn.close.assert_awaited_once()
+                attempts[2].close.assert_not_awaited()
+        attempts[2].close.assert_awaited_once()
+        statements = [str(c.args[0]) for c in attempts[2].execute.call_args_list]
+        self.assertEqual(
+            statements,
+            ["SELECT pg_try_advisory_lock(:id)", "SELECT pg_advisory_unlock(:id)"],
+        )
@@ -0,0 +1,198 @@
+import gc
+import os
+import tempfile
+import time
+import warnings
+from datetime import timedelta
+from io import BytesIO
+from unittest import mock
+
+import aiounittest
+from botocore.exceptions import ClientError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from src.engine_service.engine_commands.run import RunEngineResult
+from src.environment_management.models import (
+    Environment,
+    EnvironmentVersion,
+    ModelsBase,
+)
+from src.state_manager.architecture_storage import (
+    ArchitectureStateDoesNotExistError,
+    ArchitectureStorage,
+)
+from src.state_manager.state_gc import collect_state_garbage
+from src.util.aws.s3 import delete_objects, get_object, put_object
+from src.util.storage import LocalBody, LocalStorage
+
+
+class TestLocalStorage(aiounittest.AsyncTestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.bucket = LocalStorage(self.dir.name).Bucket("test-bucket")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_round_trip(self):
+        obj = self.bucket.Object("state/arch/env/1/state.bin")
+        put_object(obj, b"state")
+        self.assertEqual(get_object(self.bucket.Object(obj.key)), b"state")
+        self.assertEqual(obj.size, 5)
+        # sharded by the hash of the key, no temporary files are left behind
+        path = self.bucket.path(obj.key)
+        self.assertEqual(len(path.relative_to(self.bucket.root).parts), 3)
+        self.assertEqual(os.listdir(path.parent), [path.name])
+
+    def test_missing_objects(self):
+        obj = self.bucket.Object("missing")
+        with self.assertRaises(ClientError) as e:
+            obj.load()
+        self.assertEqual(e.exception.response["Error"]["Code"], "404")
+        with self.assertRaises(ClientError) as e:
+            obj.get()
+        self.assertEqual(e.exception.response["Error"]["Code"], "NoSuchKey")
+
+    def test_list_and_delete(self):
+        for key in ["cas/b", "cas/a", "state/a", "cas/c"]:
+            self.bucket.Object(key).put(Body=key)
+        self.assertEqual(
+            [o.key for o in self.bucket.objects.filter(Prefix="cas/")],
+            ["cas/a", "cas/b", "cas/c"],
+        )
+        response = delete_objects(self.bucket, ["cas/a", "cas/b"])
+        self.assertEqual(len(response["Deleted"]), 2)
+        self.bucket.objects.filter(Prefix="state/").delete()
+        self.assertEqual([o.key for o in self.bucket.objects.all()], ["cas/c"])
+
+    def test_pages(self):
+        for key in ("state/a", "state/b", "state/c", "cas/d"):
+            self.bucket.Object(key).put(Body=b"x")
+        pages = self.bucket.objects.filter(Prefix="state/").page_size(2).pages()
+        self.assertEqual(
+            [[o.key for o in page] for page in pages],
+            [["state/a", "state/b"], ["state/c"]],
+        )
+
+    def test_failed_write_keeps_previous_object(self):
+        obj = self.bucket.Object("key")
+        obj.put(Body=b"old")
+        body = mock.Mock()
+        body.read.side_effect = IOError("connection reset")
+        with self.assertRaises(IOError):
+            obj.put(Body=body)
+        self.assertEqual(get_object(obj), b"old")
+        self.assertEqual(len(os.listdir(self.bucket.path("key").parent)), 1)
+
+    def test_memory_mapped_reads(self):
+        data = os.urandom(1000)
+        obj = self.bucket.Object("iac.zip")
+        obj.upload_fileobj(BytesIO(data))
+        with mock.patch("src.util.storage.LOCAL_STORAGE_MMAP_THRESHOLD", 100):
+            body = obj.get()["Body"]
+            self.assertIsNotNone(body._map)
+            chunks = list(body.iter_chunks(300))
+            body.close()
+        self.assertEqual([len(c) for c in chunks], [300, 300, 300, 100])
+        self.assertEqual(b"".join(chunks), data)
+
+    def test_reading_to_the_end_closes_the_file(self):
+        data = os.urandom(1000)
+        obj = self.bucket.Object("iac.zip")
+        obj.put(Body=data)
+        for threshold in (10000, 100):
+            with mock.patch("src.util.storage.LOCAL_STORAGE_MMAP_THRESHOLD", threshold):
+                body = obj.get()["Body"]
+                self.assertEqual(body.read(600), data[:600])
+                self.assertFalse(body._file.closed)
+                self.assertEqual(body.read(), data[600:])
+                self.assertTrue(body._file.closed)
+                self.assertIsNone(body._map)
+                self.assertEqual(body.read(), b"")
+                body.close()
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always", ResourceWarning)
+            with mock.patch.object(
+                LocalBody, "close", autospec=True, side_effect=LocalBody.close
+            ) as close:
+                self.assertEqual(get_object(obj), data)
+            close.assert_called()
+            gc.collect()
+        self.assertEqual([w for w in caught if w.category is ResourceWarning], [])
+
+    def test_ranges(self):
+        data = bytes(range(100))
+        obj = self.bucket.Object("iac.zip")
+        obj.put(Body=data)
+        for threshold in (1000, 10):
+            with mock.patch("src.util.storage.LOCAL_STORAGE_MMAP_THRESHOLD", threshold):
+                for header, expected, content_range in [
+                    ("bytes=10-19", data[10:20], "bytes 10-19/100"),
+                    ("bytes=90-", data[90:], "bytes 90-99/100"),
+                    ("bytes=-5", data[95:], "bytes 95-99/100"),
+                    ("bytes=95-200", data[95:], "bytes 95-99/100"),
+                ]:
+                    response = obj.get(Range=header)
+                    self.assertEqual(response["Body"].read(), expected)
+                    self.assertEqual(response["ContentLength"], len(expected))
+                    self.assertEqual(response["ContentRange"], content_range)
+                    response["Body"].close()
+        response = obj.get(Range="items=0-1")
+        self.assertNotIn("ContentRange", response)
+        response["Body"].close()
+        with self.assertRaises(ClientError) as e:
+            obj.get(Range="bytes=100-")
+        self.assertEqual(e.exception.response["Error"]["Code"], "InvalidRange")
+
+    def test_copy_onto_itself_refreshes(self):
+        obj = self.bucket.Object("key")
+        obj.put(Body=b"data")
+        old = time.time() - 3600
+        os.utime(self.bucket.path("key"), (old, old))
+        obj.load()
+        before = obj.last_modified
+        obj.copy_from(CopySource={"Bucket": "test-bucket", "Key": "key"})
+        self.assertGreater(obj.last_modified, before)
+        self.assertEqual(get_object(obj), b"data")
+
+    async def test_architecture_storage(self):
+        storage = ArchitectureStorage(self.bucket)
+        ev = EnvironmentVersion(
+            architecture_id="arch", id="env", version=1, version_hash="hash"
+        )
+        state = RunEngineResult(
+            resources_yaml="resources", topology_yaml="topology", iac_topology="iac"
+        )
+        ev.state_location = await storage.write_state_to_fs(ev, state)
+        self.assertEqual(await storage.get_state_from_fs(ev), state)
+        ev.iac_location = await storage.write_iac_to_fs(ev, BytesIO(b"iac" * 100))
+        stream = await storage.get_iac_stream(ev, chunk_size=100)
+        self.assertEqual(b"".join([c async for c in stream]), b"iac" * 100)
+        await storage.delete_state_from_fs(ev)
+        with self.assertRaises(ArchitectureStateDoesNotExistError):
+            await storage.get_iac_stream(ev)
+
+    async def test_state_gc(self):
+        engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+        async with engine.begin() as conn:
+            await conn.run_sync(ModelsBase.metadata.create_all)
+        storage = ArchitectureStorage(self.bucket)
+        ev = EnvironmentVersion(architecture_id="arch", id="prod", version=1)
+        state = RunEngineResult(resources_yaml="a", topology_yaml="t", iac_topology="i")
+        orphan = await storage.write_state_to_fs(ev, state._replace(resources_yaml="b"))
+        ev.state_location = await storage.write_state_to_fs(ev, state)
+        ev.version_hash, ev.created_by = "hash", "user:test"
+        sessions = async_sessionmaker(engine, expire_on_commit=False)
+        async with sessions.begin() as session:
+            session.add(Environment(architecture_id="arch", id="prod", current=1))
+            session.add(ev)
+        try:
+            report = await collect_state_garbage(
+                sessions, storage, grace_period=timedelta(0)
+            )
+        finally:
+            await engine.dispose()
+        # the orphan's manifest and its resources part, the other parts are shared
+        self.assertEqual((report.found, report.deleted), (2, 2))
+        self.assertNotIn(orphan, [o.key for o in self.bucket.objects.all()])
+        self.assertEqual(await storage.get_state_from_fs(ev), state)